@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import numpy as np
+from config import Config
+import metrics
+
+
+class AnswerCache:
+    """質問の埋め込みの類似度で引く回答キャッシュ
+
+    (質問の埋め込み, 回答, 出典, コーパスのバージョン) を保持し、新しい質問の埋め込みと
+    コサイン類似度が threshold 以上のエントリが同じバージョンにあれば、その回答を返します。
+    文書の追加・削除でコーパスのバージョンが変わると古いエントリは使われずに破棄されます。
+    エントリは ttl 秒で失効し、max_size 件を超えた分は最も長く使われていない順に追い出します。
+    """
+
+    def __init__(self, max_size: int = Config.ANSWER_CACHE_SIZE, ttl: float = Config.ANSWER_CACHE_TTL,
+                 threshold: float = Config.ANSWER_CACHE_THRESHOLD):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+        # 類似度計算用に全エントリのベクトルを並べた行列（変更があるまで使い回す）
+        self._keys: List[int] = []
+        self._matrix: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(query_vector) -> Optional[np.ndarray]:
+        vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            # ダミーのゼロベクトルでは類似度が定義できないため扱わない
+            return None
+        return vector / norm
+
+    def _discard(self, key: int):
+        """エントリを削除します（ロックを保持した状態で呼び出します）"""
+        del self._entries[key]
+        self._matrix = None
+
+    def _purge(self, corpus_version):
+        """失効したエントリと、バージョンの異なるエントリを取り除きます"""
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items()
+                    if entry["expires_at"] <= now or entry["corpus_version"] != corpus_version]:
+            self._discard(key)
+
+    def get(self, query_vector, corpus_version, variant: Any = None) -> Optional[Dict[str, Any]]:
+        """類似した質問の回答があれば {answer, sources, similarity} を返します（無ければ None）"""
+        vector = self._normalize(query_vector)
+        if vector is None or corpus_version is None:
+            return None
+
+        with self._lock:
+            self._purge(corpus_version)
+            if not self._entries:
+                self.misses += 1
+                metrics.CACHE_REQUESTS.labels("answer", "miss").inc()
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.stack([self._entries[key]["vector"] for key in self._keys])
+
+            similarities = self._matrix @ vector
+            for position in np.argsort(-similarities):
+                if similarities[position] < self.threshold:
+                    break
+                key = self._keys[position]
+                entry = self._entries[key]
+                if entry["variant"] != variant:
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.CACHE_REQUESTS.labels("answer", "hit").inc()
+                return {
+                    "answer": entry["answer"],
+                    "sources": entry["sources"],
+                    "similarity": float(similarities[position]),
+                }
+            self.misses += 1
+            metrics.CACHE_REQUESTS.labels("answer", "miss").inc()
+            return None
+
+    def put(self, query_vector, corpus_version, answer: str, sources: List[Dict[str, Any]], variant: Any = None):
+        """回答を登録し、上限を超えた分を古い順に追い出します"""
+        vector = self._normalize(query_vector)
+        if vector is None or corpus_version is None:
+            return
+
+        with self._lock:
+            self._entries[self._next_key] = {
+                "vector": vector,
+                "answer": answer,
+                "sources": sources,
+                "corpus_version": corpus_version,
+                "variant": variant,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._next_key += 1
+            self._matrix = None
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def clear(self):
+        """すべてのエントリを破棄します"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        """ヒット・ミスの件数とヒット率を返します"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
@@ -0,0 +1,160 @@
+"""
+RAGシステムの ASGI エントリーポイント
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+    gunicorn asgi_app:app -c gunicorn.conf.py --workers 2 --worker-class uvicorn.workers.UvicornWorker
+
+/api/query と /api/query/stream は AsyncRAGSystem でイベントループ上で処理します
+（埋め込み・DB・回答生成の待ちでスレッドを使わないため、1プロセスで数百件の質問を同時に処理できます）。
+それ以外のルートは create_app() の Flask アプリにそのまま渡します（リクエストごとにスレッドで実行されます）。
+要求・応答の形式は web_app と同じです。RAGSystem は Flask アプリと共有します。
+"""
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+import metrics
+import rag_system
+from async_rag import AsyncRAGSystem
+from config import Config
+from web_app import (STREAM_HEADERS, create_app, format_stream_event, parse_filters, parse_search_options,
+                     query_response_body, timings_requested)
+
+logger = logging.getLogger(__name__)
+
+QUERY_ROUTE = "/api/query"
+STREAM_ROUTE = "/api/query/stream"
+
+def _create_rag() -> Optional[AsyncRAGSystem]:
+    """web_app の get_rag_instance と同じ条件で RAG システムを作ります（作れない場合は None）"""
+    if not Config.GOOGLE_API_KEY and Config.uses_gemini():
+        logger.error("GOOGLE_API_KEYが設定されていません")
+        return None
+    try:
+        return AsyncRAGSystem(rag_system.RAGSystem(Config.GOOGLE_API_KEY))
+    except Exception:
+        logger.exception("RAGシステムの初期化に失敗しました")
+        return None
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return body
+
+async def _send_json(send, status: int, body: Dict[str, Any]):
+    payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]})
+    await send({"type": "http.response.body", "body": payload})
+
+def create_asgi_app(rag: AsyncRAGSystem = None, flask_app=None):
+    """ASGI アプリケーションを作ります（rag を省略すると設定から作ります）"""
+    rag = rag or _create_rag()
+    flask_app = flask_app or create_app(rag=rag.rag if rag else None)
+    wsgi = WsgiToAsgi(flask_app)
+
+    async def parse_query_request(scope, receive, send):
+        """質問のリクエストを検証し、(データ, 検索オプション, 絞り込み) を返します（不正なら応答済みで None）"""
+        if rag is None:
+            await _send_json(send, 500, {'success': False, 'error': 'RAGシステムが初期化されていません'})
+            return None
+        try:
+            data = json.loads(await _read_body(receive) or b"null")
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'question' not in data:
+            await _send_json(send, 400, {'success': False, 'error': '質問が指定されていません'})
+            return None
+        try:
+            return data, parse_search_options(data.get('search')), parse_filters(data.get('filters'))
+        except ValueError as e:
+            await _send_json(send, 400, {'success': False, 'error': str(e)})
+            return None
+
+    async def query(scope, receive, send):
+        """質問に対する回答を生成（web_app の /api/query と同じ）"""
+        parsed = await parse_query_request(scope, receive, send)
+        if parsed is None:
+            return
+        data, search_options, filters = parsed
+        try:
+            result = await rag.aquery(data['question'], search_options=search_options, filters=filters)
+        except Exception as e:
+            logger.exception("クエリエラー", extra={'route': scope['path']})
+            await _send_json(send, 500, {'success': False, 'error': f'質問の処理に失敗しました: {str(e)}'})
+            return
+        body = query_response_body(data['question'], result)
+        headers = Headers([(key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"]])
+        if timings_requested(data, headers):
+            body['timings'] = result.get('timings')
+            logger.info("クエリの処理時間", extra={'route': scope['path'], 'timings': body['timings']})
+        await _send_json(send, 200, body)
+
+    async def query_stream(scope, receive, send):
+        """質問に対する回答を Server-Sent Events で逐次返す（web_app の /api/query/stream と同じ）"""
+        parsed = await parse_query_request(scope, receive, send)
+        if parsed is None:
+            return
+        data, search_options, filters = parsed
+        question = data['question']
+        headers = [(b"content-type", b"text/event-stream; charset=utf-8")]
+        headers += [(key.lower().encode(), value.encode()) for key, value in STREAM_HEADERS.items()]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        stream = rag.aanswer_question_stream(question, search_options=search_options, filters=filters)
+        try:
+            async for event, payload in stream:
+                await send({"type": "http.response.body", "more_body": True,
+                            "body": format_stream_event(question, event, payload).encode("utf-8")})
+        finally:
+            await stream.aclose()
+        await send({"type": "http.response.body", "body": b""})
+
+    routes = {("POST", QUERY_ROUTE): query, ("POST", STREAM_ROUTE): query_stream}
+
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # DB に接続できなくても起動し、最初の質問で接続を再試行する
+                if rag is not None:
+                    await rag.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if rag is not None:
+                    await rag.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await lifespan(receive, send)
+        handler = routes.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if handler is None:
+            return await wsgi(scope, receive, send)
+        started = time.monotonic()
+        status = {"code": 500}
+
+        async def send_and_record(message):
+            # Flask と同じく処理時間は応答の開始まで（ストリーミングは最初のイベントの前まで）を記録する
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                metrics.HTTP_LATENCY.labels(scope["method"], scope["path"]).observe(time.monotonic() - started)
+            await send(message)
+
+        try:
+            await handler(scope, receive, send_and_record)
+        finally:
+            metrics.HTTP_REQUESTS.labels(scope["method"], scope["path"], str(status["code"])).inc()
+
+    return app
+
+# アプリケーションインスタンスを作成
+app = create_asgi_app()
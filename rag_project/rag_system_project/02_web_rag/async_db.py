@@ -0,0 +1,235 @@
+"""
+非同期の PostgreSQL アクセス（psycopg 3 の AsyncConnectionPool）
+
+AsyncRAGSystem の検索（ベクトル・語彙）・コーパスのバージョン・埋め込みキャッシュだけを非同期で行います。
+SQL は同期版の DatabaseManager の公開メソッド（filter_conditions・chunk_search_query・
+lexical_search_query 等）が組み立てたものをそのまま使い（クライアント側でパラメータを埋め込む
+AsyncClientCursor を使うため psycopg2 と同じ %s / %(name)s の書式で動きます）、
+pgvector・pg_trgm の有無とテーブルの作成・移行は同期版の connect() の結果に従います。
+"""
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+import numpy as np
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from config import Config
+from db_utils import (DEFAULT_DOCUMENT_FIELDS, VECTOR_OPERATORS, DatabaseManager, check_vector_table,
+                      normalize_embedding)
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class AsyncDatabaseManager:
+    """DatabaseManager と同じデータベースへの非同期の接続プール
+
+    接続はクエリ1回分だけ借りるため、回答生成を待っている間のリクエストは接続を持ちません。
+    プールの上限は DB_POOL_MAX_SIZE で、同期版のプールとは別に数えます。
+    """
+
+    def __init__(self, db: DatabaseManager = None, min_size: int = Config.DB_POOL_MIN_SIZE,
+                 max_size: int = Config.DB_POOL_MAX_SIZE):
+        self.sync = db or DatabaseManager()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool: Optional[AsyncConnectionPool] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self.pool is not None
+
+    @property
+    def has_pgvector(self) -> bool:
+        return self.sync.has_pgvector
+
+    @property
+    def has_trgm(self) -> bool:
+        return self.sync.has_trgm
+
+    async def _configure(self, connection: psycopg.AsyncConnection):
+        if self.has_pgvector:
+            from pgvector.psycopg import register_vector_async
+            await register_vector_async(connection)
+        # configure の中で開始したトランザクションを閉じてからプールに入れる
+        await connection.commit()
+
+    async def connect(self) -> bool:
+        """接続プールを開きます（同期版の connect() で拡張の有無を判定した後に呼んでください）"""
+        if self.pool is not None:
+            return True
+        pool = AsyncConnectionPool(
+            conninfo=make_conninfo(
+                host=self.sync.host, dbname=self.sync.dbname, user=self.sync.user,
+                password=self.sync.password, port=self.sync.port, connect_timeout=Config.DB_CONNECT_TIMEOUT),
+            min_size=self.min_size,
+            max_size=self.max_size,
+            timeout=Config.DB_POOL_TIMEOUT,
+            kwargs={"cursor_factory": psycopg.AsyncClientCursor},
+            configure=self._configure,
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        try:
+            await pool.open(wait=True, timeout=Config.DB_CONNECT_TIMEOUT + 5)
+        except (psycopg.Error, PoolTimeout) as e:
+            logger.error("PostgreSQL への非同期接続中にエラーが発生しました: %s", e)
+            await pool.close()
+            return False
+        self.pool = pool
+        metrics.DB_CONNECTIONS_MAX.inc(self.max_size)
+        logger.info("PostgreSQL への非同期接続に成功しました。（プール %d〜%d 接続）", self.min_size, self.max_size)
+        return True
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            metrics.DB_CONNECTIONS_MAX.dec(self.max_size)
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self):
+        """操作1回分の接続を借り、トランザクションの中で使うコンテキストマネージャ"""
+        if self.pool is None:
+            raise PoolTimeout("データベースに接続されていません")
+        started = time.monotonic()
+        try:
+            connection = await self.pool.getconn()
+        except PoolTimeout:
+            metrics.DB_POOL_TIMEOUTS.inc()
+            raise
+        metrics.DB_POOL_WAIT.observe(time.monotonic() - started)
+        metrics.DB_CONNECTIONS_IN_USE.inc()
+        try:
+            async with connection.transaction():
+                yield connection
+        finally:
+            metrics.DB_CONNECTIONS_IN_USE.dec()
+            await self.pool.putconn(connection)
+
+    async def _run_vector_query(self, cursor, sql: str, params, limit: int, filtered: bool) -> List[tuple]:
+        """DatabaseManager._run_vector_query の非同期版"""
+        for statement in self.sync.search_param_statements(limit, filtered=filtered):
+            await cursor.execute(*statement)
+        await cursor.execute(sql, params)
+        rows = await cursor.fetchall()
+        if filtered and len(rows) < limit and not self.sync.supports_iterative_scan:
+            await cursor.execute("SET LOCAL enable_indexscan = off")
+            await cursor.execute(sql, params)
+            rows = await cursor.fetchall()
+        return rows
+
+    async def search_documents(self, query_embedding: List[float], limit: int = 10,
+                               filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """クエリに近い文書を pgvector で検索します（結果は DatabaseManager.search_documents と同じ形式）"""
+        if not self.has_pgvector:
+            return []
+        operator = VECTOR_OPERATORS.get(Config.SIMILARITY_METRIC, "<#>")
+        conditions, params = self.sync.filter_conditions(filters)
+        params.update({"query": normalize_embedding(query_embedding).astype(np.float32), "limit": limit})
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"""
+        SELECT {", ".join(DEFAULT_DOCUMENT_FIELDS)} FROM documents
+        {where}
+        ORDER BY embedding {operator} %(query)s
+        LIMIT %(limit)s
+        """
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    rows = await self._run_vector_query(cursor, sql, params, limit, bool(conditions))
+            return [dict(zip(DEFAULT_DOCUMENT_FIELDS, row)) for row in rows]
+        except (psycopg.Error, PoolTimeout) as e:
+            logger.error("文書検索中にエラーが発生しました: %s", e)
+            return []
+
+    async def search_chunks(self, query_embedding: List[float], limit: int = 10,
+                            filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """DatabaseManager.search_chunks の非同期版"""
+        if not self.has_pgvector:
+            return []
+        sql, params, filtered = self.sync.chunk_search_query(query_embedding, limit, filters)
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    rows = await self._run_vector_query(cursor, sql, params, limit, filtered)
+            return [self.sync.chunk_row_to_dict(row) for row in rows]
+        except (psycopg.Error, PoolTimeout) as e:
+            logger.error("チャンク検索中にエラーが発生しました: %s", e)
+            return []
+
+    async def search_lexical(self, query: str, limit: int = 10, table: str = "documents",
+                             filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """DatabaseManager.search_lexical の非同期版"""
+        check_vector_table(table)
+        if not self.has_trgm:
+            return []
+        query_sql = self.sync.lexical_search_query(query, limit, table, filters)
+        if query_sql is None:
+            return []
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(*query_sql)
+                    rows = await cursor.fetchall()
+        except (psycopg.Error, PoolTimeout) as e:
+            logger.error("語彙検索中にエラーが発生しました: %s", e)
+            return []
+        return self.sync.lexical_rows_to_dicts(rows, table)
+
+    async def get_corpus_version(self) -> Optional[int]:
+        """DatabaseManager.get_corpus_version の非同期版（プロセス内の値は同期版と共有します）"""
+        cached = self.sync.cached_corpus_version()
+        if cached is not None:
+            return cached
+        now = time.monotonic()
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute("SELECT to_regclass('document_stats') IS NOT NULL")
+                    row = None
+                    if (await cursor.fetchone())[0]:
+                        await cursor.execute("SELECT version FROM document_stats")
+                        row = await cursor.fetchone()
+        except (psycopg.Error, PoolTimeout) as e:
+            logger.error("コーパスのバージョン取得中にエラーが発生しました: %s", e)
+            return None
+        if not row:
+            return None
+        self.sync.remember_corpus_version(int(row[0]), now)
+        return int(row[0])
+
+    async def get_cached_embeddings(self, model: str, task_type: str,
+                                    text_hashes: List[str]) -> Dict[str, List[float]]:
+        """DatabaseManager.get_cached_embeddings の非同期版"""
+        if not text_hashes:
+            return {}
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute("""
+                    SELECT text_hash, embedding FROM embedding_cache
+                    WHERE model = %s AND task_type = %s AND text_hash = ANY(%s)
+                    """, (model, task_type, list(text_hashes)))
+                    return {row[0]: row[1] for row in await cursor.fetchall()}
+        except (psycopg.Error, PoolTimeout) as e:
+            logger.error("埋め込みキャッシュの参照中にエラーが発生しました: %s", e)
+            return {}
+
+    async def put_cached_embeddings(self, model: str, task_type: str, items: List[tuple]) -> bool:
+        """DatabaseManager.put_cached_embeddings の非同期版"""
+        if not items:
+            return False
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.executemany("""
+                    INSERT INTO embedding_cache (model, task_type, text_hash, embedding)
+                    VALUES (%s, %s, %s, %s::real[])
+                    ON CONFLICT DO NOTHING
+                    """, [(model, task_type, digest, embedding) for digest, embedding in items])
+            return True
+        except (psycopg.Error, PoolTimeout) as e:
+            logger.error("埋め込みキャッシュの登録中にエラーが発生しました: %s", e)
+            return False
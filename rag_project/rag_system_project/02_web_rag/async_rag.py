@@ -0,0 +1,227 @@
+"""
+asyncio で動く RAG パイプライン
+
+AsyncRAGSystem は RAGSystem と同じ検索・回答生成を、埋め込み・DB・回答生成の待ちでスレッドを
+占有せずに行います（1プロセスのイベントループで数百件の質問を同時に処理できます）。
+検索結果の統合・MMR・コンテキストの組み立て・回答キャッシュは RAGSystem の実装をそのまま使い、
+I/O だけを非同期版（提供元の aembed / agenerate、AsyncDatabaseManager）に置き換えています。
+pgvector が無い環境のメモリ常駐インデックスによる検索は、同期版を既定のスレッドプールで実行します。
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import numpy as np
+from async_db import AsyncDatabaseManager
+from config import Config
+from db_utils import normalize_embedding
+from metrics import EMBEDDING_FALLBACKS, record_stage, stage_timer
+from rag_system import RAGSystem
+import request_timing
+
+logger = logging.getLogger(__name__)
+
+class AsyncRAGSystem:
+    """RAGSystem の非同期版（aquery / aanswer_question / aanswer_question_stream / asearch_similar_documents）"""
+
+    def __init__(self, rag: RAGSystem = None, db: AsyncDatabaseManager = None):
+        self.rag = rag or RAGSystem()
+        self.db = db or AsyncDatabaseManager(self.rag.db)
+        self._start_lock = asyncio.Lock()
+
+    async def start(self) -> bool:
+        """同期版の接続（テーブルの作成・移行と拡張の判定）を済ませてから非同期の接続プールを開きます"""
+        async with self._start_lock:
+            if self.db.is_connected:
+                return True
+            if not await asyncio.to_thread(self.rag.db.ensure_connected):
+                return False
+            return await self.db.connect()
+
+    async def _aensure_connected(self) -> bool:
+        """未接続なら接続を試み、利用可能かどうかを返します"""
+        return self.db.is_connected or await self.start()
+
+    async def close(self):
+        await self.db.close()
+        await asyncio.to_thread(self.rag.close)
+
+    async def agenerate_embedding(self, text: str, task_type: str = "retrieval_query") -> List[float]:
+        """RAGSystem.generate_embedding の非同期版"""
+        embedder = self.rag.embedder
+        with stage_timer("embedding"):
+            if not embedder.remote:
+                return (await embedder.aembed([text], task_type))[0]
+            cache = self.rag.embedding_cache
+            cached = (await cache.aget_many([text], task_type, self.db))[0]
+            if cached is not None:
+                return cached
+            try:
+                result = (await embedder.aembed([text], task_type))[0]
+                await cache.aput_many([text], [result], task_type, self.db)
+                return result
+            except Exception:
+                logger.exception("埋め込み生成中にエラーが発生しました。ダミーベクトルを返します。")
+                EMBEDDING_FALLBACKS.inc()
+                return [0.0] * Config.EMBEDDING_DIMENSION
+
+    async def asearch_similar_documents(self, query: str, top_k: int = 3, query_vector: np.ndarray = None,
+                                        search_options: Dict[str, Any] = None,
+                                        filters: Dict[str, Any] = None) -> List[Dict]:
+        """RAGSystem.search_similar_documents の非同期版（引数・結果の形式も同じです）"""
+        if not await self._aensure_connected():
+            return []
+        options = search_options or {}
+        limit, mmr_lambda = self.rag._mmr_settings(top_k, options)
+        results, query_vector = await self._aretrieve(query, limit, query_vector, options, filters)
+        return self.rag._finish_search(results, query_vector, top_k, mmr_lambda)
+
+    async def _aretrieve(self, query: str, limit: int, query_vector: Optional[np.ndarray], options: Dict[str, Any],
+                         filters: Optional[Dict[str, Any]]) -> Tuple[List[Dict], Optional[np.ndarray]]:
+        """RAGSystem._retrieve の非同期版（ハイブリッド検索の語彙検索は埋め込み生成・ベクトル検索と並行して実行します）"""
+        rag = self.rag
+        mode = rag._search_mode(options)
+        if mode == "lexical":
+            results = await self._asearch_lexical(query, limit, filters)
+            return rag._attach_similarity(results, query_vector), query_vector
+
+        lexical_task = None
+        if mode == "hybrid":
+            candidates = rag._hybrid_candidates(limit, options)
+            # タスクは作成時の文脈（request_timing）を引き継ぐ
+            lexical_task = asyncio.create_task(self._asearch_lexical(query, candidates, filters))
+
+        try:
+            if query_vector is None:
+                query_vector = normalize_embedding(await self.agenerate_embedding(query))
+            if not np.any(query_vector):
+                # 埋め込みの生成に失敗した（ゼロベクトル）場合は同期版と同じく語彙検索の結果だけを返す
+                lexical_results = (await lexical_task)[:limit] if lexical_task else []
+                return rag._attach_similarity(lexical_results, None), None
+
+            if lexical_task is None:
+                return await self._avector_search(query_vector, limit, filters), query_vector
+            vector_results = await self._avector_search(query_vector, candidates, filters)
+            return rag._fuse(vector_results, await lexical_task, limit, options, query_vector), query_vector
+        finally:
+            if lexical_task is not None and not lexical_task.done():
+                lexical_task.cancel()
+
+    async def _asearch_lexical(self, query: str, limit: int, filters: Dict[str, Any] = None) -> List[Dict]:
+        with stage_timer("db_search"):
+            return await self.db.search_lexical(query, limit, self.rag.retrieval_table, filters)
+
+    async def _avector_search(self, query_vector: np.ndarray, limit: int,
+                              filters: Dict[str, Any] = None) -> List[Dict]:
+        """RAGSystem._vector_search の非同期版"""
+        if not self.db.has_pgvector:
+            # メモリ常駐インデックスの検索は CPU 処理のため、同期版をスレッドで実行する（段階の時間は同期版が記録する）
+            return await asyncio.to_thread(self.rag._vector_search, query_vector, limit, filters)
+        with stage_timer("db_search"):
+            if self.rag.retrieval_table == "document_chunks":
+                results = await self.db.search_chunks(query_vector, limit=limit, filters=filters)
+            else:
+                results = await self.db.search_documents(query_vector, limit=limit, filters=filters)
+            return self.rag._rank_by_similarity(results, query_vector)
+
+    async def _acheck_answer_cache(self, question: str, max_context_tokens: int,
+                                   search_options: Dict[str, Any] = None, filters: Dict[str, Any] = None):
+        """RAGSystem._check_answer_cache の非同期版"""
+        if not Config.ANSWER_CACHE_ENABLED:
+            return None, None, None
+        await self._aensure_connected()
+        # 埋め込み生成とコーパスのバージョン取得は互いに依存しないため同時に待つ
+        embedding, corpus_version = await asyncio.gather(
+            self.agenerate_embedding(question), self.db.get_corpus_version())
+        query_vector = normalize_embedding(embedding)
+        cached = self.rag.answer_cache.get(
+            query_vector, corpus_version,
+            variant=self.rag._cache_variant(max_context_tokens, search_options, filters))
+        if cached:
+            logger.debug("回答キャッシュにヒットしました（類似度 %.3f）", cached["similarity"])
+        return query_vector, corpus_version, cached
+
+    async def aquery(self, question: str, max_context_tokens: int = None,
+                     search_options: Dict[str, Any] = None, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """RAGSystem.query の非同期版（結果の形式も同じです）"""
+        with request_timing.collect_timings() as timings:
+            result = await self._aanswer(question, max_context_tokens, search_options, filters)
+        result["timings"] = timings.as_dict()
+        logger.debug("クエリの処理時間: %.1f ms", result["timings"]["total_ms"], extra={"timings": result["timings"]})
+        return result
+
+    async def _aanswer(self, question: str, max_context_tokens: int = None,
+                       search_options: Dict[str, Any] = None, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        rag = self.rag
+        query_vector, corpus_version, cached = await self._acheck_answer_cache(
+            question, max_context_tokens, search_options, filters)
+        if cached:
+            return {"answer": cached["answer"], "sources": cached["sources"], "cached": True, "context_usage": None}
+
+        relevant_docs = await self.asearch_similar_documents(question, top_k=3, query_vector=query_vector,
+                                                             search_options=search_options, filters=filters)
+        if not relevant_docs:
+            return {"answer": "関連する文書が見つかりませんでした。", "sources": [], "cached": False,
+                    "context_usage": None}
+
+        prompt, sources, context_usage = rag._prepare_prompt(question, relevant_docs, max_context_tokens)
+        try:
+            with stage_timer("generation"):
+                answer = await rag.generator.agenerate(prompt)
+        except Exception as e:
+            return {"answer": f"回答生成中にエラーが発生しました: {e}", "sources": sources, "cached": False,
+                    "context_usage": context_usage}
+
+        if query_vector is not None:
+            rag.answer_cache.put(query_vector, corpus_version, answer, sources,
+                                 variant=rag._cache_variant(max_context_tokens, search_options, filters))
+        return {"answer": answer, "sources": sources, "cached": False, "context_usage": context_usage}
+
+    async def aanswer_question(self, question: str, max_context_tokens: int = None,
+                               search_options: Dict[str, Any] = None, filters: Dict[str, Any] = None) -> str:
+        """RAGSystem.answer_question の非同期版"""
+        return (await self.aquery(question, max_context_tokens, search_options, filters))["answer"]
+
+    async def aanswer_question_stream(self, question: str, max_context_tokens: int = None,
+                                      search_options: Dict[str, Any] = None,
+                                      filters: Dict[str, Any] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """RAGSystem.answer_question_stream の非同期版（同じ (イベント名, データ) の組を返します）"""
+        rag = self.rag
+        try:
+            query_vector, corpus_version, cached = await self._acheck_answer_cache(
+                question, max_context_tokens, search_options, filters)
+            if cached:
+                yield "sources", cached["sources"]
+                yield "token", cached["answer"]
+                yield "done", cached["answer"]
+                return
+            relevant_docs = await self.asearch_similar_documents(question, top_k=3, query_vector=query_vector,
+                                                                 search_options=search_options, filters=filters)
+        except Exception as e:
+            yield "error", f"文書検索中にエラーが発生しました: {e}"
+            return
+
+        if not relevant_docs:
+            answer = "関連する文書が見つかりませんでした。"
+            yield "sources", []
+            yield "token", answer
+            yield "done", answer
+            return
+
+        prompt, sources, _ = rag._prepare_prompt(question, relevant_docs, max_context_tokens)
+        yield "sources", sources
+        parts = []
+        started = time.monotonic()
+        try:
+            async for text in rag.generator.agenerate_stream(prompt):
+                parts.append(text)
+                yield "token", text
+        except Exception as e:
+            yield "error", f"回答生成中にエラーが発生しました: {e}"
+            return
+        record_stage("generation", time.monotonic() - started)
+        answer = "".join(parts)
+        if query_vector is not None:
+            rag.answer_cache.put(query_vector, corpus_version, answer, sources,
+                                 variant=rag._cache_variant(max_context_tokens, search_options, filters))
+        yield "done", answer
@@ -0,0 +1,122 @@
+"""
+ベンチマーク用の合成コーパスと、ネットワークを使わない埋め込みのスタブ
+
+SyntheticCorpus は clusters 個のトピックの中心ベクトルの周りに文書ベクトルを散らし、
+トピックごとの語彙で日本語らしい本文を作ります（同じトピックの文書はベクトルも語彙も近い）。
+i 番目の文書は seed と i だけで決まるため、件数を増やしながら測る場合も既存の文書は変わりません。
+"""
+import hashlib
+from typing import Any, Dict, Iterator, List, Tuple
+import numpy as np
+from providers import EmbeddingProvider
+
+# 文書を生成する単位（この単位ごとに乱数の系列を分けるため、任意の範囲を同じ内容で作れる）
+BLOCK_SIZE = 1000
+
+_KATAKANA = "アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモヤユヨラリルレロワン"
+_KANJI = "設定管理情報処理方法確認変更登録削除検索表示送信受信接続認証契約料金請求製品機能画面操作手順障害対応更新通知保存"
+_PARTICLES = ("は", "の", "を", "に", "が", "で", "と")
+_ENDINGS = ("します。", "です。", "できます。", "されます。", "になります。", "してください。")
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+def _word(rng: np.random.Generator) -> str:
+    """カタカナ語（3〜5音）か漢字語（2〜3字）を1語作ります"""
+    if rng.random() < 0.5:
+        return "".join(rng.choice(list(_KATAKANA), size=int(rng.integers(3, 6)))) + "ー" * int(rng.random() < 0.3)
+    return "".join(rng.choice(list(_KANJI), size=int(rng.integers(2, 4))))
+
+class SyntheticCorpus:
+    """クラスタ構造を持つ768次元ベクトルと日本語らしい本文の合成コーパス"""
+    def __init__(self, dimension: int = 768, clusters: int = 64, seed: int = 0, noise: float = 0.8,
+                 sentences: Tuple[int, int] = (4, 9)):
+        self.dimension = dimension
+        self.clusters = clusters
+        self.seed = seed
+        self.noise = noise
+        self.sentences = sentences
+        rng = np.random.default_rng(seed)
+        self.centroids = _normalize_rows(rng.standard_normal((clusters, dimension)))
+        self.topics = [[_word(rng) for _ in range(12)] for _ in range(clusters)]
+        self.common = [_word(rng) for _ in range(300)]
+
+    def _vectors(self, rng: np.random.Generator, clusters: np.ndarray) -> np.ndarray:
+        """トピックの中心に、ノルムがおよそ noise の雑音を加えて単位長にします"""
+        noise = rng.standard_normal((len(clusters), self.dimension)) * (self.noise / np.sqrt(self.dimension))
+        return _normalize_rows(self.centroids[clusters] + noise)
+
+    def _sentence(self, rng: np.random.Generator, cluster: int) -> str:
+        topic = self.topics[cluster]
+        words = [topic[int(rng.integers(len(topic)))], self.common[int(rng.integers(len(self.common)))]]
+        if rng.random() < 0.5:
+            words.append(topic[int(rng.integers(len(topic)))])
+        particles = rng.choice(_PARTICLES, size=len(words))
+        return "".join(f"{word}{particle}" for word, particle in zip(words, particles))[:-1] \
+            + _ENDINGS[int(rng.integers(len(_ENDINGS)))]
+
+    def _block(self, block: int) -> List[Dict[str, Any]]:
+        rng = np.random.default_rng((self.seed, block))
+        clusters = rng.integers(self.clusters, size=BLOCK_SIZE)
+        vectors = self._vectors(rng, clusters)
+        documents = []
+        for offset, (cluster, vector) in enumerate(zip(clusters, vectors)):
+            index = block * BLOCK_SIZE + offset
+            cluster = int(cluster)
+            count = int(rng.integers(*self.sentences))
+            documents.append({
+                "title": f"{self.topics[cluster][0]}{self.topics[cluster][1]}について（{index}）",
+                "content": "".join(self._sentence(rng, cluster) for _ in range(count)),
+                "embedding": vector,
+                "metadata": {"cluster": cluster, "synthetic_id": index},
+            })
+        return documents
+
+    def documents(self, start: int, stop: int) -> Iterator[Dict[str, Any]]:
+        """start 番目から stop 番目の手前までの文書を順に返します（title, content, embedding, metadata）"""
+        for block in range(start // BLOCK_SIZE, (stop + BLOCK_SIZE - 1) // BLOCK_SIZE):
+            base = block * BLOCK_SIZE
+            for offset, document in enumerate(self._block(block)):
+                if start <= base + offset < stop:
+                    yield document
+
+    def queries(self, count: int, seed: int = 1) -> List[Dict[str, Any]]:
+        """質問文・クエリベクトル・正解のトピックの組を count 件作ります"""
+        # 文書のブロック (seed, block) と系列が重ならないよう3要素で初期化する
+        rng = np.random.default_rng((self.seed, seed, 0))
+        clusters = rng.integers(self.clusters, size=count)
+        vectors = self._vectors(rng, clusters)
+        queries = []
+        for cluster, vector in zip(clusters, vectors):
+            topic = self.topics[int(cluster)]
+            words = rng.choice(topic, size=2, replace=False)
+            queries.append({
+                "text": f"{words[0]}の{words[1]}はどうすればよいですか？（{len(queries)}）",
+                "embedding": vector,
+                "cluster": int(cluster),
+            })
+        return queries
+
+class FakeEmbedder(EmbeddingProvider):
+    """埋め込みの提供元のスタブ（登録済みのテキストは登録したベクトル、それ以外はテキストのハッシュから決まるベクトル）"""
+    model = "benchmark-fake"
+    remote = False
+
+    def __init__(self, dimension: int = 768):
+        self.dimension = dimension
+        self.known: Dict[str, np.ndarray] = {}
+
+    def register(self, text: str, vector):
+        self.known[text] = np.asarray(vector, dtype=np.float32)
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vector = self.known.get(text)
+        if vector is None:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = _normalize_rows(np.random.default_rng(seed).standard_normal(self.dimension))
+        return vector
+
+    def embed(self, texts: List[str], task_type: str = None) -> List[List[float]]:
+        return [self.embed_one(text).tolist() for text in texts]
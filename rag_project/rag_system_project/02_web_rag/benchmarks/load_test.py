@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+"""
+HTTP の負荷試験（/api/query・/api/documents の GET / POST / DELETE を混ぜて同時に送ります）
+
+使い方:
+    # Gemini をスタブにしたアプリ（benchmarks/stub_app.py）をワーカー数・接続プールの上限ごとに起動して測る
+    python benchmarks/load_test.py --start --workers 1,2,4 --pool-sizes 5,10 --concurrency 4,16,32
+    # 同期（gthread）と非同期（ASGI、/api/query をイベントループで処理）を同じ条件で比べる
+    python benchmarks/load_test.py --start --servers wsgi,asgi --workers 1 --concurrency 16,64,256
+    # 起動済みのアプリに対して測る
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 8 --duration 60
+
+--start の場合は gunicorn（Procfile と同じ gthread ワーカー）をローカルで起動し、
+--workers × --threads × --pool-sizes の組み合わせごとに起動し直します。
+--servers に asgi を含めると asgi_app を uvicorn のワーカーで起動した場合も測ります（--threads は使いません）。
+データベースは通常どおり POSTGRES_HOST 等の設定で接続します（測定中に文書の追加・削除を行うため、
+アプリのデータベースではなく POSTGRES_DB で負荷試験用のデータベースを指定してください）。
+
+同時実行数（--concurrency）ごとに --duration 秒送り続け、エンドポイントごとに
+スループット（件/秒）・遅延の p50 / p95 / p99・エラー率（接続エラーと 2xx 以外の応答の割合）を JSON に書き出します。
+あわせて /metrics から DB 接続の空き待ち（rag_db_pool_wait_seconds）とタイムアウトの回数を集計し、
+スループットが伸びなくなる同時実行数と、その原因がワーカー数か接続プールかを見分けられるようにします。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+import requests
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from corpus import SyntheticCorpus
+from run_retrieval import summarize
+ENDPOINTS = ("query", "documents_get", "documents_post", "documents_delete")
+DEFAULT_MIX = "query=60,documents_get=25,documents_post=10,documents_delete=5"
+# /metrics から測定区間の差分を取るメトリクス
+POOL_METRICS = ("rag_db_pool_wait_seconds_sum", "rag_db_pool_wait_seconds_count", "rag_db_pool_timeouts_total")
+
+def parse_mix(raw: str) -> Dict[str, float]:
+    """"query=60,documents_get=25" 形式の割合を読みます"""
+    mix = {}
+    for item in raw.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"未対応のエンドポイントです: {name}（{', '.join(ENDPOINTS)}）")
+        mix[name] = float(weight)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("--mix に1つ以上のエンドポイントを正の割合で指定してください")
+    return mix
+
+def scrape_pool_metrics(session: requests.Session, base_url: str) -> Dict[str, float]:
+    """/metrics から接続プールの待ち時間・回数を読みます（取得できなければ空）"""
+    try:
+        response = session.get(f"{base_url}/metrics", timeout=10)
+        response.raise_for_status()
+    except requests.RequestException:
+        return {}
+    values = {}
+    for line in response.text.splitlines():
+        name, _, value = line.partition(" ")
+        if name in POOL_METRICS:
+            values[name] = values.get(name, 0.0) + float(value)
+    return values
+
+class LoadGenerator:
+    """同時実行数分のスレッドから、割合 mix でエンドポイントを選んでリクエストを送ります"""
+    def __init__(self, base_url: str, mix: Dict[str, float], corpus: SyntheticCorpus, timeout: float, seed: int = 0):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.corpus = corpus
+        self.timeout = timeout
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # DELETE の対象（負荷試験で追加した文書のID）
+        self._document_ids: List[int] = []
+        # 追加する文書（再実行しても ID 以外は同じ文書にならないよう、seed ごとに範囲をずらす）
+        self._document_source = corpus.documents(seed * 10_000_000, (seed + 1) * 10_000_000)
+        self._query_round = 0
+        self._queries: List[Dict[str, Any]] = []
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _next_documents(self, count: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            documents = [next(self._document_source) for _ in range(count)]
+        return [{"title": document["title"], "content": document["content"], "metadata": document["metadata"]}
+                for document in documents]
+
+    def _next_question(self) -> str:
+        # 質問は毎回変える（回答・埋め込みのキャッシュに当たらない条件で測る）
+        with self._lock:
+            if not self._queries:
+                self._query_round += 1
+                self._queries = self.corpus.queries(1000, seed=self.seed * 1000 + self._query_round)
+            query = self._queries.pop()
+        return f"{query['text']}（{self._query_round}）"
+
+    def _remember(self, response: requests.Response):
+        if response.status_code == 200:
+            ids = response.json().get("document_ids") or []
+            with self._lock:
+                self._document_ids.extend(ids)
+
+    def seed_documents(self, count: int, batch_size: int = 50):
+        """測定前に文書を追加します（一覧・検索の対象と、DELETE で削除する文書）"""
+        session = self._session()
+        for start in range(0, count, batch_size):
+            response = session.post(f"{self.base_url}/api/documents",
+                                    json={"documents": self._next_documents(min(batch_size, count - start))},
+                                    timeout=max(self.timeout, 300))
+            if response.status_code not in (200, 202):
+                raise RuntimeError(f"文書の追加に失敗しました: {response.status_code} {response.text[:200]}")
+            self._remember(response)
+
+    def _choose(self, rng: random.Random) -> str:
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        if "documents_delete" in self.mix and not self._document_ids:
+            # 削除できる文書が無い間は DELETE 以外から選ぶ
+            index = names.index("documents_delete")
+            del names[index], weights[index]
+        return rng.choices(names, weights)[0]
+
+    def request(self, endpoint: str) -> Optional[int]:
+        """1リクエスト送り、ステータスコード（接続エラー・タイムアウトは None、送らなかった場合は 0）を返します"""
+        session = self._session()
+        url = f"{self.base_url}/api"
+        try:
+            if endpoint == "query":
+                response = session.post(f"{url}/query", json={"question": self._next_question()}, timeout=self.timeout)
+            elif endpoint == "documents_get":
+                response = session.get(f"{url}/documents", timeout=self.timeout)
+            elif endpoint == "documents_post":
+                response = session.post(f"{url}/documents", json={"documents": self._next_documents(1)},
+                                        timeout=self.timeout)
+                self._remember(response)
+            else:
+                with self._lock:
+                    document_id = self._document_ids.pop() if self._document_ids else None
+                if document_id is None:
+                    # 他のスレッドが先に最後の文書を削除した
+                    return 0
+                response = session.delete(f"{url}/documents/{document_id}", timeout=self.timeout)
+            return response.status_code
+        except requests.RequestException:
+            return None
+
+    def run(self, concurrency: int, duration: float, warmup: float) -> Dict[str, Any]:
+        """concurrency 本のスレッドで warmup + duration 秒送り、warmup 後の結果を集計します"""
+        samples: Dict[str, List[float]] = {name: [] for name in self.mix}
+        statuses: Dict[str, Dict[str, int]] = {name: {} for name in self.mix}
+        measure_from = time.monotonic() + warmup
+        deadline = measure_from + duration
+
+        def worker(index: int):
+            rng = random.Random(self.seed * 1000 + index)
+            local_samples = {name: [] for name in self.mix}
+            local_statuses = {name: {} for name in self.mix}
+            while True:
+                started = time.monotonic()
+                if started >= deadline:
+                    break
+                endpoint = self._choose(rng)
+                status = self.request(endpoint)
+                finished = time.monotonic()
+                # 測定区間内に送ったリクエストだけを数える（区間の終わりを越えた応答も含む）
+                if started >= measure_from and status != 0:
+                    local_samples[endpoint].append((finished - started) * 1000)
+                    key = str(status) if status is not None else "error"
+                    local_statuses[endpoint][key] = local_statuses[endpoint].get(key, 0) + 1
+            with self._lock:
+                for name in self.mix:
+                    samples[name].extend(local_samples[name])
+                    for key, count in local_statuses[name].items():
+                        statuses[name][key] = statuses[name].get(key, 0) + count
+
+        # 接続プールの値はウォームアップの終了時点からの差分にする
+        pool_before = {}
+        timer = threading.Timer(warmup, lambda: pool_before.update(
+            scrape_pool_metrics(requests.Session(), self.base_url)))
+        timer.start()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as executor:
+            list(executor.map(worker, range(concurrency)))
+        timer.join()
+        pool_after = scrape_pool_metrics(self._session(), self.base_url)
+
+        endpoints = {}
+        all_samples, all_errors = [], 0
+        for name in self.mix:
+            errors = sum(count for key, count in statuses[name].items() if not key.startswith("2"))
+            endpoints[name] = {
+                "requests": len(samples[name]),
+                "errors": errors,
+                "error_rate": round(errors / len(samples[name]), 4) if samples[name] else None,
+                "throughput_rps": round(len(samples[name]) / duration, 2),
+                "statuses": statuses[name],
+                **summarize(samples[name]),
+            }
+            all_samples.extend(samples[name])
+            all_errors += errors
+        endpoints["total"] = {
+            "requests": len(all_samples),
+            "errors": all_errors,
+            "error_rate": round(all_errors / len(all_samples), 4) if all_samples else None,
+            "throughput_rps": round(len(all_samples) / duration, 2),
+            **summarize(all_samples),
+        }
+        pool = {name: round(pool_after[name] - pool_before.get(name, 0.0), 4) for name in pool_after}
+        if pool.get("rag_db_pool_wait_seconds_count"):
+            pool["mean_wait_ms"] = round(
+                pool["rag_db_pool_wait_seconds_sum"] / pool["rag_db_pool_wait_seconds_count"] * 1000, 3)
+        return {"endpoints": endpoints, "db_pool": pool}
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(workers: int, threads: int, pool_size: int, args, kind: str = "wsgi") -> subprocess.Popen:
+    """スタブのアプリを gunicorn で起動し、/health が応答するまで待ちます"""
+    port = _free_port()
+    env = dict(os.environ,
+               DB_POOL_MAX_SIZE=str(pool_size),
+               DB_POOL_MIN_SIZE=str(min(pool_size, int(os.getenv("DB_POOL_MIN_SIZE", "2")))),
+               STUB_EMBEDDING_LATENCY_MS=str(args.embedding_latency_ms),
+               STUB_GENERATION_LATENCY_MS=str(args.generation_latency_ms),
+               # POST を同期で処理させる（ジョブ登録だけの 202 では追加処理の負荷を測れない）
+               INGEST_QUEUE_ENABLED="false",
+               LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    if kind == "asgi":
+        target, worker_args = "benchmarks.stub_app:asgi_app", ["--worker-class", "uvicorn.workers.UvicornWorker"]
+    else:
+        target, worker_args = "benchmarks.stub_app:app", ["--worker-class", "gthread", "--threads", str(threads)]
+    command = [sys.executable, "-m", "gunicorn", target, "-c", "gunicorn.conf.py",
+               "--bind", f"127.0.0.1:{port}", "--workers", str(workers), *worker_args,
+               "--timeout", str(args.server_timeout)]
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env)
+    process.base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn が終了しました（終了コード {process.returncode}）")
+        try:
+            if requests.get(f"{process.base_url}/health", timeout=2).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError("gunicorn が60秒以内に応答しませんでした")
+
+def stop_server(process: subprocess.Popen):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def run_target(base_url: str, server: Dict[str, Any], args, corpus: SyntheticCorpus,
+               results: List[Dict[str, Any]]):
+    """1つのアプリ（起動設定 server）に対して、同時実行数ごとに測ります"""
+    generator = LoadGenerator(base_url, args.mix, corpus, args.timeout, seed=args.seed)
+    if args.seed_documents:
+        generator.seed_documents(args.seed_documents)
+    for concurrency in args.concurrency:
+        outcome = generator.run(concurrency, args.duration, args.warmup)
+        entry = {**server, "concurrency": concurrency, **outcome}
+        results.append(entry)
+        total = outcome["endpoints"]["total"]
+        print(json.dumps({**server, "concurrency": concurrency, "throughput_rps": total["throughput_rps"],
+                          "p95_ms": total.get("p95_ms"), "error_rate": total["error_rate"],
+                          "db_pool": outcome["db_pool"]}, ensure_ascii=False))
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="/api/query・/api/documents の HTTP 負荷試験")
+    parser.add_argument("--url", help="起動済みのアプリの URL（--start と同時には指定しない）")
+    parser.add_argument("--start", action="store_true", help="スタブのアプリを gunicorn でローカルに起動して測る")
+    parser.add_argument("--servers", default="wsgi",
+                        help="--start 時のアプリ（wsgi: gthread で web_app, asgi: uvicorn で asgi_app。カンマ区切りで複数）")
+    parser.add_argument("--workers", default="2", help="--start 時の gunicorn のワーカー数（カンマ区切りで複数）")
+    parser.add_argument("--threads", default="4", help="--start 時のワーカーあたりのスレッド数（カンマ区切りで複数）")
+    parser.add_argument("--pool-sizes", default=str(int(os.getenv("DB_POOL_MAX_SIZE", "10"))),
+                        help="--start 時の DB_POOL_MAX_SIZE（カンマ区切りで複数）")
+    parser.add_argument("--server-timeout", type=int, default=120, help="--start 時の gunicorn の --timeout")
+    parser.add_argument("--concurrency", default="1,4,16", help="同時に送るリクエスト数（カンマ区切り、昇順に測定）")
+    parser.add_argument("--duration", type=float, default=30.0, help="同時実行数ごとの測定時間（秒）")
+    parser.add_argument("--warmup", type=float, default=5.0, help="同時実行数ごとに集計から除く最初の秒数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="エンドポイントの割合（名前=重み のカンマ区切り）")
+    parser.add_argument("--seed-documents", type=int, default=200, help="測定前に追加する文書数")
+    parser.add_argument("--embedding-latency-ms", type=float, default=100.0, help="--start 時のスタブの埋め込みの待ち時間")
+    parser.add_argument("--generation-latency-ms", type=float, default=1000.0, help="--start 時のスタブの回答生成の待ち時間")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_test_results.json")
+    args = parser.parse_args(argv)
+    if bool(args.url) == args.start:
+        parser.error("--url と --start のどちらか一方を指定してください")
+    try:
+        args.mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    args.servers = [value.strip() for value in args.servers.split(",") if value.strip()]
+    if not set(args.servers) <= {"wsgi", "asgi"}:
+        parser.error("--servers は wsgi / asgi で指定してください")
+    for name in ("workers", "threads", "pool_sizes"):
+        setattr(args, name, [int(value) for value in getattr(args, name).split(",") if value.strip()])
+    args.concurrency = sorted(int(value) for value in args.concurrency.split(",") if value.strip())
+    return args
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    corpus = SyntheticCorpus(seed=args.seed)
+    report = {
+        "benchmark": "http_load",
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "parameters": {key: value for key, value in vars(args).items() if key != "output"},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count()},
+        "results": [],
+    }
+    if args.url:
+        run_target(args.url, {"url": args.url}, args, corpus, report["results"])
+    else:
+        for kind in args.servers:
+            # ASGI のワーカーはスレッド数を使わないため1通りだけ測る
+            for workers in args.workers:
+                for threads in (args.threads if kind == "wsgi" else [None]):
+                    for pool_size in args.pool_sizes:
+                        server = {"server": kind, "workers": workers, "threads": threads, "pool_size": pool_size}
+                        process = start_server(workers, threads, pool_size, args, kind)
+                        try:
+                            run_target(process.base_url, server, args, corpus, report["results"])
+                        finally:
+                            stop_server(process)
+    report["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を {args.output} に保存しました。")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
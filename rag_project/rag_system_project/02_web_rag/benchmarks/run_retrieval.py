@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+検索のスケーリングベンチマーク（合成コーパス・オフライン）
+
+使い方:
+    python benchmarks/run_retrieval.py                                   # 1k / 10k / 100k / 1M 件、pgvector と JSONB
+    python benchmarks/run_retrieval.py --sizes 1000,10000 --backends pgvector
+    python benchmarks/run_retrieval.py --output results/after.json --compare results/before.json
+
+ローカルの PostgreSQL（POSTGRES_HOST 等の接続設定）にベンチマーク専用のデータベース
+{prefix}_pgvector と {prefix}_jsonb を作って使います（アプリのデータベースには触れません）。
+JSONB 側では vector 拡張を削除し、pgvector の無い環境のフォールバック（メモリ常駐インデックス）を測ります。
+埋め込みは FakeEmbedder、回答生成は StubGenerationProvider を使うため、ネットワークは使いません。
+検索は文書単位です（チャンク分割・回答キャッシュは無効にして測ります）。
+
+件数ごとに前の件数からの差分だけをロード（COPY）し、次の操作を測って JSON に書き出します。
+    load         差分のロード（件/秒）
+    index_build  pgvector: ANN インデックスの作成 / JSONB: メモリ常駐インデックスの構築
+    search       search_similar_documents（遅延と、結果がクエリと同じトピックの文書である割合 topic_precision）
+    insert       insert_document（1件ずつ。測定後に削除します）
+    list         list_documents（カーソルで続きのページを順に取得）
+    answer       answer_question（生成はスタブ）
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from db_utils import DatabaseManager
+from logging_config import setup_logging
+from providers import StubGenerationProvider
+from corpus import FakeEmbedder, SyntheticCorpus
+
+BACKENDS = ("pgvector", "jsonb")
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+LIST_FIELDS = ["id", "title", "preview", "content_length", "metadata", "created_at"]
+
+def summarize(samples_ms: List[float]) -> Dict[str, Any]:
+    """遅延（ミリ秒）の件数・平均・パーセンタイルを返します"""
+    if not samples_ms:
+        return {"count": 0}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+def _batches(items: Iterable, size: int) -> Iterable[List]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _connect(dbname: str):
+    return psycopg2.connect(host=Config.DB_HOST, dbname=dbname, user=Config.DB_USER,
+                            password=Config.DB_PASSWORD, port=Config.DB_PORT, connect_timeout=Config.DB_CONNECT_TIMEOUT)
+
+def prepare_database(name: str, backend: str):
+    """ベンチマーク用のデータベースを用意し、backend に応じて vector 拡張を作成・削除します"""
+    admin = _connect("postgres")
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            if cursor.fetchone() is None:
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+    finally:
+        admin.close()
+
+    connection = _connect(name)
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            if backend == "pgvector":
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+            else:
+                cursor.execute("DROP EXTENSION IF EXISTS vector CASCADE")
+    finally:
+        connection.close()
+
+def create_rag(db: DatabaseManager, embedder: FakeEmbedder, generation_latency: float):
+    """埋め込みと生成をスタブにした RAGSystem を作ります"""
+    from rag_system import RAGSystem
+
+    rag = RAGSystem(embedding_provider=embedder, generation_provider=StubGenerationProvider(latency=generation_latency))
+    rag.db = db
+    rag.embedding_cache.db = db
+    return rag
+
+def _analyze(db: DatabaseManager):
+    """ロード後の統計情報を更新します（プランナーが件数に応じた計画を選べるように）"""
+    with db.get_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE documents")
+        connection.commit()
+
+def _server_version(db: DatabaseManager) -> str:
+    with db.get_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('server_version')")
+            version = cursor.fetchone()[0]
+        connection.commit()
+    return version
+
+def run_backend(backend: str, args, corpus: SyntheticCorpus, queries: List[Dict[str, Any]],
+                embedder: FakeEmbedder) -> Dict[str, Any]:
+    """1つのバックエンドで全件数を測り、{environment, results} を返します"""
+    name = f"{args.db_prefix}_{backend}"
+    prepare_database(name, backend)
+    db = DatabaseManager(dbname=name)
+    if not db.connect():
+        raise RuntimeError(f"データベース {name} に接続できません")
+    if (backend == "pgvector") != db.has_pgvector:
+        raise RuntimeError(f"データベース {name} の pgvector の有無が {backend} と一致しません")
+    if not db.create_documents_table():
+        raise RuntimeError(f"データベース {name} にテーブルを作成できません")
+
+    rag = create_rag(db, embedder, args.generation_latency)
+    search_options = {"mode": args.search_mode}
+    environment = {"database": name, "server_version": _server_version(db),
+                   "pgvector_version": ".".join(map(str, db.pgvector_version)) or None, "has_trgm": db.has_trgm}
+    results = []
+
+    def record(size: int, operation: str, **values):
+        entry = {"backend": backend, "size": size, "operation": operation, **values}
+        results.append(entry)
+        print(json.dumps(entry, ensure_ascii=False))
+
+    loaded = 0
+    for size in args.sizes:
+        if backend == "jsonb" and size > args.jsonb_max_size:
+            record(size, "skipped", reason=f"--jsonb-max-size {args.jsonb_max_size} を超えるため")
+            continue
+
+        if backend == "pgvector":
+            db.drop_vector_index(table="documents")
+        started = time.perf_counter()
+        for batch in _batches(corpus.documents(loaded, size), args.batch_size):
+            if len(db.copy_documents(batch)) != len(batch):
+                raise RuntimeError("文書のロードに失敗しました")
+        load_seconds = _elapsed_ms(started) / 1000
+        record(size, "load", documents=size - loaded, seconds=round(load_seconds, 3),
+               docs_per_sec=round((size - loaded) / load_seconds, 1) if load_seconds else None)
+        loaded = size
+        _analyze(db)
+
+        started = time.perf_counter()
+        if backend == "pgvector":
+            db.create_vector_index(concurrently=False, table="documents")
+        else:
+            rag._sync_vector_index(force=True)
+        record(size, "index_build", seconds=round(_elapsed_ms(started) / 1000, 3))
+
+        # 先頭の warmup 件はキャッシュ・接続の準備を含むため集計から除く
+        latencies, precisions = [], []
+        for position, query in enumerate(queries):
+            started = time.perf_counter()
+            hits = rag.search_similar_documents(query["text"], top_k=args.top_k, search_options=search_options)
+            elapsed = _elapsed_ms(started)
+            if position < args.warmup:
+                continue
+            latencies.append(elapsed)
+            if hits:
+                same_topic = sum(1 for hit in hits if (hit.get("metadata") or {}).get("cluster") == query["cluster"])
+                precisions.append(same_topic / len(hits))
+        record(size, "search", top_k=args.top_k, mode=args.search_mode,
+               topic_precision=round(float(np.mean(precisions)), 4) if precisions else None, **summarize(latencies))
+
+        latencies = []
+        inserted = []
+        for document in corpus.documents(size, size + args.inserts):
+            started = time.perf_counter()
+            document_id = db.insert_document(document["title"], document["content"], document["embedding"],
+                                             document["metadata"])
+            latencies.append(_elapsed_ms(started))
+            if document_id:
+                inserted.append(document_id)
+        for document_id in inserted:
+            db.delete_document(document_id)
+        record(size, "insert", **summarize(latencies))
+
+        latencies = []
+        cursor = None
+        for _ in range(args.list_pages):
+            started = time.perf_counter()
+            page = db.list_documents(limit=Config.DOCUMENT_PAGE_SIZE, cursor=cursor, fields=LIST_FIELDS)
+            latencies.append(_elapsed_ms(started))
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        record(size, "list", page_size=Config.DOCUMENT_PAGE_SIZE, **summarize(latencies))
+
+        latencies = []
+        for position, query in enumerate(queries[:args.warmup + args.answers]):
+            started = time.perf_counter()
+            rag.answer_question(query["text"], search_options=search_options)
+            if position >= args.warmup:
+                latencies.append(_elapsed_ms(started))
+        record(size, "answer", generation_latency_ms=args.generation_latency * 1000, **summarize(latencies))
+
+    rag.close()
+    return {"environment": environment, "results": results}
+
+def compare(current: List[Dict[str, Any]], baseline_path: str):
+    """以前の結果ファイルと p50 / p95 を比べて表示します（比は 今回 / 以前）"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["backend"], r["size"], r["operation"]): r for r in json.load(f)["results"]}
+    print(f"\n{baseline_path} との比較（今回 / 以前）")
+    for entry in current:
+        previous = baseline.get((entry["backend"], entry["size"], entry["operation"]))
+        if not previous:
+            continue
+        for key in ("p50_ms", "p95_ms", "seconds"):
+            if entry.get(key) and previous.get(key):
+                print(f"  {entry['backend']:8} {entry['size']:>8} {entry['operation']:12} {key:8} "
+                      f"{previous[key]:>10.2f} -> {entry[key]:>10.2f}  x{entry[key] / previous[key]:.2f}")
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="合成コーパスによる検索のスケーリングベンチマーク")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="測定する文書数（カンマ区切り、昇順に測定）")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="pgvector / jsonb（カンマ区切り）")
+    parser.add_argument("--jsonb-max-size", type=int, default=100000,
+                        help="JSONB（メモリ常駐インデックス）で測る最大件数（これを超える件数は skipped）")
+    parser.add_argument("--queries", type=int, default=200, help="検索を測るクエリ数")
+    parser.add_argument("--answers", type=int, default=50, help="answer_question を測る回数")
+    parser.add_argument("--inserts", type=int, default=100, help="insert_document を測る件数")
+    parser.add_argument("--list-pages", type=int, default=20, help="list_documents で辿るページ数")
+    parser.add_argument("--warmup", type=int, default=5, help="集計から除く最初のクエリ数")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--search-mode", choices=["hybrid", "vector", "lexical"], default=Config.SEARCH_MODE)
+    parser.add_argument("--clusters", type=int, default=64, help="合成コーパスのトピック数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=5000, help="COPY 1回でロードする件数")
+    parser.add_argument("--generation-latency", type=float, default=0.0, help="スタブの回答生成の待ち時間（秒）")
+    parser.add_argument("--db-prefix", default="rag_bench", help="ベンチマーク用データベース名の接頭辞")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="比較する以前の結果ファイル")
+    args = parser.parse_args(argv)
+    args.sizes = sorted(int(size) for size in args.sizes.split(",") if size.strip())
+    args.backends = [backend.strip() for backend in args.backends.split(",") if backend.strip()]
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"未対応のバックエンドです: {', '.join(sorted(unknown))}")
+    if args.db_prefix == Config.DB_NAME or any(f"{args.db_prefix}_{b}" == Config.DB_NAME for b in BACKENDS):
+        parser.error("--db-prefix にはアプリのデータベースと異なる名前を指定してください（テーブルを作り直します）")
+    return args
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    setup_logging(level="WARNING")
+    # 文書単位・回答キャッシュ無効で測り、アプリの IVF インデックスのファイルは上書きしない
+    Config.CHUNKING_ENABLED = False
+    Config.ANSWER_CACHE_ENABLED = False
+    Config.IVF_INDEX_PATH = os.path.join(tempfile.mkdtemp(prefix="rag_bench_"), "ivf_index.npz")
+
+    corpus = SyntheticCorpus(dimension=Config.EMBEDDING_DIMENSION, clusters=args.clusters, seed=args.seed)
+    queries = corpus.queries(args.warmup + args.queries, seed=args.seed + 1)
+    embedder = FakeEmbedder(Config.EMBEDDING_DIMENSION)
+    for query in queries:
+        embedder.register(query["text"], query["embedding"])
+
+    report = {
+        "benchmark": "retrieval",
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "backends": {}},
+        "config": {key: getattr(Config, key) for key in (
+            "ANN_INDEX_TYPE", "HNSW_M", "HNSW_EF_CONSTRUCTION", "HNSW_EF_SEARCH", "IVFFLAT_PROBES",
+            "FALLBACK_INDEX_TYPE", "IVF_NPROBE", "MMR_ENABLED", "MMR_CANDIDATES", "HYBRID_CANDIDATES",
+            "DB_POOL_MAX_SIZE")},
+        "results": [],
+    }
+    for backend in args.backends:
+        outcome = run_backend(backend, args, corpus, queries, embedder)
+        report["environment"]["backends"][backend] = outcome["environment"]
+        report["results"].extend(outcome["results"])
+    report["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"結果を {args.output} に保存しました。")
+    if args.compare:
+        compare(report["results"], args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+負荷試験用のアプリ（Gemini の埋め込み・回答生成をプロセス内のスタブに置き換えた web_app）
+
+    gunicorn benchmarks.stub_app:app -c gunicorn.conf.py --workers 2 --worker-class gthread --threads 4
+    gunicorn benchmarks.stub_app:asgi_app -c gunicorn.conf.py --workers 2 --worker-class uvicorn.workers.UvicornWorker
+
+データベースは通常どおり POSTGRES_HOST 等の設定で接続します。API キーは不要です。
+スタブの待ち時間は環境変数で指定します（Gemini の応答時間の代わり）。
+    STUB_EMBEDDING_LATENCY_MS   埋め込み1回あたり（既定 100）
+    STUB_GENERATION_LATENCY_MS  回答生成1回あたり（既定 1000）
+埋め込みは LocalEmbeddingProvider で計算しますが、Gemini と同じく埋め込みキャッシュを通します。
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import providers
+from config import Config
+from web_app import create_app
+
+EMBEDDING_LATENCY = float(os.getenv("STUB_EMBEDDING_LATENCY_MS", "100")) / 1000
+GENERATION_LATENCY = float(os.getenv("STUB_GENERATION_LATENCY_MS", "1000")) / 1000
+
+class StubEmbeddingProvider(providers.LocalEmbeddingProvider):
+    """Gemini の埋め込みの代わり（1回の呼び出しごとに待ち、キャッシュの対象にします）"""
+    remote = True
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        time.sleep(EMBEDDING_LATENCY)
+        return super().embed(texts, task_type)
+
+    async def aembed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        await asyncio.sleep(EMBEDDING_LATENCY)
+        return super().embed(texts, task_type)
+
+providers.EMBEDDING_PROVIDERS["load_test"] = lambda api_key: StubEmbeddingProvider()
+providers.GENERATION_PROVIDERS["load_test"] = lambda api_key: providers.StubGenerationProvider(
+    latency=GENERATION_LATENCY)
+Config.EMBEDDING_PROVIDER = Config.GENERATION_PROVIDER = "load_test"
+
+app = create_app()
+# asgi_app は import 時に設定の提供元で RAG システムを作るため、提供元を差し替えた後に import する
+from asgi_app import app as asgi_app
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+JSONL / CSV / テキストファイルのディレクトリから文書を一括で取り込むスクリプト
+
+使い方:
+    python bulk_import.py corpus.jsonl                 # 1行1文書（title, content, metadata）
+    python bulk_import.py corpus.csv --content-field body
+    python bulk_import.py docs/                        # .txt / .md を再帰的に取り込む
+    python bulk_import.py corpus.jsonl --restart       # 再開位置を無視して先頭から
+    python bulk_import.py corpus.jsonl --defer-index   # ANN インデックスを外してロードし、最後に作り直す
+
+埋め込みは --concurrency 個のバッチを並行して生成し、ロードは入力順にバッチごとの
+COPY（バイナリ形式）で行います。バッチのロードと同じトランザクションで再開位置を記録するため、
+中断しても同じコマンドを再実行すれば続きから取り込みます（二重に追加されません）。
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+from dotenv import load_dotenv
+from config import Config
+from db_utils import VECTOR_TABLES
+from logging_config import setup_logging
+from rag_system import RAGSystem, is_valid_document
+
+# .envファイルから環境変数を読み込み
+load_dotenv()
+
+TEXT_EXTENSIONS = (".txt", ".md", ".markdown")
+
+def iter_jsonl(path: str) -> Iterator[Optional[Dict[str, Any]]]:
+    """JSONL の各行を文書として返します（壊れた行は None）"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+def iter_csv(path: str, title_field: str, content_field: str) -> Iterator[Dict[str, Any]]:
+    """CSV の各行を文書として返します（タイトル・本文以外の列はメタデータ）"""
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            metadata = {key: value for key, value in row.items() if key not in (title_field, content_field) and value}
+            yield {"title": row.get(title_field), "content": row.get(content_field), "metadata": metadata}
+
+def iter_directory(root: str) -> Iterator[Dict[str, Any]]:
+    """ディレクトリ以下のテキスト・Markdown ファイルをパス順に文書として返します
+
+    タイトルは Markdown の最初の見出し、無ければファイル名です。
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.lower().endswith(TEXT_EXTENSIONS))
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        relative = os.path.relpath(path, root)
+        title = os.path.splitext(os.path.basename(path))[0]
+        for line in content.splitlines():
+            if line.startswith("#"):
+                title = line.lstrip("#").strip() or title
+                break
+        yield {"title": title, "content": content, "metadata": {"source": relative}}
+
+def iter_records(path: str, fmt: str, title_field: str = "title", content_field: str = "content"):
+    """入力の形式に応じて文書を順に返します"""
+    if fmt == "auto":
+        if os.path.isdir(path):
+            fmt = "dir"
+        elif path.lower().endswith(".csv"):
+            fmt = "csv"
+        else:
+            fmt = "jsonl"
+    if fmt == "dir":
+        return iter_directory(path)
+    if fmt == "csv":
+        return iter_csv(path, title_field, content_field)
+    return iter_jsonl(path)
+
+def iter_batches(records: Iterator, batch_size: int, skip: int):
+    """skip 件を読み飛ばした後、(バッチ末尾の入力位置, 有効な文書, 不正な件数) を返します"""
+    batch: List[Dict[str, Any]] = []
+    invalid = 0
+    position = 0
+    for record in records:
+        position += 1
+        if position <= skip:
+            continue
+        if not is_valid_document(record):
+            invalid += 1
+        else:
+            batch.append({"title": str(record["title"]), "content": str(record["content"]),
+                          "metadata": record.get("metadata") or {}})
+        if len(batch) >= batch_size:
+            yield position, batch, invalid
+            batch, invalid = [], 0
+    if batch or invalid:
+        yield position, batch, invalid
+
+def run_import(rag: RAGSystem, records: Iterator, name: str, batch_size: int, concurrency: int,
+               restart: bool = False) -> bool:
+    """文書を取り込み、すべて取り込めた場合は True を返します"""
+    db = rag.db
+    if restart:
+        db.reset_import_checkpoint(name)
+    checkpoint = db.get_import_checkpoint(name)
+    if checkpoint is None:
+        return False
+    if checkpoint["position"]:
+        print(f"前回の続き（{checkpoint['position']} 件目の後）から取り込みます。")
+
+    imported = checkpoint["imported"]
+    loaded = 0
+    skipped = 0
+    started = time.monotonic()
+    in_flight = deque()
+
+    def load_oldest() -> bool:
+        nonlocal imported, loaded, skipped
+        position, batch, invalid, future = in_flight.popleft()
+        rows = future.result() if batch else []
+        if rows:
+            if not db.copy_documents(rows, checkpoint=(name, position, imported + len(rows))):
+                return False
+        elif not db.save_import_checkpoint(name, position, imported):
+            # 不正な行だけのバッチでも再開位置は進める
+            return False
+        imported += len(rows)
+        loaded += len(rows)
+        skipped += invalid
+        elapsed = time.monotonic() - started
+        print(f"取り込み済み: {imported} 件（今回 {loaded} 件, {loaded / elapsed if elapsed else 0:.1f} 件/秒, "
+              f"不正 {skipped} 件, 入力位置 {position}）")
+        return True
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        try:
+            for position, batch, invalid in iter_batches(records, batch_size, checkpoint["position"]):
+                future = pool.submit(rag.prepare_documents, batch, batch_size) if batch else None
+                in_flight.append((position, batch, invalid, future))
+                # 埋め込みは並行して進め、ロードは入力順に1バッチずつ行う
+                if len(in_flight) >= concurrency and not load_oldest():
+                    return False
+            while in_flight:
+                if not load_oldest():
+                    return False
+        except Exception as e:
+            print(f"取り込みを中断しました: {e}（再実行すると続きから取り込みます）")
+            return False
+        finally:
+            # 中断時は未着手の埋め込みを取り消す
+            for _, _, _, future in in_flight:
+                if future:
+                    future.cancel()
+
+    elapsed = time.monotonic() - started
+    print(f"取り込み完了: 今回 {loaded} 件 / {elapsed:.1f} 秒（{loaded / elapsed if elapsed else 0:.1f} 件/秒）, "
+          f"不正 {skipped} 件, 累計 {imported} 件")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="文書の一括取り込み")
+    parser.add_argument("path", help="JSONL / CSV ファイル、またはテキストファイルのディレクトリ")
+    parser.add_argument("--format", choices=["auto", "jsonl", "csv", "dir"], default="auto")
+    parser.add_argument("--name", help="再開位置の記録名（省略時は入力の絶対パス）")
+    parser.add_argument("--batch-size", type=int, default=Config.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=4, help="並行して埋め込むバッチ数")
+    parser.add_argument("--title-field", default="title")
+    parser.add_argument("--content-field", default="content")
+    parser.add_argument("--restart", action="store_true", help="再開位置を破棄して先頭から取り込む")
+    parser.add_argument("--defer-index", action="store_true",
+                        help="ANN インデックスを削除してからロードし、完了後に作り直す")
+    parser.add_argument("--cache-embeddings", action="store_true",
+                        help="生成した埋め込みを embedding_cache テーブルにも保存する")
+    args = parser.parse_args()
+    setup_logging()
+
+    rag = RAGSystem()
+    if not rag.db.connect():
+        return 1
+    # 一括取り込みの埋め込みは再利用されにくいため、既定ではDBのキャッシュに書き込まない
+    rag.embedding_cache.persist = args.cache_embeddings
+
+    defer_index = args.defer_index and rag.db.has_pgvector
+    if defer_index:
+        for table in VECTOR_TABLES:
+            rag.db.drop_vector_index(table=table)
+
+    records = iter_records(args.path, args.format, args.title_field, args.content_field)
+    success = run_import(rag, records, args.name or os.path.abspath(args.path),
+                         max(1, args.batch_size), max(1, args.concurrency), args.restart)
+
+    if defer_index:
+        for table in VECTOR_TABLES:
+            rag.db.create_vector_index(concurrently=True, table=table)
+    rag.close()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
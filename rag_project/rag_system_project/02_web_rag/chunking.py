@@ -0,0 +1,60 @@
+import re
+from typing import List, Tuple
+from config import Config
+
+# 文末とみなす位置（日本語の句点・感嘆符・疑問符と閉じ括弧、英文のピリオド、改行）
+_SENTENCE_END = re.compile(r"[。！？!?]+[」』）)]*|\.(?=\s)|\n+")
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """テキストを文単位に区切り、元テキスト上の (開始, 終了) 位置のリストを返します"""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        if text[start:end].strip():
+            spans.append((start, end))
+        start = end
+    if text[start:].strip():
+        spans.append((start, len(text)))
+    return spans
+
+def chunk_text(text: str, chunk_size: int = None, overlap: int = None) -> List[str]:
+    """テキストを文の境界で chunk_size 文字以内のチャンクに分割します
+
+    前のチャンク末尾の文のうち合計 overlap 文字以内のものを次のチャンクの先頭に重ね、
+    チャンクの境界で文脈が途切れないようにします。chunk_size を超える1文は
+    chunk_size 文字ごとに（overlap 文字ずつ重ねて）切り分けます。
+    """
+    chunk_size = chunk_size or Config.CHUNK_SIZE
+    overlap = Config.CHUNK_OVERLAP if overlap is None else overlap
+    if not 0 <= overlap < chunk_size:
+        raise ValueError(f"overlap は0以上かつ chunk_size 未満にしてください: {overlap} / {chunk_size}")
+
+    pieces = []
+    for start, end in split_sentences(text or ""):
+        while end - start > chunk_size:
+            pieces.append((start, start + chunk_size))
+            start += chunk_size - overlap
+        pieces.append((start, end))
+
+    chunks = []
+    current: List[Tuple[int, int]] = []
+    for piece in pieces:
+        if current and piece[1] - current[0][0] > chunk_size:
+            chunks.append((current[0][0], current[-1][1]))
+            # 末尾から overlap 文字に収まる文だけを次のチャンクへ持ち越す
+            carried = []
+            length = 0
+            for span in reversed(current):
+                length += span[1] - span[0]
+                if length > overlap:
+                    break
+                carried.insert(0, span)
+            current = carried
+            if current and piece[1] - current[0][0] > chunk_size:
+                current = []
+        current.append(piece)
+    if current:
+        chunks.append((current[0][0], current[-1][1]))
+
+    return [text[start:end].strip() for start, end in chunks]
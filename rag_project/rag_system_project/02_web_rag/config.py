@@ -2,6 +2,9 @@ import os
 from typing import Optional
 import urllib.parse
 
+# 検索方式の選択肢（SEARCH_MODE と /api/query の search.mode）
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+
 class Config:
     """RAGシステムの設定クラス"""
     
@@ -31,6 +34,14 @@ class Config:
         DB_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", os.getenv("DB_PASSWORD", "test1234"))
         DB_PORT: int = int(os.getenv("POSTGRES_PORT", os.getenv("DB_PORT", "5432")))
     
+    # 接続プール設定（プロセスごと。gunicornのワーカー数×最大数がDBの接続上限を超えないようにする）
+    # psycopg2のプールは返却時に最小数を超えた接続を閉じるため、最小数が常時保持される接続数になる
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # 空き接続を待つ最大秒数
+    DB_CONNECT_TIMEOUT: int = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+    DB_HEALTHCHECK_INTERVAL: float = float(os.getenv("DB_HEALTHCHECK_INTERVAL", "30"))  # この秒数以上使われていない接続は貸出前に確認
+    
     # Gemini API設定
     GOOGLE_API_KEY: Optional[str] = os.getenv("GOOGLE_API_KEY")
     
@@ -39,11 +50,89 @@ class Config:
     
     # デバッグ設定
     DEBUG: bool = not IS_PRODUCTION
+    # ログ設定（本番は INFO で文書・クエリごとの DEBUG ログを出さない。書式は json / text）
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO" if IS_PRODUCTION else "DEBUG")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "json" if IS_PRODUCTION else "text")
       # RAGシステム設定
+    # 埋め込み・回答生成の提供元（providers.py。埋め込みは gemini / local、回答生成は gemini / stub）
+    EMBEDDING_PROVIDER: str = os.getenv("EMBEDDING_PROVIDER", "gemini")
+    GENERATION_PROVIDER: str = os.getenv("GENERATION_PROVIDER", "gemini")
     EMBEDDING_MODEL: str = "text-embedding-004"
+    GENERATION_MODEL: str = os.getenv("GENERATION_MODEL", "gemini-1.5-pro-latest")
     EMBEDDING_DIMENSION: int = 768
     DEFAULT_TOP_K: int = 3
-    MAX_CONTEXT_LENGTH: int = 2000
+    # 埋め込みキャッシュ（プロセス内LRUの上限件数と、DBテーブルでの共有の有無）
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "2000"))
+    EMBEDDING_CACHE_PERSIST: bool = os.getenv("EMBEDDING_CACHE_PERSIST", "true").lower() == "true"
+    # 一括追加時に1回の埋め込みAPI呼び出し・1回のINSERTで処理する件数
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+    # 回答生成のコンテキストのトークン予算（見積もり）と、1文書あたりに最低限割り当てるトークン数
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+    CONTEXT_MIN_DOC_TOKENS: int = int(os.getenv("CONTEXT_MIN_DOC_TOKENS", "100"))
+    # 文書追加ジョブ（POST /api/documents はジョブ登録のみ行い、worker プロセスが埋め込み・挿入する）
+    # worker（ingest_worker.py）を起動しない構成でも文書を追加できるよう、既定ではリクエスト内で追加する
+    INGEST_QUEUE_ENABLED: bool = os.getenv("INGEST_QUEUE_ENABLED", "false").lower() == "true"
+    INGEST_JOB_MAX_ATTEMPTS: int = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "5"))
+    INGEST_JOB_RETRY_DELAY: float = float(os.getenv("INGEST_JOB_RETRY_DELAY", "5"))  # 再試行までの秒数（試行ごとに倍）
+    INGEST_JOB_LOCK_TIMEOUT: float = float(os.getenv("INGEST_JOB_LOCK_TIMEOUT", "600"))  # この秒数更新の無い実行中ジョブは再取得
+    INGEST_WORKER_POLL_INTERVAL: float = float(os.getenv("INGEST_WORKER_POLL_INTERVAL", "1"))
+    CHUNK_BACKFILL_INTERVAL: float = float(os.getenv("CHUNK_BACKFILL_INTERVAL", "60"))  # 既存文書のチャンク化の再確認の間隔（秒）
+    # 回答キャッシュ（質問の埋め込みのコサイン類似度がしきい値以上で、コーパスが同じ版なら回答を再利用）
+    ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_SIZE: int = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+    ANSWER_CACHE_TTL: float = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # 秒
+    ANSWER_CACHE_THRESHOLD: float = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    CORPUS_VERSION_CHECK_INTERVAL: float = float(os.getenv("CORPUS_VERSION_CHECK_INTERVAL", "1"))  # 他ワーカーの変更を確認する間隔（秒）
+    # チャンク分割（文単位で CHUNK_SIZE 文字以内にまとめ、前のチャンク末尾の CHUNK_OVERLAP 文字までを重ねる）
+    # 有効時は検索・回答生成の単位が文書全体ではなくチャンクになる
+    CHUNKING_ENABLED: bool = os.getenv("CHUNKING_ENABLED", "true").lower() == "true"
+    CHUNK_SIZE: int = int(os.getenv("CHUNK_SIZE", "500"))
+    CHUNK_OVERLAP: int = int(os.getenv("CHUNK_OVERLAP", "100"))
+    # 検索方式（hybrid: 語彙検索とベクトル検索を Reciprocal Rank Fusion で統合 / vector / lexical）
+    SEARCH_MODE: str = os.getenv("SEARCH_MODE", "hybrid")
+    HYBRID_CANDIDATES: int = int(os.getenv("HYBRID_CANDIDATES", "20"))  # 統合前に各検索から取る候補数
+    HYBRID_VECTOR_WEIGHT: float = float(os.getenv("HYBRID_VECTOR_WEIGHT", "1.0"))
+    HYBRID_LEXICAL_WEIGHT: float = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "1.0"))
+    RRF_K: int = int(os.getenv("RRF_K", "60"))
+    # 語彙検索でインデックス（pg_trgm）の絞り込みに使う語の最小文字数（3文字未満はトライグラムが作れない）
+    LEXICAL_MIN_TERM_LENGTH: int = int(os.getenv("LEXICAL_MIN_TERM_LENGTH", "3"))
+    # 起動時のデータ移行でトライグラムインデックスを作成する行数の上限（超える場合は manage_vector_index.py lexical で作成）
+    LEXICAL_INDEX_AUTO_MAX_ROWS: int = int(os.getenv("LEXICAL_INDEX_AUTO_MAX_ROWS", "50000"))
+    # MMR による再ランキング（MMR_CANDIDATES 件を取得し、重複の少ない top_k 件を選ぶ。MMR_LAMBDA=1 で無効と同じ）
+    MMR_ENABLED: bool = os.getenv("MMR_ENABLED", "true").lower() == "true"
+    MMR_LAMBDA: float = float(os.getenv("MMR_LAMBDA", "0.7"))
+    MMR_CANDIDATES: int = int(os.getenv("MMR_CANDIDATES", "20"))
+    
+    # 文書一覧API（ページサイズと本文プレビューの文字数）
+    DOCUMENT_PAGE_SIZE: int = int(os.getenv("DOCUMENT_PAGE_SIZE", "50"))
+    DOCUMENT_PAGE_SIZE_MAX: int = int(os.getenv("DOCUMENT_PAGE_SIZE_MAX", "200"))
+    DOCUMENT_PREVIEW_LENGTH: int = int(os.getenv("DOCUMENT_PREVIEW_LENGTH", "200"))
+    DOCUMENT_COUNT_CACHE_TTL: float = float(os.getenv("DOCUMENT_COUNT_CACHE_TTL", "5"))  # 文書数をプロセス内で使い回す秒数
+    
+    # 類似度指標: "inner_product"（既定） / "cosine" / "l2"
+    # ベクトルは単位長に正規化して保存するため、どの指標でも順位は同じになる
+    SIMILARITY_METRIC: str = os.getenv("SIMILARITY_METRIC", "inner_product")
+    
+    # pgvectorのANNインデックス: "hnsw"（既定） / "ivfflat" / "none"
+    ANN_INDEX_TYPE: str = os.getenv("ANN_INDEX_TYPE", "hnsw")
+    HNSW_M: int = int(os.getenv("HNSW_M", "16"))
+    HNSW_EF_CONSTRUCTION: int = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+    HNSW_EF_SEARCH: int = int(os.getenv("HNSW_EF_SEARCH", "40"))
+    IVFFLAT_LISTS: int = int(os.getenv("IVFFLAT_LISTS", "0"))  # 0の場合は行数から自動決定
+    IVFFLAT_PROBES: int = int(os.getenv("IVFFLAT_PROBES", "10"))
+    ANN_INDEX_MAINTENANCE_WORK_MEM: str = os.getenv("ANN_INDEX_MAINTENANCE_WORK_MEM", "512MB")
+    
+    # pgvector非対応時のメモリ常駐インデックスが他ワーカーの変更を確認する間隔（秒）
+    VECTOR_INDEX_SYNC_INTERVAL: float = float(os.getenv("VECTOR_INDEX_SYNC_INTERVAL", "30"))
+    # pgvector非対応時のインデックス: "ivf"（k-means分割・既定） / "flat"（総当たり）
+    FALLBACK_INDEX_TYPE: str = os.getenv("FALLBACK_INDEX_TYPE", "ivf")
+    IVF_INDEX_PATH: str = os.getenv("IVF_INDEX_PATH", os.path.join("instance", "ivf_index.npz"))
+    IVF_NLISTS: int = int(os.getenv("IVF_NLISTS", "0"))  # 0の場合は sqrt(件数)
+    IVF_NPROBE: int = int(os.getenv("IVF_NPROBE", "8"))
+    IVF_MIN_TRAIN_SIZE: int = int(os.getenv("IVF_MIN_TRAIN_SIZE", "5000"))  # これ未満は総当たり
+    IVF_RETRAIN_GROWTH: float = float(os.getenv("IVF_RETRAIN_GROWTH", "2.0"))  # 学習時の何倍で再学習するか
+    IVF_TRAIN_SAMPLES_PER_LIST: int = int(os.getenv("IVF_TRAIN_SAMPLES_PER_LIST", "64"))
+    IVF_SAVE_AFTER_CHANGES: int = int(os.getenv("IVF_SAVE_AFTER_CHANGES", "1000"))  # 未保存の変更がこの件数に達したら保存
     
     # 生成AI設定
     GENERATION_CONFIG = {
@@ -53,10 +142,30 @@ class Config:
         "max_output_tokens": 1024,
     }
     
+    @classmethod
+    def uses_gemini(cls) -> bool:
+        """埋め込み・回答生成のどちらかに Gemini API を使う（GOOGLE_API_KEY が必要な）設定かを返します"""
+        return "gemini" in (cls.EMBEDDING_PROVIDER, cls.GENERATION_PROVIDER)
+    
     @classmethod
     def validate(cls) -> bool:
         """設定の妥当性をチェックします"""
-        if not cls.GOOGLE_API_KEY:
+        if cls.uses_gemini() and not cls.GOOGLE_API_KEY:
             print("警告: GOOGLE_API_KEYが設定されていません。")
             return False
+        if cls.SIMILARITY_METRIC not in ("inner_product", "cosine", "l2"):
+            print(f"警告: SIMILARITY_METRIC '{cls.SIMILARITY_METRIC}' は未対応です。")
+            return False
+        if cls.ANN_INDEX_TYPE not in ("hnsw", "ivfflat", "none"):
+            print(f"警告: ANN_INDEX_TYPE '{cls.ANN_INDEX_TYPE}' は未対応です。")
+            return False
+        if not 0 <= cls.CHUNK_OVERLAP < cls.CHUNK_SIZE:
+            print(f"警告: CHUNK_OVERLAP ({cls.CHUNK_OVERLAP}) は0以上かつCHUNK_SIZE ({cls.CHUNK_SIZE}) 未満にしてください。")
+            return False
+        if not 0.0 <= cls.MMR_LAMBDA <= 1.0:
+            print(f"警告: MMR_LAMBDA ({cls.MMR_LAMBDA}) は0以上1以下にしてください。")
+            return False
+        if cls.SEARCH_MODE not in SEARCH_MODES:
+            print(f"警告: SEARCH_MODE ({cls.SEARCH_MODE}) は {', '.join(SEARCH_MODES)} のいずれかにしてください。")
+            return False
         return True
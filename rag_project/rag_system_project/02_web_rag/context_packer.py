@@ -0,0 +1,154 @@
+import math
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Set
+from chunking import split_sentences
+from config import Config
+
+# トークン数の見積もりに使う文字種（かな・漢字・半角カナ / 英数字の連続 / それ以外の記号）
+_CJK_CLASS = "\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff66-\uff9f"
+_CJK = re.compile("[" + _CJK_CLASS + "]")
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_SYMBOL = re.compile(r"[^\sA-Za-z0-9" + _CJK_CLASS + "]")
+_ELLIPSIS = "…"
+
+def estimate_tokens(text: str) -> int:
+    """トークン数をローカルで見積もります
+
+    かな・漢字は1文字1トークン、英数字の連続は4文字ごとに1トークン、記号は1文字1トークンとして数えます。
+    文字数で数えるより、日本語と英語が混ざった文書でモデルのトークン数に近くなります。
+    """
+    if not text:
+        return 0
+    words = sum(math.ceil(len(word) / 4) for word in _WORD.findall(text))
+    return len(_CJK.findall(text)) + words + len(_SYMBOL.findall(text))
+
+def _bigrams(text: str) -> Set[str]:
+    """空白を除いた文字 bigram の集合（単語分割なしで日本語の一致度を測るため）"""
+    normalized = "".join(unicodedata.normalize("NFKC", text).lower().split())
+    return {normalized[i:i + 2] for i in range(len(normalized) - 1)}
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """先頭から max_tokens トークン以内に収まるところまでを返します"""
+    if max_tokens <= 0:
+        return ""
+    end = len(text)
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        # 超過分に比例して縮め、最低1文字ずつ短くする
+        ratio = max_tokens / estimate_tokens(text[:end])
+        end = min(end - 1, int(end * ratio))
+    return text[:end]
+
+def best_window(text: str, query: str, max_tokens: int) -> str:
+    """text のうち、query と最もよく一致する連続した文の範囲を max_tokens トークン以内で返します
+
+    一致度は各文と query の文字 bigram の共通数の合計です。範囲が本文の一部になる場合は
+    前後に「…」を付けます（その分もトークン数に含めます）。
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max_tokens - 2 * estimate_tokens(_ELLIPSIS)
+    if limit <= 0:
+        return ""
+
+    query_bigrams = _bigrams(query)
+    sentences = [text[start:end] for start, end in split_sentences(text)]
+    # 1文だけで上限を超える場合は、その文の先頭部分を候補にする
+    cut = [estimate_tokens(s) > limit for s in sentences]
+    sentences = [_truncate_to_tokens(s, limit) if too_long else s for s, too_long in zip(sentences, cut)]
+    tokens = [estimate_tokens(s) for s in sentences]
+    scores = [len(_bigrams(s) & query_bigrams) for s in sentences]
+
+    # 一致度が同じなら、予算をより多く使う（長い）範囲を選ぶ
+    best = (-1, 0, 0, 0)  # (一致度, トークン数, 開始, 終了)
+    start = 0
+    window_tokens = 0
+    window_score = 0
+    for end, (sentence_tokens, sentence_score) in enumerate(zip(tokens, scores)):
+        window_tokens += sentence_tokens
+        window_score += sentence_score
+        while window_tokens > limit:
+            window_tokens -= tokens[start]
+            window_score -= scores[start]
+            start += 1
+        if (window_score, window_tokens) > best[:2]:
+            best = (window_score, window_tokens, start, end + 1)
+
+    _, _, start, end = best
+    if end == 0:
+        return ""
+    window = "".join(sentences[start:end]).strip()
+    prefix = _ELLIPSIS if start > 0 else ""
+    suffix = _ELLIPSIS if end < len(sentences) or cut[end - 1] else ""
+    return f"{prefix}{window}{suffix}"
+
+def _water_level(sizes: List[int], available: int) -> Optional[int]:
+    """各文書に min(サイズ, 上限) を割り当てて合計が available に収まる最大の上限を返します（全文が入るなら None）"""
+    remaining = available
+    ordered = sorted(sizes)
+    for i, size in enumerate(ordered):
+        share = remaining // (len(ordered) - i)
+        if size > share:
+            return share
+        remaining -= size
+    return None
+
+def _header(doc: Dict[str, Any]) -> str:
+    """コンテキスト内の各文書の見出し"""
+    return f"Document: {doc['title']}\nContent: "
+
+def pack_context(question: str, docs: List[Dict[str, Any]], token_budget: int = None,
+                 min_doc_tokens: int = None) -> Dict[str, Any]:
+    """検索結果をトークン予算内のコンテキストに詰めます
+
+    類似度の高い順に文書を並べ、予算を文書間で均等な上限（短い文書の余りは他へ回す）で分け合います。
+    上限を超える文書は丸ごと外すのではなく、質問と最も一致する範囲（best_window）に切り詰めます。
+    1文書あたり min_doc_tokens を確保できない場合は類似度の低い文書から外します。
+    切り詰めで余った予算は、類似度の高い文書から順に範囲を広げるのに使います。
+
+    返り値:
+        context      プロンプトに埋め込むコンテキスト
+        documents    使った文書（類似度順）と、その本文 text・トークン数 tokens・切り詰めの有無 trimmed
+        used_tokens  コンテキストの見積もりトークン数
+        budget       トークン予算
+    """
+    budget = Config.CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    min_doc_tokens = Config.CONTEXT_MIN_DOC_TOKENS if min_doc_tokens is None else min_doc_tokens
+    ranked = sorted(docs, key=lambda doc: doc.get("similarity", 0.0), reverse=True)
+    headers = [estimate_tokens(_header(doc)) for doc in ranked]
+    sizes = [estimate_tokens(doc.get("content") or "") for doc in ranked]
+
+    # 1文書あたりの上限が min_doc_tokens を下回る間は、類似度の低い文書から外す
+    count = len(ranked)
+    cap = None
+    while count:
+        available = budget - sum(headers[:count])
+        cap = _water_level(sizes[:count], available) if available > 0 else 0
+        if cap is None or cap >= min(min_doc_tokens, max(sizes[:count])) or count == 1:
+            break
+        count -= 1
+    if count and cap is not None and cap <= 0:
+        count = 0
+
+    packed = []
+    for doc, header_tokens, size in zip(ranked[:count], headers, sizes):
+        allotted = size if cap is None else min(size, cap)
+        text = best_window(doc.get("content") or "", question, allotted)
+        packed.append({"doc": doc, "text": text, "tokens": header_tokens + estimate_tokens(text),
+                       "trimmed": allotted < size})
+
+    # 範囲を文単位で選ぶため余った予算を、切り詰めた文書へ類似度順に配り直す
+    used = sum(item["tokens"] for item in packed)
+    for item, header_tokens in zip(packed, headers):
+        if not item["trimmed"] or used >= budget:
+            continue
+        limit = item["tokens"] - header_tokens + (budget - used)
+        text = best_window(item["doc"].get("content") or "", question, limit)
+        tokens = header_tokens + estimate_tokens(text)
+        if tokens > item["tokens"]:
+            used += tokens - item["tokens"]
+            item.update(text=text, tokens=tokens, trimmed=estimate_tokens(item["doc"].get("content") or "") > limit)
+
+    context = "\n".join(f"{_header(item['doc'])}{item['text']}\n" for item in packed)
+    return {"context": context, "documents": packed, "used_tokens": used, "budget": budget}
+
@@ -1,9 +1,24 @@
 import psycopg2
+import base64
+import io
 import json
+import logging
 import os
+import re
+import struct
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+from datetime import datetime
 from typing import List, Dict, Any, Optional
 from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from config import Config
+from lexical import extract_search_terms, like_pattern
+import metrics
+
+logger = logging.getLogger(__name__)
 
 # PostgreSQL データベースへの接続情報を設定します。
 # config.pyまたは環境変数で設定してください
@@ -11,230 +26,2145 @@ DB_HOST = Config.DB_HOST
 DB_NAME = Config.DB_NAME
 DB_USER = Config.DB_USER
 DB_PASSWORD = Config.DB_PASSWORD
+DB_PORT = Config.DB_PORT
+
+# 類似度指標ごとの pgvector 演算子（いずれも値が小さいほど類似）
+VECTOR_OPERATORS = {
+    "inner_product": "<#>",
+    "cosine": "<=>",
+    "l2": "<->",
+}
+
+# 類似度指標ごとの ANN インデックス用演算子クラス（検索時の演算子と対応させる）
+VECTOR_OPCLASSES = {
+    "inner_product": "vector_ip_ops",
+    "cosine": "vector_cosine_ops",
+    "l2": "vector_l2_ops",
+}
+
+ANN_INDEX_NAMES = {
+    "hnsw": "idx_documents_embedding_hnsw",
+    "ivfflat": "idx_documents_embedding_ivfflat",
+}
+
+# データ移行を1プロセスずつ実行するための pg_advisory_lock のキー（他の用途と重ならない任意の定数）
+MIGRATION_LOCK_ID = 0x52414701
+
+# 埋め込み列を持つテーブル（文書全体とチャンク）
+VECTOR_TABLES = ("documents", "document_chunks")
+
+def ann_index_name(index_type: str, table: str = "documents") -> str:
+    """テーブルごとの ANN インデックス名を返します（documents は ANN_INDEX_NAMES と同じ名前）"""
+    return f"idx_{table}_embedding_{index_type}"
+
+def check_vector_table(table: str):
+    """テーブル名を SQL に埋め込む前に許可リストと照合します"""
+    if table not in VECTOR_TABLES:
+        raise ValueError(f"未対応のテーブルです: {table}")
+
+# 検索の絞り込み条件（filter_conditions）で指定できるキー
+FILTER_KEYS = ("title", "metadata")
+
+# JSON の数値として解釈できる文字列（metadata の絞り込みで数値にも一致させる）
+_JSON_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+
+def metadata_containment(metadata: Dict[str, Any]):
+    """メタデータの絞り込み条件を、JSONB の包含（@>）で評価できる値に変換します
+    
+    値は以前の metadata->>key = str(value) と同じく文字列として比べるため、{"year": "2023"} は
+    数値で保存された 2023 にも、{"year": 2023} は文字列の "2023" にも一致します（真偽値も同様）。
+    (そのまま包含で比べられる条件の JSON, キーごとの候補の JSON の一覧) を返し、
+    後者はキーごとに候補のいずれかの包含（OR）で評価します。
+    """
+    exact: Dict[str, Any] = {}
+    alternatives: List[List[str]] = []
+    for key, value in metadata.items():
+        if value is None or isinstance(value, (dict, list)):
+            # 構造を持つ値は文字列として比べられないため、包含のまま評価する
+            exact[key] = value
+            continue
+        text = value if isinstance(value, str) else json.dumps(value)
+        candidates = [json.dumps({key: text}, ensure_ascii=False)]
+        if text in ("true", "false") or _JSON_NUMBER.fullmatch(text):
+            # 数値は桁をそのまま JSONB に渡す（float に変換すると精度が落ちる）
+            candidates.append(f"{{{json.dumps(key, ensure_ascii=False)}: {text}}}")
+        if len(candidates) == 1:
+            exact[key] = text
+        else:
+            alternatives.append(candidates)
+    exact_json = json.dumps(exact, ensure_ascii=False) if exact else None
+    return exact_json, alternatives
+
+def lexical_index_name(table: str) -> str:
+    """テーブルごとの本文のトライグラム（pg_trgm）インデックス名を返します"""
+    return f"idx_{table}_content_trgm"
+
+# search_documents の fields で指定できる列（preview は本文の先頭のみ、content_length は文字数）
+DOCUMENT_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "content": "content",
+    "preview": "left(content, %(preview_length)s)",
+    "content_length": "char_length(content)",
+    "embedding": "embedding",
+    "metadata": "metadata",
+    "created_at": "created_at",
+}
+DEFAULT_DOCUMENT_FIELDS = ["id", "title", "content", "embedding", "metadata", "created_at"]
+
+def encode_cursor(document: Dict[str, Any]) -> str:
+    """一覧の最終行から、次ページ取得用のカーソル文字列を作ります"""
+    payload = json.dumps([document["created_at"].isoformat(), document["id"]])
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    """カーソル文字列を (created_at, id) に戻します（不正な場合は ValueError）"""
+    try:
+        created_at, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), int(document_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"不正なカーソルです: {cursor}") from e
+
+# COPY ... WITH (FORMAT binary) のヘッダ（署名・フラグ・拡張領域長）と終端
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack("!h", -1)
+
+def _encode_copy_field(value, kind: str) -> bytes:
+    """1列分の値を COPY バイナリ形式（長さ + 値）にします"""
+    if value is None:
+        return struct.pack("!i", -1)
+    if kind == "int4":
+        data = struct.pack("!i", value)
+    elif kind == "text":
+        data = value.encode("utf-8")
+    elif kind == "jsonb":
+        # jsonb のバイナリ形式はバージョン番号(1) + JSON テキスト
+        data = b"\x01" + json.dumps(value, ensure_ascii=False).encode("utf-8")
+    elif kind == "vector":
+        # pgvector のバイナリ形式は 次元数(int16) + 予約(int16) + float4 の並び（ネットワークバイトオーダー）
+        vector = np.asarray(value, dtype=">f4")
+        data = struct.pack("!HH", len(vector), 0) + vector.tobytes()
+    else:
+        raise ValueError(f"未対応の型です: {kind}")
+    return struct.pack("!i", len(data)) + data
+
+def encode_copy_binary(rows: List[tuple], kinds: List[str]) -> bytes:
+    """行のリストを COPY バイナリ形式のデータにします（kinds は列ごとの型）"""
+    buffer = io.BytesIO()
+    buffer.write(_PGCOPY_HEADER)
+    field_count = struct.pack("!h", len(kinds))
+    for row in rows:
+        buffer.write(field_count)
+        for value, kind in zip(row, kinds):
+            buffer.write(_encode_copy_field(value, kind))
+    buffer.write(_PGCOPY_TRAILER)
+    return buffer.getvalue()
+
+def normalize_embedding(embedding: List[float]) -> np.ndarray:
+    """埋め込みベクトルを単位長に正規化します（ゼロベクトルはそのまま返します）"""
+    vector = np.asarray(embedding, dtype=np.float64)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector = vector / norm
+    return vector
 
 class DatabaseManager:
-    """RAGシステム用のデータベース管理クラス"""
+    """RAGシステム用のデータベース管理クラス
+    
+    接続は上限付きの ThreadedConnectionPool で管理し、各操作ごとに
+    get_connection() で1本借りて返却します。Flask の複数スレッドから
+    同じインスタンスを共有しても、接続やカーソルが混ざることはありません。
+    """
     
-    def __init__(self, host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD):
+    def __init__(self, host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT,
+                 min_size: int = Config.DB_POOL_MIN_SIZE, max_size: int = Config.DB_POOL_MAX_SIZE):
         self.host = host
         self.dbname = dbname
         self.user = user
         self.password = password
-        self.connection = None
+        self.port = port
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self.has_pgvector = False
+        self.pgvector_version: tuple = ()
+        self.has_trgm = False
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._connect_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._last_used: Dict[int, float] = {}
+        self._registered = set()
+        self._stats = {"checkouts": 0, "timeouts": 0, "discarded": 0, "wait_ms_total": 0.0}
+        self._document_count: Optional[int] = None
+        self._document_count_at = 0.0
+        self._corpus_version: Optional[int] = None
+        self._corpus_version_at = 0.0
+    
+    @property
+    def is_connected(self) -> bool:
+        """接続プールが作成済みかどうか"""
+        return self.pool is not None
     
     def connect(self):
-        """データベースに接続します"""
-        try:
-            self.connection = psycopg2.connect(
-                host=self.host,
-                dbname=self.dbname,
-                user=self.user,
-                password=self.password
-            )
-            print("PostgreSQL への接続に成功しました。")
-              # pgvector 拡張機能があるかチェックして登録を試みます
+        """接続プールを作成します（pgvectorの有無もここで判定します）"""
+        with self._connect_lock:
+            if self.pool is not None:
+                return self.pool
+            try:
+                pool = ThreadedConnectionPool(
+                    self.min_size,
+                    self.max_size,
+                    host=self.host,
+                    dbname=self.dbname,
+                    user=self.user,
+                    password=self.password,
+                    port=self.port,
+                    connect_timeout=Config.DB_CONNECT_TIMEOUT
+                )
+                logger.info("PostgreSQL への接続に成功しました。（プール %d〜%d 接続）", self.min_size, self.max_size)
+            except psycopg2.Error as e:
+                logger.error("PostgreSQL への接続中にエラーが発生しました: %s", e)
+                return None
+            
+            # pgvector 拡張機能があるかチェックして登録を試みます
+            connection = pool.getconn()
             try:
                 from pgvector.psycopg2 import register_vector
-                register_vector(self.connection)
-                print("pgvector 拡張機能が登録されました。")
+                register_vector(connection)
+                connection.commit()
+                self._registered.add(id(connection))
+                logger.info("pgvector 拡張機能が登録されました。")
                 self.has_pgvector = True
+                self.pgvector_version = self._detect_pgvector_version(connection)
             except (ImportError, Exception) as e:
-                print(f"pgvectorエラー: {e}")
-                print("pgvectorが利用できません。JSONBを使用してベクトルを保存します。")
+                logger.warning("pgvectorが利用できません。JSONBを使用してベクトルを保存します。: %s", e)
+                connection.rollback()
                 self.has_pgvector = False
+            finally:
+                self.has_trgm = self._detect_trgm(connection)
+                pool.putconn(connection)
             
-            return self.connection
-        except psycopg2.Error as e:
-            print(f"PostgreSQL への接続中にエラーが発生しました: {e}")
-            return None
+            self.pool = pool
+            # 同じプロセスの他のプール（AsyncDatabaseManager 等）の分を上書きしないよう増減で反映する
+            metrics.DB_CONNECTIONS_MAX.inc(self.max_size)
+        
+        self.run_migrations()
+        return self.pool
+    
+    @property
+    def supports_iterative_scan(self) -> bool:
+        """pgvector が反復インデックススキャン（hnsw / ivfflat.iterative_scan、0.8.0 以降）に対応しているか"""
+        return self.has_pgvector and self.pgvector_version >= (0, 8, 0)
+    
+    @staticmethod
+    def _detect_pgvector_version(connection) -> tuple:
+        """pgvector 拡張のバージョンを (メジャー, マイナー, パッチ) で返します（不明な場合は空のタプル）"""
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+            row = cursor.fetchone()
+            cursor.close()
+            connection.commit()
+            return tuple(int(part) for part in str(row[0]).split(".")[:3]) if row else ()
+        except (psycopg2.Error, ValueError):
+            connection.rollback()
+            return ()
+    
+    def ensure_connected(self) -> bool:
+        """未接続なら接続を試み、利用可能かどうかを返します（起動時にDBが落ちていた場合の再接続）"""
+        if self.pool is None and self.connect() is None:
+            logger.error("データベースに接続されていません。")
+            return False
+        return True
     
     def disconnect(self):
         """データベース接続を閉じます"""
-        if self.connection:
-            self.connection.close()
-            self.connection = None
-            print("PostgreSQL との接続を閉じました。")
+        with self._connect_lock:
+            if self.pool:
+                self.pool.closeall()
+                self.pool = None
+                metrics.DB_CONNECTIONS_MAX.dec(self.max_size)
+                self._last_used.clear()
+                self._registered.clear()
+                logger.info("PostgreSQL との接続を閉じました。")
+    
+    def _checkout(self):
+        """プールから健全な接続を1本借ります（上限到達時は DB_POOL_TIMEOUT 秒まで待機）"""
+        if not self.ensure_connected():
+            raise PoolError("データベースに接続されていません")
+        
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=Config.DB_POOL_TIMEOUT):
+            with self._stats_lock:
+                self._stats["timeouts"] += 1
+            metrics.DB_POOL_TIMEOUTS.inc()
+            raise PoolError(f"接続プールの空き待ちが {Config.DB_POOL_TIMEOUT} 秒を超えました")
+        
+        try:
+            for _ in range(self.max_size + 1):
+                connection = self.pool.getconn()
+                if self._is_healthy(connection):
+                    break
+                self._discard(connection)
+            else:
+                raise PoolError("健全な接続を取得できませんでした")
+            
+            if self.has_pgvector and id(connection) not in self._registered:
+                from pgvector.psycopg2 import register_vector
+                register_vector(connection)
+                self._registered.add(id(connection))
+        except Exception:
+            self._slots.release()
+            raise
+        
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_ms_total"] += waited * 1000
+        metrics.DB_POOL_WAIT.observe(waited)
+        metrics.DB_CONNECTIONS_IN_USE.inc()
+        return connection
+    
+    def _is_healthy(self, connection) -> bool:
+        """切断済みの接続や、一定時間使われていない接続の生存を確認します"""
+        if connection.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(connection), 0.0)
+        if idle < Config.DB_HEALTHCHECK_INTERVAL:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+    
+    def _discard(self, connection):
+        """壊れた接続を閉じてプールから外します（次回の取得時に新しい接続が作られます）"""
+        self._last_used.pop(id(connection), None)
+        self._registered.discard(id(connection))
+        with self._stats_lock:
+            self._stats["discarded"] += 1
+        try:
+            self.pool.putconn(connection, close=True)
+        except PoolError:
+            pass
+    
+    def _checkin(self, connection):
+        """接続をプールに返却します（未完了のトランザクションはロールバック）"""
+        try:
+            if connection.closed:
+                self._discard(connection)
+                return
+            try:
+                if connection.status != psycopg2.extensions.STATUS_READY:
+                    connection.rollback()
+            except psycopg2.Error:
+                self._discard(connection)
+                return
+            self._last_used[id(connection)] = time.monotonic()
+            self.pool.putconn(connection)
+        finally:
+            self._slots.release()
+            metrics.DB_CONNECTIONS_IN_USE.dec()
+    
+    @contextmanager
+    def get_connection(self):
+        """操作1回分の接続を借りるコンテキストマネージャ"""
+        connection = self._checkout()
+        try:
+            yield connection
+        finally:
+            self._checkin(connection)
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """接続プールの利用状況を返します（ワーカー数・プールサイズの調整用）"""
+        in_use = len(self.pool._used) if self.pool else 0
+        idle = len(self.pool._pool) if self.pool else 0
+        with self._stats_lock:
+            stats = dict(self._stats)
+        checkouts = stats["checkouts"]
+        return {
+            "connected": self.pool is not None,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "in_use": in_use,
+            "idle": idle,
+            "checkouts": checkouts,
+            "timeouts": stats["timeouts"],
+            "discarded": stats["discarded"],
+            "avg_wait_ms": stats["wait_ms_total"] / checkouts if checkouts else 0.0,
+        }
     
     def create_documents_table(self):
         """文書保存用のテーブルを作成します"""
-        if not self.connection:
-            print("データベースに接続されていません。")
+        if not self.ensure_connected():
             return False
         
         try:
-            cursor = self.connection.cursor()
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                
+                if self.has_pgvector:
+                    # pgvectorを使用する場合
+                    cursor.execute("""
+                    CREATE EXTENSION IF NOT EXISTS vector;
+                    """)
+                    
+                    cursor.execute("""
+                    DROP TABLE IF EXISTS chunk_backfill_failures;
+                    DROP TABLE IF EXISTS document_chunks;
+                    DROP TABLE IF EXISTS documents;
+                    CREATE TABLE documents (
+                        id SERIAL PRIMARY KEY,
+                        title TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        embedding vector(768),  -- Gemini embedding dimensions
+                        metadata JSONB,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                    """)
+                else:
+                    # JSONBを使用する場合
+                    cursor.execute("""
+                    DROP TABLE IF EXISTS chunk_backfill_failures;
+                    DROP TABLE IF EXISTS document_chunks;
+                    DROP TABLE IF EXISTS documents;
+                    CREATE TABLE documents (
+                        id SERIAL PRIMARY KEY,
+                        title TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        embedding JSONB,  -- ベクトル埋め込みをJSONBとして保存
+                        metadata JSONB,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    );
+                    """)
+                # インデックスを作成（検索性能向上のため）
+                cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_documents_title ON documents(title);
+                CREATE INDEX IF NOT EXISTS idx_documents_metadata ON documents USING GIN(metadata);
+                CREATE INDEX IF NOT EXISTS idx_documents_created_at_id ON documents(created_at DESC, id DESC);
+                """)
+                
+                connection.commit()
+                cursor.close()
+                self._migrate_create_document_chunks(connection)
+                self._migrate_create_chunk_backfill_failures(connection)
+                # テーブルを作り直すとトリガーも消えるため、件数カウンタを毎回設置し直す
+                self._migrate_create_document_counter(connection)
+                self.has_trgm = self._create_lexical_indexes(connection, concurrently=False)
+            self._document_count = None
+            logger.info("documentsテーブルが正常に作成されました。")
             
+            # 空のテーブルなのでロックの心配はなく、通常のCREATE INDEXで作成する
             if self.has_pgvector:
-                # pgvectorを使用する場合
+                self.create_vector_index(concurrently=False)
+            
+            # 新規テーブルには移行不要の行しかないため、移行済みとして記録する
+            self.run_migrations()
+            return True
+        except psycopg2.Error as e:
+            logger.error("テーブル作成中にエラーが発生しました: %s", e)
+            return False
+    
+    def _vector_index_sql(self, index_type: str, name: str, concurrently: bool, row_count: int,
+                          table: str = "documents") -> str:
+        """設定に応じた ANN インデックス作成文を組み立てます"""
+        opclass = VECTOR_OPCLASSES.get(Config.SIMILARITY_METRIC, "vector_ip_ops")
+        mode = "CONCURRENTLY " if concurrently else ""
+        if index_type == "hnsw":
+            options = f"m = {int(Config.HNSW_M)}, ef_construction = {int(Config.HNSW_EF_CONSTRUCTION)}"
+        else:
+            # pgvector の推奨値: 100万行までは 行数/1000、それ以上は sqrt(行数)
+            lists = Config.IVFFLAT_LISTS
+            if lists <= 0:
+                lists = row_count // 1000 if row_count <= 1_000_000 else int(row_count ** 0.5)
+            options = f"lists = {max(1, int(lists))}"
+        return (f"CREATE INDEX {mode}IF NOT EXISTS {name} ON {table} "
+                f"USING {index_type} (embedding {opclass}) WITH ({options})")
+    
+    def create_vector_index(self, concurrently: bool = True, table: str = "documents"):
+        """ANN_INDEX_TYPE に従って table の埋め込み列に ANN インデックスを作成します
+        
+        concurrently=True の場合は CREATE INDEX CONCURRENTLY を使い、
+        作成中も文書の追加・削除をブロックしません（トランザクション外で実行します）。
+        """
+        index_type = Config.ANN_INDEX_TYPE
+        if not self.has_pgvector or index_type not in ANN_INDEX_NAMES:
+            logger.info("ANNインデックスは作成しません（pgvector: %s, 種類: %s）", self.has_pgvector, index_type)
+            return False
+        check_vector_table(table)
+        if not self.ensure_connected():
+            return False
+        
+        name = ann_index_name(index_type, table)
+        try:
+            with self.get_connection() as connection:
+                connection.autocommit = True
+                try:
+                    cursor = connection.cursor()
+                    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                    row_count = cursor.fetchone()[0]
+                    cursor.execute("SET maintenance_work_mem = %s", (Config.ANN_INDEX_MAINTENANCE_WORK_MEM,))
+                    logger.info("ANNインデックス %s を作成中...（%d 行）", name, row_count)
+                    cursor.execute(self._vector_index_sql(index_type, name, concurrently, row_count, table))
+                    cursor.execute("RESET maintenance_work_mem")
+                    cursor.close()
+                finally:
+                    connection.autocommit = False
+            logger.info("ANNインデックス %s を作成しました。", name)
+            return True
+        except psycopg2.Error as e:
+            logger.error("ANNインデックス作成中にエラーが発生しました: %s", e)
+            return False
+    
+    def drop_vector_index(self, index_type: str = None, table: str = "documents"):
+        """table の ANN インデックスを削除します（index_type 省略時はすべての種類）"""
+        check_vector_table(table)
+        if not self.ensure_connected():
+            return False
+        
+        index_types = [index_type] if index_type else list(ANN_INDEX_NAMES)
+        names = [ann_index_name(name, table) for name in index_types]
+        try:
+            with self.get_connection() as connection:
+                connection.autocommit = True
+                try:
+                    cursor = connection.cursor()
+                    for name in names:
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                    cursor.close()
+                finally:
+                    connection.autocommit = False
+            logger.info("ANNインデックスを削除しました: %s", ", ".join(names))
+            return True
+        except psycopg2.Error as e:
+            logger.error("ANNインデックス削除中にエラーが発生しました: %s", e)
+            return False
+    
+    def rebuild_vector_index(self, table: str = "documents"):
+        """table の ANN インデックスを書き込みを止めずに作り直します
+        
+        同じ種類のインデックスがあれば REINDEX CONCURRENTLY、無ければ新しく作成してから
+        他の種類のインデックスを削除します。IVFFlat のリスト数を行数に合わせ直す場合にも使います。
+        """
+        index_type = Config.ANN_INDEX_TYPE
+        if not self.ensure_connected():
+            return False
+        
+        status = self.get_vector_index_status(table)
+        existing = {index["name"] for index in status}
+        name = ann_index_name(index_type, table) if index_type in ANN_INDEX_NAMES else None
+        
+        if name in existing and index_type == "ivfflat":
+            # リスト数は作成時に決まるため、作り直しは削除と再作成で行う
+            if not self.drop_vector_index(index_type, table):
+                return False
+            existing.discard(name)
+        
+        if name in existing:
+            try:
+                with self.get_connection() as connection:
+                    connection.autocommit = True
+                    try:
+                        cursor = connection.cursor()
+                        logger.info("ANNインデックス %s を再構築中...", name)
+                        cursor.execute(f"REINDEX INDEX CONCURRENTLY {name}")
+                        cursor.close()
+                    finally:
+                        connection.autocommit = False
+            except psycopg2.Error as e:
+                logger.error("ANNインデックス再構築中にエラーが発生しました: %s", e)
+                return False
+        elif name and not self.create_vector_index(concurrently=True, table=table):
+            return False
+        
+        for other_type in ANN_INDEX_NAMES:
+            if other_type != index_type and ann_index_name(other_type, table) in existing:
+                self.drop_vector_index(other_type, table)
+        logger.info("ANNインデックスの再構築が完了しました。")
+        return True
+    
+    def get_vector_index_status(self, table: str = "documents") -> List[Dict[str, Any]]:
+        """table にある ANN インデックスの名前・定義・サイズ・有効状態を返します"""
+        check_vector_table(table)
+        if not self.ensure_connected():
+            return []
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
                 cursor.execute("""
-                CREATE EXTENSION IF NOT EXISTS vector;
-                """)
+                SELECT c.relname, pg_get_indexdef(i.indexrelid),
+                       pg_size_pretty(pg_relation_size(i.indexrelid)), i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE i.indrelid = %s::regclass AND c.relname = ANY(%s)
+                """, (table, [ann_index_name(index_type, table) for index_type in ANN_INDEX_NAMES]))
+                rows = cursor.fetchall()
+                cursor.close()
+            return [
+                {"name": row[0], "definition": row[1], "size": row[2], "valid": row[3]}
+                for row in rows
+            ]
+        except psycopg2.Error as e:
+            logger.error("ANNインデックス情報の取得中にエラーが発生しました: %s", e)
+            return []
+    
+    def run_migrations(self):
+        """未適用のデータ移行を一度だけ実行します（schema_migrations テーブルで管理）
+        
+        connect() は各ワーカー・取り込みワーカー・一括取り込みのプロセスでそれぞれ呼ばれるため、
+        移行は pg_advisory_lock で1プロセスずつ実行し、ロックを取った後に適用済みの一覧を読み直します
+        （先に取ったプロセスが適用した移行は実行しません）。すべて適用済みならロックを取りません。
+        """
+        if not self.is_connected:
+            return False
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT to_regclass('documents') IS NOT NULL")
+                if not cursor.fetchone()[0]:
+                    # documentsテーブルがまだ無い場合は作成時に改めて実行する
+                    cursor.close()
+                    connection.commit()
+                    return True
                 
                 cursor.execute("""
-                DROP TABLE IF EXISTS documents;
-                CREATE TABLE documents (
-                    id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    embedding vector(768),  -- Gemini embedding dimensions
-                    metadata JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 );
                 """)
-            else:
-                # JSONBを使用する場合
-                cursor.execute("""
-                DROP TABLE IF EXISTS documents;
-                CREATE TABLE documents (
-                    id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    embedding JSONB,  -- ベクトル埋め込みをJSONBとして保存
-                    metadata JSONB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                """)            # インデックスを作成（検索性能向上のため）
+                migrations = self._migrations()
+                applied = self._applied_migrations(cursor)
+                pending = [name for name, _ in migrations if name not in applied]
+                cursor.close()
+                connection.commit()
+                if not pending:
+                    return True
+                
+                with self._migration_lock(connection):
+                    # 待っている間に他のプロセスが適用した移行は飛ばす
+                    cursor = connection.cursor()
+                    applied = self._applied_migrations(cursor)
+                    cursor.close()
+                    connection.commit()
+                    for name, migration in migrations:
+                        if name in applied:
+                            continue
+                        logger.info("データ移行 '%s' を実行します...", name)
+                        migration(connection)
+                        cursor = connection.cursor()
+                        cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s) ON CONFLICT DO NOTHING",
+                                       (name,))
+                        cursor.close()
+                        connection.commit()
+                        logger.info("データ移行 '%s' が完了しました。", name)
+            return True
+        except psycopg2.Error as e:
+            logger.error("データ移行中にエラーが発生しました: %s", e)
+            return False
+    
+    @staticmethod
+    @contextmanager
+    def _migration_lock(connection):
+        """データ移行・インデックス作成を1プロセスずつ行うためのセッション単位の advisory lock"""
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        cursor.close()
+        connection.commit()
+        try:
+            yield
+        finally:
+            # ロックはセッション単位のため、失敗時もトランザクションを戻してから解放する
+            connection.rollback()
+            cursor = connection.cursor()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            cursor.close()
+            connection.commit()
+    
+    def _migrations(self) -> List[tuple]:
+        """(移行名, 実行する関数) の一覧を適用する順に返します"""
+        return [
+            ("normalize_embeddings", self._migrate_normalize_embeddings),
+            ("create_embedding_cache", self._migrate_create_embedding_cache),
+            ("create_listing_index", self._migrate_create_listing_index),
+            ("create_document_counter", self._migrate_create_document_counter),
+            ("create_document_chunks", self._migrate_create_document_chunks),
+            ("add_corpus_version", self._migrate_create_document_counter),
+            ("create_ingest_jobs", self._migrate_create_ingest_jobs),
+            ("create_import_checkpoints", self._migrate_create_import_checkpoints),
+            ("create_lexical_indexes", self._migrate_create_lexical_indexes),
+            ("create_title_trigram_index", self._migrate_create_lexical_indexes),
+            ("create_chunk_backfill_failures", self._migrate_create_chunk_backfill_failures),
+        ]
+    
+    @staticmethod
+    def _applied_migrations(cursor) -> set:
+        cursor.execute("SELECT name FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
+    
+    def _migrate_normalize_embeddings(self, connection, batch_size: int = 500):
+        """既存の埋め込みベクトルを単位長に正規化して保存し直します"""
+        vector_type = "vector" if self.has_pgvector else "jsonb"
+        last_id = 0
+        while True:
+            cursor = connection.cursor()
             cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_documents_title ON documents(title);
-            CREATE INDEX IF NOT EXISTS idx_documents_metadata ON documents USING GIN(metadata);
-            """)
+            SELECT id, embedding::text FROM documents
+            WHERE id > %s AND embedding IS NOT NULL
+            ORDER BY id LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                cursor.close()
+                break
             
-            self.connection.commit()
+            values = []
+            for doc_id, embedding_text in rows:
+                vector = normalize_embedding(np.fromstring(embedding_text.strip("[]"), sep=","))
+                values.append((doc_id, json.dumps(vector.tolist())))
+            execute_values(cursor, f"""
+            UPDATE documents AS d SET embedding = v.embedding::{vector_type}
+            FROM (VALUES %s) AS v(id, embedding)
+            WHERE d.id = v.id
+            """, values)
+            cursor.close()
+            connection.commit()
+            last_id = rows[-1][0]
+
+    def _migrate_create_embedding_cache(self, connection):
+        """埋め込みキャッシュ用のテーブルを作成します（ワーカー間・再起動後で共有）"""
+        cursor = connection.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model TEXT NOT NULL,
+            task_type TEXT NOT NULL,
+            text_hash CHAR(64) NOT NULL,
+            embedding REAL[] NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (model, task_type, text_hash)
+        );
+        """)
+        cursor.close()
+        connection.commit()
+    
+    def _migrate_create_listing_index(self, connection):
+        """一覧のキーセットページング用に (created_at, id) のインデックスを作成します"""
+        cursor = connection.cursor()
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_documents_created_at_id ON documents(created_at DESC, id DESC);
+        """)
+        cursor.close()
+        connection.commit()
+    
+    def _migrate_create_document_counter(self, connection):
+        """文書数とコーパスのバージョンをトリガーで保持するカウンタを設置します（何度実行しても同じ状態になります）
+        
+        行ごとではなく文単位のトリガーで遷移テーブルの件数を加減するため、
+        一括INSERTでもカウンタの更新は1文につき1回で済みます。
+        version は documents・document_chunks が変更されるたびに増え、回答キャッシュの無効化に使います。
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS document_stats (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            document_count BIGINT NOT NULL DEFAULT 0
+        );
+        ALTER TABLE document_stats ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0;
+        
+        CREATE OR REPLACE FUNCTION document_stats_on_insert() RETURNS trigger AS $$
+        BEGIN
+            UPDATE document_stats SET document_count = document_count + (SELECT COUNT(*) FROM inserted_rows),
+                                      version = version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        CREATE OR REPLACE FUNCTION document_stats_on_delete() RETURNS trigger AS $$
+        BEGIN
+            UPDATE document_stats SET document_count = document_count - (SELECT COUNT(*) FROM deleted_rows),
+                                      version = version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        CREATE OR REPLACE FUNCTION document_stats_on_truncate() RETURNS trigger AS $$
+        BEGIN
+            UPDATE document_stats SET document_count = 0, version = version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        CREATE OR REPLACE FUNCTION document_stats_bump_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE document_stats SET version = version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        
+        DROP TRIGGER IF EXISTS trg_document_stats_insert ON documents;
+        CREATE TRIGGER trg_document_stats_insert AFTER INSERT ON documents
+            REFERENCING NEW TABLE AS inserted_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION document_stats_on_insert();
+        
+        DROP TRIGGER IF EXISTS trg_document_stats_delete ON documents;
+        CREATE TRIGGER trg_document_stats_delete AFTER DELETE ON documents
+            REFERENCING OLD TABLE AS deleted_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION document_stats_on_delete();
+        
+        DROP TRIGGER IF EXISTS trg_document_stats_truncate ON documents;
+        CREATE TRIGGER trg_document_stats_truncate AFTER TRUNCATE ON documents
+            FOR EACH STATEMENT EXECUTE FUNCTION document_stats_on_truncate();
+        """)
+        # チャンクだけの追加（既存文書のチャンク化）でも検索結果は変わるため版を上げる
+        cursor.execute("SELECT to_regclass('document_chunks') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute("""
+            DROP TRIGGER IF EXISTS trg_document_chunks_version ON document_chunks;
+            CREATE TRIGGER trg_document_chunks_version AFTER INSERT OR DELETE ON document_chunks
+                FOR EACH STATEMENT EXECUTE FUNCTION document_stats_bump_version();
+            """)
+        # トリガー設置と同じトランザクションで現在の件数に合わせる
+        cursor.execute("LOCK TABLE documents IN SHARE MODE")
+        cursor.execute("""
+        INSERT INTO document_stats (id, document_count) VALUES (TRUE, (SELECT COUNT(*) FROM documents))
+        ON CONFLICT (id) DO UPDATE SET document_count = EXCLUDED.document_count
+        """)
+        cursor.close()
+        connection.commit()
+    
+    def _migrate_create_document_chunks(self, connection):
+        """チャンク保存用の document_chunks テーブルを作成します（文書の削除に連動して消えます）"""
+        embedding_type = "vector(768)" if self.has_pgvector else "JSONB"
+        cursor = connection.cursor()
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            id SERIAL PRIMARY KEY,
+            document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            embedding {embedding_type},
+            UNIQUE (document_id, chunk_index)
+        );
+        """)
+        index_type = Config.ANN_INDEX_TYPE
+        if self.has_pgvector and index_type in ANN_INDEX_NAMES:
+            # 作成直後の空テーブルなので、同じトランザクション内で通常のCREATE INDEXを使う
+            cursor.execute(self._vector_index_sql(
+                index_type, ann_index_name(index_type, "document_chunks"), False, 0, "document_chunks"))
+        cursor.close()
+        connection.commit()
+    
+    def _migrate_create_ingest_jobs(self, connection):
+        """文書追加ジョブのキューとなる ingest_jobs テーブルを作成します"""
+        cursor = connection.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'queued',  -- queued / running / succeeded / failed
+            payload JSONB NOT NULL,                 -- 追加する文書のリスト
+            results JSONB NOT NULL DEFAULT '[]',    -- 文書ごとの結果（document_id または error）
+            total INTEGER NOT NULL,
+            processed INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            last_error TEXT,
+            run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_ingest_jobs_pending ON ingest_jobs(run_after, id)
+            WHERE status IN ('queued', 'running');
+        """)
+        cursor.close()
+        connection.commit()
+    
+    def _migrate_create_chunk_backfill_failures(self, connection):
+        """既存の文書のチャンク化に失敗した文書を記録する chunk_backfill_failures テーブルを作成します"""
+        cursor = connection.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_backfill_failures (
+            document_id INTEGER PRIMARY KEY REFERENCES documents(id) ON DELETE CASCADE,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            last_error TEXT,
+            retry_after TIMESTAMP,                 -- この時刻まで飛ばす（NULL は再試行しない）
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        cursor.close()
+        connection.commit()
+    
+    def _migrate_create_import_checkpoints(self, connection):
+        """一括取り込みの再開位置を記録する import_checkpoints テーブルを作成します"""
+        cursor = connection.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            name TEXT PRIMARY KEY,
+            position BIGINT NOT NULL DEFAULT 0,   -- 取り込み済みの入力レコード数
+            imported BIGINT NOT NULL DEFAULT 0,   -- 追加した文書数
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+        cursor.close()
+        connection.commit()
+    
+    def _migrate_create_lexical_indexes(self, connection):
+        """語彙検索・タイトル絞り込み用の pg_trgm 拡張とトライグラムインデックスを既存のテーブルに作成します
+        
+        移行はアプリの起動時（最初のリクエスト）に走るため、インデックスを作るのは行数が
+        LEXICAL_INDEX_AUTO_MAX_ROWS 以下の場合だけです。大きなテーブルでは拡張だけを作成し
+        （語彙検索はインデックス無しで動きます）、インデックスは manage_vector_index.py lexical で作成します。
+        """
+        cursor = connection.cursor()
+        cursor.execute("""
+        SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0)::bigint FROM pg_class
+        WHERE oid IN (to_regclass('documents'), to_regclass('document_chunks'))
+        """)
+        estimated_rows = cursor.fetchone()[0]
+        cursor.close()
+        connection.commit()
+        build_indexes = estimated_rows <= Config.LEXICAL_INDEX_AUTO_MAX_ROWS
+        if not build_indexes:
+            logger.warning("文書が多い（推定 %d 行）ため、起動時にはトライグラムインデックスを作成しません。"
+                           "python manage_vector_index.py lexical で作成してください。", estimated_rows)
+        if self._create_lexical_indexes(connection, concurrently=True, build_indexes=build_indexes):
+            self.has_trgm = True
+    
+    @staticmethod
+    def _lexical_indexes() -> List[tuple]:
+        """トライグラムインデックスの (名前, テーブル, 列) の一覧"""
+        indexes = [(lexical_index_name(table), table, "content") for table in VECTOR_TABLES]
+        # タイトルの部分一致による絞り込み（search の filters.title）用
+        indexes.append(("idx_documents_title_trgm", "documents", "title"))
+        return indexes
+    
+    def _create_lexical_indexes(self, connection, concurrently: bool = True, build_indexes: bool = True) -> bool:
+        """pg_trgm 拡張と、documents / document_chunks の本文・documents のタイトルの GIN トライグラムインデックスを作成します
+        
+        トライグラムは文字単位で作られるため、単語分割器の無い日本語でも部分一致（ILIKE）の
+        絞り込みにインデックスが使えます。拡張を作成できない（権限が無い等）場合は False を返し、
+        語彙検索は無効のままになります（後から manage_vector_index.py lexical で作成できます）。
+        CREATE INDEX CONCURRENTLY が中断されると無効（indisvalid = false）なインデックスが残り、
+        IF NOT EXISTS では作り直されないため、無効なものは削除してから作成し直します。
+        """
+        cursor = connection.cursor()
+        try:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            connection.commit()
+        except psycopg2.Error as e:
+            connection.rollback()
+            cursor.close()
+            logger.warning("pg_trgm 拡張を作成できないため、語彙検索は無効になります: %s", e)
+            return False
+        if not build_indexes:
             cursor.close()
-            print("documentsテーブルが正常に作成されました。")
             return True
+        
+        mode = "CONCURRENTLY " if concurrently else ""
+        # CREATE INDEX CONCURRENTLY はトランザクション内で実行できない
+        connection.autocommit = concurrently
+        try:
+            for name, table, column in self._lexical_indexes():
+                cursor.execute("""
+                SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.oid = to_regclass(%s)
+                """, (name,))
+                row = cursor.fetchone()
+                if row and row[0]:
+                    continue
+                if row:
+                    logger.warning("無効なトライグラムインデックス %s を作り直します。", name)
+                    cursor.execute(f"DROP INDEX {mode}IF EXISTS {name}")
+                cursor.execute(f"CREATE INDEX {mode}IF NOT EXISTS {name} ON {table} USING gin ({column} gin_trgm_ops)")
+        finally:
+            cursor.close()
+            if concurrently:
+                connection.autocommit = False
+        connection.commit()
+        return True
+    
+    def create_lexical_indexes(self) -> bool:
+        """語彙検索用の拡張とインデックスを作成します（作成済みなら何もせず、無効なインデックスは作り直します）
+        
+        データ移行と同じ advisory lock の中で作成するため、起動時の移行と同時には走りません。
+        """
+        if not self.ensure_connected():
+            return False
+        try:
+            with self.get_connection() as connection, self._migration_lock(connection):
+                created = self._create_lexical_indexes(connection, concurrently=True)
         except psycopg2.Error as e:
-            print(f"テーブル作成中にエラーが発生しました: {e}")
-            if self.connection:
-                self.connection.rollback()
+            logger.error("トライグラムインデックス作成中にエラーが発生しました: %s", e)
             return False
-
+        self.has_trgm = self.has_trgm or created
+        return created
+    
+    @staticmethod
+    def _detect_trgm(connection) -> bool:
+        """pg_trgm 拡張が作成済みかどうかを返します"""
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            available = bool(cursor.fetchone()[0])
+            cursor.close()
+            connection.commit()
+            return available
+        except psycopg2.Error as e:
+            logger.error("pg_trgm の確認中にエラーが発生しました: %s", e)
+            connection.rollback()
+            return False
+    
+    def count_documents(self, mode: str = "cached") -> int:
+        """文書数を返します
+        
+        mode:
+            "cached"   プロセス内の値（DOCUMENT_COUNT_CACHE_TTL 秒以内）か、トリガーで保持している
+                       document_stats の1行を読むだけの O(1) な件数（既定）
+            "exact"    COUNT(*) による厳密な件数（全件走査）
+            "estimate" pg_class.reltuples による統計上の推定値（巨大なテーブル向け、ANALYZE 時点の値）
+        失敗時は -1 を返します。
+        """
+        now = time.monotonic()
+        if mode == "cached" and self._document_count is not None \
+                and now - self._document_count_at < Config.DOCUMENT_COUNT_CACHE_TTL:
+            return self._document_count
+        if not self.ensure_connected():
+            return -1
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                count = None
+                if mode == "estimate":
+                    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'documents'::regclass")
+                    row = cursor.fetchone()
+                    # 一度も ANALYZE されていない場合は -1 になるため厳密な件数で代用する
+                    if row and row[0] >= 0:
+                        count = int(row[0])
+                elif mode == "cached":
+                    cursor.execute("SELECT to_regclass('document_stats') IS NOT NULL")
+                    if cursor.fetchone()[0]:
+                        cursor.execute("SELECT document_count FROM document_stats")
+                        row = cursor.fetchone()
+                        count = int(row[0]) if row else None
+                if count is None:
+                    cursor.execute("SELECT COUNT(*) FROM documents")
+                    count = int(cursor.fetchone()[0])
+                cursor.close()
+            
+            if mode != "estimate":
+                self._document_count = count
+                self._document_count_at = now
+            return count
+        except psycopg2.Error as e:
+            logger.error("文書数の取得中にエラーが発生しました: %s", e)
+            return -1
+    
+    def _adjust_document_count(self, delta: int):
+        """自プロセスでの追加・削除をキャッシュ済みの件数に即時反映します"""
+        if self._document_count is not None:
+            self._document_count = max(0, self._document_count + delta)
+        # バージョンは次回の参照時に読み直させる
+        self._corpus_version = None
+    
+    def cached_corpus_version(self) -> Optional[int]:
+        """CORPUS_VERSION_CHECK_INTERVAL 秒以内に読んだコーパスのバージョンを返します（無ければ None）
+        
+        DB には問い合わせません。非同期版（AsyncDatabaseManager）もこの値を共有します。
+        """
+        if self._corpus_version is None:
+            return None
+        if time.monotonic() - self._corpus_version_at >= Config.CORPUS_VERSION_CHECK_INTERVAL:
+            return None
+        return self._corpus_version
+    
+    def remember_corpus_version(self, version: int, read_at: float):
+        """DB から読んだコーパスのバージョンを、読み始めた時刻（time.monotonic()）と合わせて保持します"""
+        self._corpus_version = version
+        self._corpus_version_at = read_at
+    
+    def get_corpus_version(self) -> Optional[int]:
+        """コーパスのバージョン（文書・チャンクの変更ごとに増える値）を返します
+        
+        CORPUS_VERSION_CHECK_INTERVAL 秒以内はプロセス内の値を使います。
+        カウンタが無い・取得に失敗した場合は None を返します。
+        """
+        cached = self.cached_corpus_version()
+        if cached is not None:
+            return cached
+        now = time.monotonic()
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT to_regclass('document_stats') IS NOT NULL")
+                row = None
+                if cursor.fetchone()[0]:
+                    cursor.execute("SELECT version FROM document_stats")
+                    row = cursor.fetchone()
+                cursor.close()
+            if not row:
+                return None
+            self.remember_corpus_version(int(row[0]), now)
+            return self._corpus_version
+        except psycopg2.Error as e:
+            logger.error("コーパスのバージョン取得中にエラーが発生しました: %s", e)
+            return None
+    
+    def get_cached_embeddings(self, model: str, task_type: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """埋め込みキャッシュから該当するベクトルを {text_hash: embedding} で返します"""
+        if not self.is_connected or not text_hashes:
+            return {}
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                SELECT text_hash, embedding FROM embedding_cache
+                WHERE model = %s AND task_type = %s AND text_hash = ANY(%s)
+                """, (model, task_type, list(text_hashes)))
+                found = {row[0]: row[1] for row in cursor.fetchall()}
+                cursor.close()
+            return found
+        except psycopg2.Error as e:
+            logger.error("埋め込みキャッシュの参照中にエラーが発生しました: %s", e)
+            return {}
+    
+    def put_cached_embeddings(self, model: str, task_type: str, items: List[tuple]):
+        """(text_hash, embedding) のリストを埋め込みキャッシュに登録します"""
+        if not self.is_connected or not items:
+            return False
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                execute_values(cursor, """
+                INSERT INTO embedding_cache (model, task_type, text_hash, embedding)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                """, [(model, task_type, digest, embedding) for digest, embedding in items],
+                    template="(%s, %s, %s, %s::real[])", page_size=len(items))
+                cursor.close()
+                connection.commit()
+            return True
+        except psycopg2.Error as e:
+            logger.error("埋め込みキャッシュの登録中にエラーが発生しました: %s", e)
+            return False
+    
+    def _embedding_value(self, embedding: List[float]):
+        """正規化したベクトルを埋め込み列の型（vector / JSONB）に合わせた値にします"""
+        vector = normalize_embedding(embedding)
+        if self.has_pgvector:
+            return vector.astype(np.float32)
+        return json.dumps(vector.tolist())
+    
+    def _insert_chunk_rows(self, cursor, rows: List[tuple]) -> List[int]:
+        """(document_id, chunk_index, content, embedding) の行を1文で挿入し、チャンクIDを返します"""
+        if not rows:
+            return []
+        template = "(%s, %s, %s, %s)" if self.has_pgvector else "(%s, %s, %s, %s::jsonb)"
+        values = [
+            (document_id, chunk_index, content, self._embedding_value(embedding))
+            for document_id, chunk_index, content, embedding in rows
+        ]
+        inserted = execute_values(cursor, """
+        INSERT INTO document_chunks (document_id, chunk_index, content, embedding)
+        VALUES %s
+        RETURNING id
+        """, values, template=template, page_size=len(values), fetch=True)
+        return [row[0] for row in inserted]
+    
+    def insert_chunks(self, document_id: int, chunks: List[tuple]) -> List[int]:
+        """既存の文書に (content, embedding) のチャンクを追加し、チャンクIDを返します（失敗時は空）"""
+        if not chunks or not self.ensure_connected():
+            return []
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                chunk_ids = self._insert_chunk_rows(cursor, [
+                    (document_id, index, content, embedding)
+                    for index, (content, embedding) in enumerate(chunks)
+                ])
+                # 以前のチャンク化の失敗記録は不要になる
+                cursor.execute("DELETE FROM chunk_backfill_failures WHERE document_id = %s", (document_id,))
+                connection.commit()
+                cursor.close()
+            self._corpus_version = None
+            return chunk_ids
+        except psycopg2.Error as e:
+            logger.error("チャンク挿入中にエラーが発生しました: %s", e)
+            return []
+    
     def insert_document(self, title: str, content: str, embedding: List[float], metadata: Dict[str, Any] = None):
-        """文書をデータベースに挿入します"""
-        if not self.connection:
-            print("データベースに接続されていません。")
+        """文書をデータベースに挿入し、採番されたIDを返します（失敗時はFalse）"""
+        if not self.ensure_connected():
             return False
         
         try:
-            cursor = self.connection.cursor()
             metadata = metadata or {}
             
-            print(f"文書 '{title}' を追加します。ベクトルの長さ: {len(embedding) if embedding else 0}")
+            logger.debug("文書 '%s' を追加します。ベクトルの長さ: %d", title, len(embedding) if embedding is not None else 0)
+            
+            # 検索時にノルム計算が不要になるよう、単位長に正規化して保存する
+            vector = normalize_embedding(embedding)
+            
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                if self.has_pgvector:
+                    cursor.execute("""
+                    INSERT INTO documents (title, content, embedding, metadata)
+                    VALUES (%s, %s, %s, %s::jsonb)
+                    RETURNING id
+                    """, (title, content, vector.astype(np.float32), json.dumps(metadata)))
+                else:
+                    # JSONBとして埋め込みベクトルを保存
+                    cursor.execute("""
+                    INSERT INTO documents (title, content, embedding, metadata)
+                    VALUES (%s, %s, %s::jsonb, %s::jsonb)
+                    RETURNING id
+                    """, (title, content, json.dumps(vector.tolist()), json.dumps(metadata)))
+                
+                document_id = cursor.fetchone()[0]
+                connection.commit()
+                cursor.close()
+            self._adjust_document_count(1)
+            logger.debug("文書 '%s' をデータベースに追加しました。ID: %s", title, document_id)
+            return document_id
+            
+        except psycopg2.Error as e:
+            logger.error("文書挿入中にエラーが発生しました: %s", e)
+            return False
+    
+    def insert_documents(self, documents: List[Dict[str, Any]]):
+        """複数の文書を1回の複数行INSERTで挿入し、採番されたIDのリストを入力順で返します
+        
+        documents の各要素は title, content, embedding, metadata(任意) を持つ辞書です。
+        chunks（(content, embedding) のリスト）を持つ場合は同じトランザクションで
+        document_chunks にも1文で挿入し、採番されたチャンクIDを各要素の chunk_ids に格納します。
+        失敗時は空のリストを返し、トランザクションはロールバックされます。
+        """
+        if not documents:
+            return []
+        if not self.ensure_connected():
+            return []
+        
+        try:
+            values = [
+                (doc["title"], doc["content"], self._embedding_value(doc["embedding"]), json.dumps(doc.get("metadata") or {}))
+                for doc in documents
+            ]
             
             if self.has_pgvector:
-                cursor.execute("""
-                INSERT INTO documents (title, content, embedding, metadata)
-                VALUES (%s, %s, %s, %s::jsonb)
-                """, (title, content, embedding, json.dumps(metadata)))
+                template = "(%s, %s, %s, %s::jsonb)"
             else:
-                # JSONBとして埋め込みベクトルを保存
-                cursor.execute("""
+                template = "(%s, %s, %s::jsonb, %s::jsonb)"
+            
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                # page_size を件数に合わせ、バッチ全体を1文で送る
+                rows = execute_values(cursor, """
                 INSERT INTO documents (title, content, embedding, metadata)
-                VALUES (%s, %s, %s::jsonb, %s::jsonb)
-                """, (title, content, json.dumps(embedding), json.dumps(metadata)))
+                VALUES %s
+                RETURNING id
+                """, values, template=template, page_size=len(values), fetch=True)
+                document_ids = [row[0] for row in rows]
+                
+                chunk_rows = [
+                    (document_id, index, content, embedding)
+                    for doc, document_id in zip(documents, document_ids)
+                    for index, (content, embedding) in enumerate(doc.get("chunks") or [])
+                ]
+                chunk_ids = iter(self._insert_chunk_rows(cursor, chunk_rows))
+                
+                connection.commit()
+                cursor.close()
+            for doc in documents:
+                if doc.get("chunks"):
+                    doc["chunk_ids"] = [next(chunk_ids) for _ in doc["chunks"]]
+            self._adjust_document_count(len(rows))
+            logger.debug("%d 件の文書をデータベースに追加しました。", len(rows))
+            return document_ids
             
-            self.connection.commit()
-            cursor.close()
-            print(f"文書 '{title}' をデータベースに追加しました。")
+        except psycopg2.Error as e:
+            logger.error("文書の一括挿入中にエラーが発生しました: %s", e)
+            return []
+    
+    def copy_documents(self, documents: List[Dict[str, Any]], checkpoint: tuple = None) -> List[int]:
+        """文書（とチャンク）を COPY のバイナリ形式で一括ロードし、採番したIDを入力順で返します
+        
+        documents の形式は insert_documents と同じです。INSERT と違い RETURNING が使えないため、
+        IDはシーケンスから先に払い出してから明示的に指定します。
+        checkpoint に (名前, 入力位置, 追加件数) を渡すと、同じトランザクションで
+        import_checkpoints を更新します（ロードと再開位置の記録がずれません）。
+        失敗時は空のリストを返し、トランザクションはロールバックされます。
+        """
+        if not documents or not self.ensure_connected():
+            return []
+        
+        vector_kind = "vector" if self.has_pgvector else "jsonb"
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT nextval(pg_get_serial_sequence('documents', 'id')) FROM generate_series(1, %s)",
+                               (len(documents),))
+                document_ids = [row[0] for row in cursor.fetchall()]
+                
+                rows = []
+                for doc, document_id in zip(documents, document_ids):
+                    vector = normalize_embedding(doc["embedding"])
+                    rows.append((document_id, doc["title"], doc["content"],
+                                 vector if self.has_pgvector else vector.tolist(), doc.get("metadata") or {}))
+                cursor.copy_expert(
+                    "COPY documents (id, title, content, embedding, metadata) FROM STDIN WITH (FORMAT binary)",
+                    io.BytesIO(encode_copy_binary(rows, ["int4", "text", "text", vector_kind, "jsonb"])))
+                
+                chunks = [
+                    (document_id, index, content, embedding)
+                    for doc, document_id in zip(documents, document_ids)
+                    for index, (content, embedding) in enumerate(doc.get("chunks") or [])
+                ]
+                if chunks:
+                    cursor.execute("SELECT nextval(pg_get_serial_sequence('document_chunks', 'id')) "
+                                   "FROM generate_series(1, %s)", (len(chunks),))
+                    chunk_ids = [row[0] for row in cursor.fetchall()]
+                    chunk_rows = []
+                    for chunk_id, (document_id, index, content, embedding) in zip(chunk_ids, chunks):
+                        vector = normalize_embedding(embedding)
+                        chunk_rows.append((chunk_id, document_id, index, content,
+                                           vector if self.has_pgvector else vector.tolist()))
+                    cursor.copy_expert(
+                        "COPY document_chunks (id, document_id, chunk_index, content, embedding) "
+                        "FROM STDIN WITH (FORMAT binary)",
+                        io.BytesIO(encode_copy_binary(chunk_rows, ["int4", "int4", "int4", "text", vector_kind])))
+                
+                if checkpoint:
+                    self._write_import_checkpoint(cursor, *checkpoint)
+                
+                connection.commit()
+                cursor.close()
+            self._adjust_document_count(len(document_ids))
+            return document_ids
+        except psycopg2.Error as e:
+            logger.error("文書の一括ロード中にエラーが発生しました: %s", e)
+            return []
+    
+    def _write_import_checkpoint(self, cursor, name: str, position: int, imported: int):
+        cursor.execute("""
+        INSERT INTO import_checkpoints (name, position, imported) VALUES (%s, %s, %s)
+        ON CONFLICT (name) DO UPDATE SET position = EXCLUDED.position,
+            imported = EXCLUDED.imported, updated_at = now()
+        """, (name, position, imported))
+    
+    def save_import_checkpoint(self, name: str, position: int, imported: int) -> bool:
+        """文書を追加せずに一括取り込みの再開位置だけを記録します"""
+        if not self.ensure_connected():
+            return False
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                self._write_import_checkpoint(cursor, name, position, imported)
+                connection.commit()
+                cursor.close()
+            return True
+        except psycopg2.Error as e:
+            logger.error("再開位置の記録中にエラーが発生しました: %s", e)
+            return False
+    
+    def get_import_checkpoint(self, name: str) -> Optional[Dict[str, int]]:
+        """一括取り込みの再開位置 {position, imported} を返します（記録が無ければ 0、失敗時は None）"""
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT position, imported FROM import_checkpoints WHERE name = %s", (name,))
+                row = cursor.fetchone()
+                cursor.close()
+            return {"position": row[0], "imported": row[1]} if row else {"position": 0, "imported": 0}
+        except psycopg2.Error as e:
+            logger.error("再開位置の取得中にエラーが発生しました: %s", e)
+            return None
+    
+    def reset_import_checkpoint(self, name: str) -> bool:
+        """一括取り込みの再開位置を削除し、次回は先頭から取り込むようにします"""
+        if not self.ensure_connected():
+            return False
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("DELETE FROM import_checkpoints WHERE name = %s", (name,))
+                connection.commit()
+                cursor.close()
+            return True
+        except psycopg2.Error as e:
+            logger.error("再開位置の削除中にエラーが発生しました: %s", e)
+            return False
+    
+    def enqueue_ingest_job(self, documents: List[Dict[str, Any]], max_attempts: int = None) -> Optional[int]:
+        """文書追加ジョブを登録し、ジョブIDを返します（失敗時は None）"""
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                INSERT INTO ingest_jobs (payload, results, total, max_attempts)
+                VALUES (%s::jsonb, %s::jsonb, %s, %s)
+                RETURNING id
+                """, (json.dumps(documents), json.dumps([None] * len(documents)), len(documents),
+                      max_attempts or Config.INGEST_JOB_MAX_ATTEMPTS))
+                job_id = cursor.fetchone()[0]
+                connection.commit()
+                cursor.close()
+            return job_id
+        except psycopg2.Error as e:
+            logger.error("ジョブ登録中にエラーが発生しました: %s", e)
+            return None
+    
+    def claim_ingest_job(self) -> Optional[Dict[str, Any]]:
+        """実行可能なジョブを1件取得して running にします（無ければ None）
+        
+        FOR UPDATE SKIP LOCKED で他の worker が取得中の行を飛ばすため、worker を
+        いくつ並べても同じジョブを二重に取得しません。INGEST_JOB_LOCK_TIMEOUT 秒以上
+        更新の無い running のジョブは、worker が異常終了したものとみなして取得し直します。
+        """
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                UPDATE ingest_jobs SET status = 'running', attempts = attempts + 1, updated_at = now()
+                WHERE id = (
+                    SELECT id FROM ingest_jobs
+                    WHERE (status = 'queued' AND run_after <= now())
+                       OR (status = 'running' AND updated_at < now() - make_interval(secs => %s))
+                    ORDER BY run_after, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, payload, results, attempts, max_attempts
+                """, (Config.INGEST_JOB_LOCK_TIMEOUT,))
+                row = cursor.fetchone()
+                connection.commit()
+                cursor.close()
+            if not row:
+                return None
+            return {"id": row[0], "payload": row[1], "results": row[2], "attempts": row[3], "max_attempts": row[4]}
+        except psycopg2.Error as e:
+            logger.error("ジョブ取得中にエラーが発生しました: %s", e)
+            return None
+    
+    def update_ingest_job(self, job_id: int, results: List[Optional[Dict[str, Any]]], status: str = None,
+                          last_error: str = None, retry_delay: float = None) -> bool:
+        """ジョブの進捗（文書ごとの結果）を保存します
+        
+        status を指定すると状態も変更します。queued に戻す場合は retry_delay 秒後まで取得されません。
+        """
+        if not self.ensure_connected():
+            return False
+        
+        processed = sum(1 for result in results if result and result.get("document_id"))
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                UPDATE ingest_jobs SET
+                    results = %s::jsonb,
+                    processed = %s,
+                    status = COALESCE(%s, status),
+                    last_error = COALESCE(%s, last_error),
+                    run_after = now() + make_interval(secs => %s),
+                    finished_at = CASE WHEN %s IN ('succeeded', 'failed') THEN now() ELSE finished_at END,
+                    updated_at = now()
+                WHERE id = %s
+                """, (json.dumps(results), processed, status, last_error, retry_delay or 0, status, job_id))
+                connection.commit()
+                cursor.close()
             return True
-            
         except psycopg2.Error as e:
-            print(f"文書挿入中にエラーが発生しました: {e}")
-            if self.connection:
-                self.connection.rollback()
+            logger.error("ジョブ更新中にエラーが発生しました: %s", e)
             return False
     
+    def get_ingest_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """ジョブの状態と進捗を返します（存在しない場合・失敗時は None）"""
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                SELECT id, status, results, total, processed, attempts, max_attempts, last_error,
+                       created_at, updated_at, finished_at
+                FROM ingest_jobs WHERE id = %s
+                """, (job_id,))
+                row = cursor.fetchone()
+                cursor.close()
+            if not row:
+                return None
+            keys = ["id", "status", "results", "total", "processed", "attempts", "max_attempts", "last_error",
+                    "created_at", "updated_at", "finished_at"]
+            return dict(zip(keys, row))
+        except psycopg2.Error as e:
+            logger.error("ジョブ取得中にエラーが発生しました: %s", e)
+            return None
+    
     def search_documents(self, query_embedding: List[float] = None, title_filter: str = None, 
-                        metadata_filter: Dict[str, Any] = None, limit: int = 10):
-        """文書を検索します"""
-        if not self.connection:
-            print("データベースに接続されていません。")
+                        metadata_filter: Dict[str, Any] = None, limit: int = 10,
+                        ef_search: int = None, probes: int = None,
+                        cursor: str = None, fields: List[str] = None):
+        """文書を検索します
+        
+        ef_search / probes は ANN インデックス（HNSW / IVFFlat）の探索幅で、
+        省略時は Config の値をこのクエリのトランザクション内だけ（SET LOCAL）適用します。
+        
+        query_embedding を指定しない一覧取得では (created_at, id) の降順でキーセット
+        ページングを行い、cursor に前ページ最終行の encode_cursor() を渡すと続きを返します。
+        fields で取得する列を絞れます（DOCUMENT_FIELDS のキー。id と created_at は常に含みます）。
+        """
+        if not self.ensure_connected():
             return []
         
+        fields = list(fields or DEFAULT_DOCUMENT_FIELDS)
+        unknown = [field for field in fields if field not in DOCUMENT_FIELDS]
+        if unknown:
+            raise ValueError(f"未対応のフィールドです: {', '.join(unknown)}")
+        for required in ("created_at", "id"):
+            if required not in fields:
+                fields.insert(0, required)
+        
         try:
-            cursor = self.connection.cursor()
-            
             # 基本のSELECT文
-            query = "SELECT id, title, content, embedding, metadata, created_at FROM documents"
+            columns = ", ".join(
+                DOCUMENT_FIELDS[field] % {"preview_length": int(Config.DOCUMENT_PREVIEW_LENGTH)}
+                for field in fields
+            )
+            query = f"SELECT {columns} FROM documents"
             conditions = []
             params = []
             
-            # フィルター条件を構築
+            # フィルター条件を構築（どちらもインデックスで評価できる形にする）
             if title_filter:
                 conditions.append("title ILIKE %s")
-                params.append(f"%{title_filter}%")
+                params.append(like_pattern(title_filter))
             
             if metadata_filter:
-                for key, value in metadata_filter.items():
-                    conditions.append("metadata->>%s = %s")
-                    params.extend([key, str(value)])
+                # JSONB の包含（@>）は metadata の GIN インデックスで評価される
+                exact, alternatives = metadata_containment(metadata_filter)
+                if exact:
+                    conditions.append("metadata @> %s::jsonb")
+                    params.append(exact)
+                for candidates in alternatives:
+                    conditions.append("(" + " OR ".join(["metadata @> %s::jsonb"] * len(candidates)) + ")")
+                    params.extend(candidates)
+            
+            filtered = bool(conditions)
+            use_vector = query_embedding is not None and self.has_pgvector
+            if cursor and not use_vector:
+                # 前ページの最終行より後ろだけを取得（OFFSETを使わないのでページが深くても一定コスト）
+                conditions.append("(created_at, id) < (%s, %s)")
+                params.extend(decode_cursor(cursor))
             
             if conditions:
                 query += " WHERE " + " AND ".join(conditions)
             
             # pgvectorを使用できる場合は類似度検索も追加
-            if query_embedding and self.has_pgvector:
-                if conditions:
-                    query += f" ORDER BY embedding <-> %s LIMIT %s"
-                else:
-                    query += f" ORDER BY embedding <-> %s LIMIT %s"
-                params.extend([query_embedding, limit])
+            if use_vector:
+                operator = VECTOR_OPERATORS.get(Config.SIMILARITY_METRIC, "<#>")
+                query += f" ORDER BY embedding {operator} %s LIMIT %s"
+                params.extend([normalize_embedding(query_embedding).astype(np.float32), limit])
             else:
-                query += f" ORDER BY created_at DESC LIMIT %s"
+                query += f" ORDER BY created_at DESC, id DESC LIMIT %s"
                 params.append(limit)
             
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            cursor.close()
+            with self.get_connection() as connection:
+                db_cursor = connection.cursor()
+                if use_vector:
+                    results = self._run_vector_query(db_cursor, query, params, limit, filtered, ef_search, probes)
+                else:
+                    db_cursor.execute(query, params)
+                    results = db_cursor.fetchall()
+                db_cursor.close()
             
             # 結果を辞書形式で返す
-            documents = []
-            for row in results:
-                doc = {
-                    "id": row[0],
-                    "title": row[1],
-                    "content": row[2],
-                    "embedding": row[3],
-                    "metadata": row[4],
-                    "created_at": row[5]
-                }
-                documents.append(doc)
+            return [dict(zip(fields, row)) for row in results]
             
-            return documents
+        except psycopg2.Error as e:
+            logger.error("文書検索中にエラーが発生しました: %s", e)
+            return []
+    
+    def _set_search_params(self, db_cursor, limit: int, ef_search: int = None, probes: int = None,
+                           filtered: bool = False):
+        """ANN インデックスの探索幅をこのトランザクション内だけ（SET LOCAL）に設定します
+        
+        プールの他の利用者には影響させません。filtered=True で pgvector が反復スキャン（0.8.0 以降）に
+        対応していれば、絞り込みで候補が減っても limit 件集まるまでインデックスを探索し続けます。
+        """
+        for statement in self.search_param_statements(limit, ef_search, probes, filtered):
+            db_cursor.execute(*statement)
+    
+    def search_param_statements(self, limit: int, ef_search: int = None, probes: int = None,
+                                filtered: bool = False) -> List[tuple]:
+        """_set_search_params で実行する SET LOCAL 文を execute の引数の組（(SQL,) か (SQL, パラメータ)）のリストで返します"""
+        iterative = filtered and self.supports_iterative_scan
+        statements = []
+        if Config.ANN_INDEX_TYPE == "hnsw":
+            # ef_search が返却件数より小さいと k 件に満たないため、limit を下限にする
+            ef = max(int(ef_search or Config.HNSW_EF_SEARCH), int(limit))
+            statements.append(("SET LOCAL hnsw.ef_search = %s", (ef,)))
+            if iterative:
+                statements.append(("SET LOCAL hnsw.iterative_scan = relaxed_order",))
+        elif Config.ANN_INDEX_TYPE == "ivfflat":
+            statements.append(("SET LOCAL ivfflat.probes = %s", (int(probes or Config.IVFFLAT_PROBES),)))
+            if iterative:
+                statements.append(("SET LOCAL ivfflat.iterative_scan = relaxed_order",))
+        return statements
+    
+    def _run_vector_query(self, db_cursor, sql: str, params, limit: int, filtered: bool,
+                          ef_search: int = None, probes: int = None) -> List[tuple]:
+        """探索幅を設定して近傍検索を実行し、行を返します
+        
+        反復スキャンの無い pgvector では、ANN インデックスが返した候補が絞り込みで減り limit 件に
+        満たないことがあるため、その場合は ANN インデックスを使わない厳密な検索でやり直します
+        （絞り込み条件はインデックスで評価されるため、対象が少ないほど速く終わります）。
+        relaxed_order の結果は距離順が多少前後することがあるため、呼び出し側で並べ直してください。
+        """
+        self._set_search_params(db_cursor, limit, ef_search, probes, filtered)
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+        if filtered and len(rows) < limit and not self.supports_iterative_scan:
+            db_cursor.execute("SET LOCAL enable_indexscan = off")
+            db_cursor.execute(sql, params)
+            rows = db_cursor.fetchall()
+        return rows
+    
+    def filter_conditions(self, filters: Optional[Dict[str, Any]], alias: str = "") -> tuple:
+        """検索の絞り込み条件を (SQL 条件のリスト, 名前付きパラメータ) にします
+        
+        filters のキー:
+            title     タイトルの部分一致（pg_trgm のインデックスで評価）
+            metadata  メタデータに含まれるキーと値（JSONB の包含 @>、GIN インデックスで評価。
+                      値は文字列として比べる。metadata_containment を参照）
+        alias は documents テーブルの別名です（チャンク検索で結合する場合）。
+        """
+        conditions: List[str] = []
+        params: Dict[str, Any] = {}
+        if not filters:
+            return conditions, params
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"未対応の絞り込み条件です: {', '.join(sorted(unknown))}")
+        prefix = f"{alias}." if alias else ""
+        if filters.get("title"):
+            conditions.append(f"{prefix}title ILIKE %(filter_title)s")
+            params["filter_title"] = like_pattern(filters["title"])
+        if filters.get("metadata"):
+            exact, alternatives = metadata_containment(filters["metadata"])
+            if exact:
+                conditions.append(f"{prefix}metadata @> %(filter_metadata)s::jsonb")
+                params["filter_metadata"] = exact
+            for i, candidates in enumerate(alternatives):
+                names = [f"filter_metadata_{i}_{j}" for j in range(len(candidates))]
+                conditions.append("(" + " OR ".join(f"{prefix}metadata @> %({name})s::jsonb" for name in names) + ")")
+                params.update(zip(names, candidates))
+        return conditions, params
+    
+    def search_chunks(self, query_embedding: List[float], limit: int = 10,
+                      ef_search: int = None, probes: int = None,
+                      filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """クエリに近いチャンクを pgvector で検索し、文書のタイトル・メタデータと合わせて返します
+        
+        絞り込みが無い場合、近傍探索はチャンクテーブルだけで ANN インデックスを使って行い、
+        上位 limit 件にだけ documents を結合します。filters（filter_conditions を参照）を指定すると
+        documents を結合した上で条件に合うチャンクから limit 件を探します。
+        """
+        if not self.has_pgvector or not self.ensure_connected():
+            return []
+        
+        sql, params, filtered = self.chunk_search_query(query_embedding, limit, filters)
+        try:
+            with self.get_connection() as connection:
+                db_cursor = connection.cursor()
+                rows = self._run_vector_query(db_cursor, sql, params, limit, filtered, ef_search, probes)
+                db_cursor.close()
+            return [self.chunk_row_to_dict(row) for row in rows]
+        except psycopg2.Error as e:
+            logger.error("チャンク検索中にエラーが発生しました: %s", e)
+            return []
+    
+    def chunk_search_query(self, query_embedding: List[float], limit: int,
+                           filters: Dict[str, Any] = None) -> tuple:
+        """search_chunks の SQL を (SQL, 名前付きパラメータ, 絞り込みの有無) で返します"""
+        operator = VECTOR_OPERATORS.get(Config.SIMILARITY_METRIC, "<#>")
+        conditions, params = self.filter_conditions(filters, alias="d")
+        params.update({"query": normalize_embedding(query_embedding).astype(np.float32), "limit": limit})
+        if conditions:
+            # 条件の選択性が高ければ絞り込みが先に、低ければ ANN インデックスの走査が先に選ばれる
+            sql = f"""
+            WITH nearest AS MATERIALIZED (
+                SELECT c.id, c.document_id, c.chunk_index, c.content, c.embedding,
+                       d.title, d.metadata, d.created_at,
+                       c.embedding {operator} %(query)s AS distance
+                FROM document_chunks c
+                JOIN documents d ON d.id = c.document_id
+                WHERE {" AND ".join(conditions)}
+                ORDER BY c.embedding {operator} %(query)s
+                LIMIT %(limit)s
+            )
+            SELECT id, document_id, chunk_index, content, embedding, title, metadata, created_at
+            FROM nearest
+            ORDER BY distance
+            """
+        else:
+            sql = f"""
+            WITH nearest AS (
+                SELECT id, document_id, chunk_index, content, embedding,
+                       embedding {operator} %(query)s AS distance
+                FROM document_chunks
+                ORDER BY embedding {operator} %(query)s
+                LIMIT %(limit)s
+            )
+            SELECT n.id, n.document_id, n.chunk_index, n.content, n.embedding,
+                   d.title, d.metadata, d.created_at
+            FROM nearest n
+            JOIN documents d ON d.id = n.document_id
+            ORDER BY n.distance
+            """
+        return sql, params, bool(conditions)
+    
+    def search_lexical(self, query: str, limit: int = 10, table: str = "documents",
+                       filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """クエリ中の語（型番・カタカナ語・漢字語）を本文に含む文書またはチャンクを返します
+        
+        LEXICAL_MIN_TERM_LENGTH 文字以上の語のいずれかを含む行をトライグラムインデックスで絞り込み、
+        含む語の文字数の合計（lexical_score）の降順で limit 件を返します。短い語は順位付けにだけ使います。
+        結果の形式は table が documents なら search_documents、document_chunks なら search_chunks と同じです。
+        filters は search_chunks と同じ絞り込み条件です。
+        pg_trgm が使えない場合や、絞り込みに使える語が無い場合は空のリストを返します。
+        """
+        check_vector_table(table)
+        if not self.has_trgm:
+            return []
+        query_sql = self.lexical_search_query(query, limit, table, filters)
+        if query_sql is None or not self.ensure_connected():
+            return []
+        
+        sql, params = query_sql
+        try:
+            with self.get_connection() as connection:
+                db_cursor = connection.cursor()
+                db_cursor.execute(sql, params)
+                rows = db_cursor.fetchall()
+                db_cursor.close()
+        except psycopg2.Error as e:
+            logger.error("語彙検索中にエラーが発生しました: %s", e)
+            return []
+        return self.lexical_rows_to_dicts(rows, table)
+    
+    def lexical_search_query(self, query: str, limit: int, table: str = "documents",
+                             filters: Dict[str, Any] = None) -> Optional[tuple]:
+        """search_lexical の SQL を (SQL, 名前付きパラメータ) で返します（絞り込みに使える語が無ければ None）"""
+        terms = extract_search_terms(query)
+        indexed = [term for term in terms if len(term) >= Config.LEXICAL_MIN_TERM_LENGTH]
+        if not indexed:
+            return None
+        
+        chunks = table == "document_chunks"
+        column = "c.content" if chunks else "content"
+        conditions, params = self.filter_conditions(filters, alias="d" if chunks else "")
+        params["limit"] = limit
+        scores = []
+        for i, term in enumerate(terms):
+            params[f"term{i}"] = like_pattern(term)
+            scores.append(f"({column} ILIKE %(term{i})s)::int * {len(term)}")
+        # OR でつないだ各 ILIKE はそれぞれトライグラムインデックスで評価され、BitmapOr でまとめられる
+        matches = " OR ".join(f"{column} ILIKE %(term{terms.index(term)})s" for term in indexed)
+        condition = " AND ".join([f"({matches})"] + conditions)
+        score = " + ".join(scores)
+        
+        if chunks:
+            sql = f"""
+            SELECT c.id, c.document_id, c.chunk_index, c.content, c.embedding,
+                   d.title, d.metadata, d.created_at, {score} AS lexical_score
+            FROM document_chunks c
+            JOIN documents d ON d.id = c.document_id
+            WHERE {condition}
+            ORDER BY lexical_score DESC, c.id
+            LIMIT %(limit)s
+            """
+        else:
+            sql = f"""
+            SELECT id, title, content, embedding, metadata, created_at, {score} AS lexical_score
+            FROM documents
+            WHERE {condition}
+            ORDER BY lexical_score DESC, id
+            LIMIT %(limit)s
+            """
+        return sql, params
+    
+    def lexical_rows_to_dicts(self, rows: List[tuple], table: str) -> List[Dict[str, Any]]:
+        """search_lexical の行を結果の辞書にします"""
+        if table == "document_chunks":
+            results = []
+            for row in rows:
+                result = self.chunk_row_to_dict(row)
+                result["lexical_score"] = row[8]
+                results.append(result)
+            return results
+        return [dict(zip(DEFAULT_DOCUMENT_FIELDS + ["lexical_score"], row)) for row in rows]
+    
+    @staticmethod
+    def chunk_row_to_dict(row) -> Dict[str, Any]:
+        """チャンクの行を検索結果の辞書にします（id は文書ID、content はチャンク本文）"""
+        return {
+            "chunk_id": row[0],
+            "id": row[1],
+            "chunk_index": row[2],
+            "content": row[3],
+            "embedding": row[4],
+            "title": row[5],
+            "metadata": row[6],
+            "created_at": row[7],
+        }
+    
+    def get_chunks_by_ids(self, chunk_ids: List[int]) -> List[Dict[str, Any]]:
+        """指定IDのチャンクを文書情報と合わせて取得し、chunk_ids の順序で返します（埋め込みは含みません）"""
+        if not chunk_ids or not self.ensure_connected():
+            return []
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                SELECT c.id, c.document_id, c.chunk_index, c.content, NULL, d.title, d.metadata, d.created_at
+                FROM document_chunks c
+                JOIN documents d ON d.id = c.document_id
+                WHERE c.id = ANY(%s)
+                """, (list(chunk_ids),))
+                rows = cursor.fetchall()
+                cursor.close()
             
+            by_id = {row[0]: self.chunk_row_to_dict(row) for row in rows}
+            for chunk in by_id.values():
+                del chunk["embedding"]
+            return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+        except psycopg2.Error as e:
+            logger.error("チャンク取得中にエラーが発生しました: %s", e)
+            return []
+    
+    def get_chunk_ids(self, document_id: int) -> List[int]:
+        """文書に属するチャンクのIDを返します"""
+        if not self.ensure_connected():
+            return []
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT id FROM document_chunks WHERE document_id = %s ORDER BY chunk_index",
+                               (document_id,))
+                ids = [row[0] for row in cursor.fetchall()]
+                cursor.close()
+            return ids
         except psycopg2.Error as e:
-            print(f"文書検索中にエラーが発生しました: {e}")
+            logger.error("チャンクIDの取得中にエラーが発生しました: %s", e)
             return []
     
+    def get_documents_without_chunks(self, limit: int = 100) -> Optional[List[Dict[str, Any]]]:
+        """チャンクが1件も無い文書（チャンク分割導入前の文書）を ID 順に返します
+        
+        チャンク化に失敗して再試行を待っている（または再試行しない）文書は飛ばします。
+        取得に失敗した場合は None を返します（空のリストは未分割の文書が残っていないことを表します）。
+        """
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                SELECT d.id, d.title, d.content FROM documents d
+                WHERE NOT EXISTS (SELECT 1 FROM document_chunks c WHERE c.document_id = d.id)
+                  AND NOT EXISTS (
+                      SELECT 1 FROM chunk_backfill_failures f
+                      WHERE f.document_id = d.id AND (f.retry_after IS NULL OR f.retry_after > now())
+                  )
+                ORDER BY d.id LIMIT %s
+                """, (limit,))
+                rows = cursor.fetchall()
+                cursor.close()
+            return [{"id": row[0], "title": row[1], "content": row[2]} for row in rows]
+        except psycopg2.Error as e:
+            logger.error("未分割の文書の取得中にエラーが発生しました: %s", e)
+            return None
+    
+    def record_chunk_backfill_failure(self, document_id: int, error: str, retry: bool = True) -> bool:
+        """文書のチャンク化の失敗を記録します（記録できなければ False）
+        
+        retry の場合は INGEST_JOB_RETRY_DELAY 秒（試行ごとに倍）後から INGEST_JOB_MAX_ATTEMPTS 回目まで
+        再試行の対象に戻し、それ以外は reset_chunk_backfill_failures まで飛ばし続けます。
+        """
+        if not self.ensure_connected():
+            return False
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                INSERT INTO chunk_backfill_failures AS f (document_id, last_error, retry_after)
+                VALUES (%(id)s, %(error)s, CASE WHEN %(retry)s AND %(max_attempts)s > 1
+                                               THEN now() + make_interval(secs => %(delay)s) END)
+                ON CONFLICT (document_id) DO UPDATE SET
+                    attempts = f.attempts + 1,
+                    last_error = EXCLUDED.last_error,
+                    retry_after = CASE WHEN %(retry)s AND f.attempts + 1 < %(max_attempts)s
+                                       THEN now() + make_interval(secs => %(delay)s * power(2, f.attempts)) END,
+                    updated_at = now()
+                """, {"id": document_id, "error": error, "retry": retry,
+                      "max_attempts": Config.INGEST_JOB_MAX_ATTEMPTS, "delay": Config.INGEST_JOB_RETRY_DELAY})
+                connection.commit()
+                cursor.close()
+            return True
+        except psycopg2.Error as e:
+            logger.error("チャンク化の失敗の記録中にエラーが発生しました: %s", e)
+            return False
+    
+    def count_chunk_backfill_failures(self) -> int:
+        """チャンク化に失敗して飛ばしている文書の数を返します"""
+        if not self.ensure_connected():
+            return 0
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("SELECT count(*) FROM chunk_backfill_failures")
+                count = cursor.fetchone()[0]
+                cursor.close()
+            return count
+        except psycopg2.Error as e:
+            logger.error("チャンク化の失敗記録の集計中にエラーが発生しました: %s", e)
+            return 0
+    
+    def reset_chunk_backfill_failures(self) -> int:
+        """チャンク化の失敗記録を消して、すべての文書を再びチャンク化の対象にします（消した件数を返します）"""
+        if not self.ensure_connected():
+            return 0
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("DELETE FROM chunk_backfill_failures")
+                deleted = cursor.rowcount
+                connection.commit()
+                cursor.close()
+            return deleted
+        except psycopg2.Error as e:
+            logger.error("チャンク化の失敗記録の削除中にエラーが発生しました: %s", e)
+            return 0
+    
+    def list_documents(self, limit: int = 50, cursor: str = None, fields: List[str] = None) -> Dict[str, Any]:
+        """一覧表示用に文書を1ページ取得し、次ページのカーソルと合わせて返します"""
+        documents = self.search_documents(limit=limit + 1, cursor=cursor, fields=fields)
+        has_more = len(documents) > limit
+        documents = documents[:limit]
+        return {
+            "documents": documents,
+            "next_cursor": encode_cursor(documents[-1]) if has_more else None,
+            "has_more": has_more,
+        }
+    
     def get_all_documents(self):
         """すべての文書を取得します"""
         return self.search_documents(limit=1000)
     
+    def get_all_embeddings(self, batch_size: int = 2000, table: str = "documents"):
+        """table（documents / document_chunks）の全行のIDと埋め込みベクトルを (ids, vectors) のリストで返します
+        
+        メモリ常駐インデックスの構築用です。本文は読み込まず、サーバーサイドカーソルで
+        batch_size 行ずつ取得します。ベクトルはテキスト表現のまま受け取り、
+        json.loads を介さずに NumPy で直接パースします。
+        """
+        check_vector_table(table)
+        if not self.ensure_connected():
+            return [], []
+        
+        ids = []
+        vectors = []
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor(name="embedding_scan")
+                cursor.itersize = batch_size
+                cursor.execute(f"""
+                SELECT id, embedding::text FROM {table}
+                WHERE embedding IS NOT NULL
+                ORDER BY id
+                """)
+                for doc_id, embedding_text in cursor:
+                    ids.append(doc_id)
+                    vectors.append(np.fromstring(embedding_text.strip("[]"), dtype=np.float32, sep=","))
+                cursor.close()
+                connection.commit()
+            return ids, vectors
+        except psycopg2.Error as e:
+            logger.error("埋め込み取得中にエラーが発生しました: %s", e)
+            return [], []
+    
+    def get_document_ids(self, table: str = "documents") -> Optional[List[int]]:
+        """table の全行のIDだけを返します（インデックスとの差分同期用。失敗時は None）"""
+        check_vector_table(table)
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"SELECT id FROM {table} WHERE embedding IS NOT NULL")
+                ids = [row[0] for row in cursor.fetchall()]
+                cursor.close()
+            return ids
+        except psycopg2.Error as e:
+            logger.error("文書IDの取得中にエラーが発生しました: %s", e)
+            return None
+    
+    def get_filtered_ids(self, filters: Dict[str, Any], table: str = "documents") -> Optional[List[int]]:
+        """絞り込み条件に合う文書（table が document_chunks ならそのチャンク）のIDを返します（失敗時は None）
+        
+        pgvector 非対応時に、メモリ常駐インデックスの検索対象を先に絞り込むために使います。
+        """
+        check_vector_table(table)
+        if not self.ensure_connected():
+            return None
+        
+        conditions, params = self.filter_conditions(filters, alias="d")
+        where = " AND ".join(conditions) or "TRUE"
+        if table == "document_chunks":
+            sql = f"SELECT c.id FROM document_chunks c JOIN documents d ON d.id = c.document_id WHERE {where}"
+        else:
+            sql = f"SELECT d.id FROM documents d WHERE {where}"
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(sql, params)
+                ids = [row[0] for row in cursor.fetchall()]
+                cursor.close()
+            return ids
+        except psycopg2.Error as e:
+            logger.error("絞り込み対象のIDの取得中にエラーが発生しました: %s", e)
+            return None
+    
+    def get_embeddings_by_ids(self, document_ids: List[int], batch_size: int = 1000, table: str = "documents"):
+        """table の指定IDの埋め込みベクトルを (ids, vectors) で返します"""
+        check_vector_table(table)
+        if not document_ids or not self.ensure_connected():
+            return [], []
+        
+        ids = []
+        vectors = []
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                for start in range(0, len(document_ids), batch_size):
+                    cursor.execute(f"""
+                    SELECT id, embedding::text FROM {table}
+                    WHERE id = ANY(%s) AND embedding IS NOT NULL
+                    """, (list(document_ids[start:start + batch_size]),))
+                    for doc_id, embedding_text in cursor.fetchall():
+                        ids.append(doc_id)
+                        vectors.append(np.fromstring(embedding_text.strip("[]"), dtype=np.float32, sep=","))
+                cursor.close()
+            return ids, vectors
+        except psycopg2.Error as e:
+            logger.error("埋め込み取得中にエラーが発生しました: %s", e)
+            return [], []
+    
+    def get_documents_by_ids(self, document_ids: List[int]):
+        """指定IDの文書を埋め込みを除いて取得し、document_ids の順序で返します"""
+        if not document_ids:
+            return []
+        if not self.ensure_connected():
+            return []
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("""
+                SELECT id, title, content, metadata, created_at FROM documents
+                WHERE id = ANY(%s)
+                """, (list(document_ids),))
+                rows = cursor.fetchall()
+                cursor.close()
+            
+            by_id = {
+                row[0]: {
+                    "id": row[0],
+                    "title": row[1],
+                    "content": row[2],
+                    "metadata": row[3],
+                    "created_at": row[4]
+                }
+                for row in rows
+            }
+            return [by_id[doc_id] for doc_id in document_ids if doc_id in by_id]
+            
+        except psycopg2.Error as e:
+            logger.error("文書取得中にエラーが発生しました: %s", e)
+            return []
+    
+    def get_corpus_signature(self, table: str = "documents"):
+        """table の行数と最大IDの組を返します（他プロセスでの追加・削除の検知用）"""
+        check_vector_table(table)
+        if not self.ensure_connected():
+            return None
+        
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"SELECT COUNT(*), COALESCE(MAX(id), 0) FROM {table}")
+                signature = tuple(cursor.fetchone())
+                cursor.close()
+            return signature
+        except psycopg2.Error as e:
+            logger.error("文書数の取得中にエラーが発生しました: %s", e)
+            return None
+    
     def delete_document(self, document_id: int):
         """指定されたIDの文書を削除します"""
-        if not self.connection:
-            print("データベースに接続されていません。")
+        if not self.ensure_connected():
             return False
         
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("DELETE FROM documents WHERE id = %s", (document_id,))
-            
-            if cursor.rowcount > 0:
-                self.connection.commit()
-                print(f"文書 ID {document_id} を削除しました。")
-                result = True
-            else:
-                print(f"文書 ID {document_id} が見つかりませんでした。")
-                result = False
-            
-            cursor.close()
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute("DELETE FROM documents WHERE id = %s", (document_id,))
+                
+                if cursor.rowcount > 0:
+                    connection.commit()
+                    self._adjust_document_count(-1)
+                    logger.info("文書 ID %s を削除しました。", document_id)
+                    result = True
+                else:
+                    logger.info("文書 ID %s が見つかりませんでした。", document_id)
+                    result = False
+                
+                cursor.close()
             return result
             
         except psycopg2.Error as e:
-            print(f"文書削除中にエラーが発生しました: {e}")
-            if self.connection:
-                self.connection.rollback()
+            logger.error("文書削除中にエラーが発生しました: %s", e)
             return False
 
 # 使用例とテスト関数
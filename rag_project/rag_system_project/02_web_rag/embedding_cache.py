@@ -0,0 +1,152 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+from config import Config
+import metrics
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用にテキストを正規化します（NFKC・前後空白除去・連続空白の圧縮）"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+def text_hash(text: str) -> str:
+    """正規化後テキストの SHA-256 を返します"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """埋め込みベクトルの2段キャッシュ
+
+    キーは (埋め込みモデル, task_type, 正規化テキストの SHA-256) です。
+    1段目はプロセス内のサイズ上限付き LRU、2段目は PostgreSQL の embedding_cache テーブルで、
+    gunicorn の複数ワーカー間や再起動後も共有されます。
+    """
+
+    def __init__(self, db=None, model: str = Config.EMBEDDING_MODEL,
+                 max_size: int = Config.EMBEDDING_CACHE_SIZE, persist: bool = Config.EMBEDDING_CACHE_PERSIST):
+        self.db = db
+        self.model = model
+        self.max_size = max_size
+        self.persist = persist
+        self._entries: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _use_db(self) -> bool:
+        return bool(self.persist and self.db is not None and self.db.is_connected)
+
+    def _remember(self, key: tuple, vector: np.ndarray):
+        """1段目に格納し、上限を超えた分を古い順に追い出します"""
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_many(self, texts: List[str], task_type: str) -> List[Optional[List[float]]]:
+        """各テキストのキャッシュ済みベクトルを返します（未登録は None）"""
+        results, missing = self._lookup_memory(texts, task_type)
+        db_hits = 0
+        if missing and self._use_db():
+            found = self.db.get_cached_embeddings(self.model, task_type, list(missing))
+            db_hits = self._merge_found(found, missing, results, task_type)
+        self._count(len(texts), db_hits, missing)
+        return results
+
+    async def aget_many(self, texts: List[str], task_type: str, adb) -> List[Optional[List[float]]]:
+        """get_many の非同期版（2段目は AsyncDatabaseManager の adb で引きます）"""
+        results, missing = self._lookup_memory(texts, task_type)
+        db_hits = 0
+        if missing and self.persist and adb is not None:
+            found = await adb.get_cached_embeddings(self.model, task_type, list(missing))
+            db_hits = self._merge_found(found, missing, results, task_type)
+        self._count(len(texts), db_hits, missing)
+        return results
+
+    def _lookup_memory(self, texts: List[str], task_type: str):
+        """1段目を引き、(結果, 1段目に無かったテキストのハッシュ → 位置のリスト) を返します"""
+        hashes = [text_hash(text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, digest in enumerate(hashes):
+                key = (self.model, task_type, digest)
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    results[i] = vector.tolist()
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(digest, []).append(i)
+        return results, missing
+
+    def _merge_found(self, found: Dict[str, List[float]], missing: Dict[str, List[int]],
+                     results: List[Optional[List[float]]], task_type: str) -> int:
+        """2段目で見つかったベクトルを1段目に登録して results に埋め、ヒット数を返します"""
+        db_hits = 0
+        for digest, embedding in found.items():
+            vector = np.asarray(embedding, dtype=np.float32)
+            self._remember((self.model, task_type, digest), vector)
+            for i in missing.pop(digest):
+                results[i] = vector.tolist()
+                db_hits += 1
+        return db_hits
+
+    def _count(self, total: int, db_hits: int, missing: Dict[str, List[int]]):
+        misses = sum(len(indexes) for indexes in missing.values())
+        with self._lock:
+            self.db_hits += db_hits
+            self.misses += misses
+        metrics.CACHE_REQUESTS.labels("embedding", "memory_hit").inc(total - db_hits - misses)
+        metrics.CACHE_REQUESTS.labels("embedding", "db_hit").inc(db_hits)
+        metrics.CACHE_REQUESTS.labels("embedding", "miss").inc(misses)
+
+    def get(self, text: str, task_type: str) -> Optional[List[float]]:
+        """1件分のキャッシュ済みベクトルを返します（未登録は None）"""
+        return self.get_many([text], task_type)[0]
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]], task_type: str):
+        """生成したベクトルを両方の段に登録します"""
+        items = self._remember_all(texts, embeddings, task_type)
+        if items and self._use_db():
+            self.db.put_cached_embeddings(self.model, task_type, items)
+
+    async def aput_many(self, texts: List[str], embeddings: List[List[float]], task_type: str, adb):
+        """put_many の非同期版"""
+        items = self._remember_all(texts, embeddings, task_type)
+        if items and self.persist and adb is not None:
+            await adb.put_cached_embeddings(self.model, task_type, items)
+
+    def _remember_all(self, texts: List[str], embeddings: List[List[float]], task_type: str) -> List[tuple]:
+        """1段目に登録し、2段目に登録する (text_hash, embedding) のリストを返します"""
+        items = {}
+        for text, embedding in zip(texts, embeddings):
+            digest = text_hash(text)
+            vector = np.asarray(embedding, dtype=np.float32)
+            self._remember((self.model, task_type, digest), vector)
+            items[digest] = vector.tolist()
+        return list(items.items())
+
+    def put(self, text: str, embedding: List[float], task_type: str):
+        """1件分のベクトルを登録します"""
+        self.put_many([text], [embedding], task_type)
+
+    def stats(self) -> Dict[str, float]:
+        """ヒット・ミスの件数とヒット率を返します"""
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
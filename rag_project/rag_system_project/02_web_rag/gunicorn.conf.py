@@ -0,0 +1,22 @@
+"""
+gunicorn の設定（Procfile では -c gunicorn.conf.py で明示的に読み込みます）
+
+/metrics を全ワーカーで集約するため、ワーカーを起動する前に PROMETHEUS_MULTIPROC_DIR を設定します。
+prometheus_client は import 時にこの環境変数を見て値の保存先を決めるため、ここでは import しません。
+"""
+import os
+import shutil
+import tempfile
+
+multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "rag_prometheus_metrics"))
+
+def on_starting(server):
+    """前回の起動で残ったワーカーの値を消してから始めます"""
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    """終了したワーカーのゲージ（livesum）を集計から外します"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+文書追加ジョブ（ingest_jobs テーブル）を処理する worker プロセス
+
+使い方:
+    python ingest_worker.py          # ジョブを待ち受けて処理し続ける（Procfile の worker）
+    python ingest_worker.py --once   # 実行可能なジョブが無くなったら終了
+
+ジョブは文書ごとの結果を保存しながら EMBEDDING_BATCH_SIZE 件ずつ追加し、失敗した文書は
+INGEST_JOB_RETRY_DELAY 秒（試行ごとに倍）後に再試行します。再試行では追加済みの文書を飛ばします。
+バッチの挿入後・進捗の保存前に worker が止まった場合はそのバッチが再度追加されることがあります（少なくとも1回）。
+CHUNKING_ENABLED の場合は、ジョブの無い間にチャンク分割導入前の文書を EMBEDDING_BATCH_SIZE 件ずつチャンク化します
+（RAGSystem.backfill_chunks。チャンク単位の検索で既存の文書が見つかるようにするため）。
+チャンク化できない文書は記録して飛ばし、完了後やエラー時も CHUNK_BACKFILL_INTERVAL 秒ごとに残りを確認します。
+"""
+import argparse
+import logging
+import signal
+import sys
+import time
+from typing import Any, Dict
+from dotenv import load_dotenv
+from config import Config
+from logging_config import setup_logging
+from rag_system import RAGSystem
+
+# .envファイルから環境変数を読み込み
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+def process_job(rag: RAGSystem, job: Dict[str, Any], batch_size: int = None) -> str:
+    """ジョブ1件を処理し、処理後の状態（succeeded / queued / failed）を返します"""
+    batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+    documents = job["payload"]
+    results = job["results"] or [None] * len(documents)
+    pending = [i for i, result in enumerate(results) if not (result and result.get("document_id"))]
+    logger.info("ジョブ %s を処理します: 未処理 %d / %d 件（%d 回目）", job["id"], len(pending), len(documents),
+                job["attempts"], extra={"job_id": job["id"]})
+
+    for start in range(0, len(pending), batch_size):
+        indexes = pending[start:start + batch_size]
+        try:
+            batch_results = rag.add_documents([documents[i] for i in indexes], batch_size=batch_size)
+        except Exception as e:
+            logger.exception("ジョブ %s の処理中にエラーが発生しました", job["id"], extra={"job_id": job["id"]})
+            batch_results = [{"success": False, "error": str(e)} for _ in indexes]
+        for i, result in zip(indexes, batch_results):
+            if result["success"]:
+                results[i] = {"document_id": result["document_id"]}
+            else:
+                results[i] = {"error": result["error"]}
+        # 進捗の保存が実行中であることの知らせも兼ねる
+        rag.db.update_ingest_job(job["id"], results)
+
+    errors = [result["error"] for result in results if not (result and result.get("document_id"))]
+    if not errors:
+        status, delay = "succeeded", None
+    elif job["attempts"] < job["max_attempts"]:
+        status, delay = "queued", Config.INGEST_JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+    else:
+        status, delay = "failed", None
+    rag.db.update_ingest_job(job["id"], results, status=status, last_error=errors[0] if errors else None,
+                             retry_delay=delay)
+    logger.info("ジョブ %s: %s（失敗 %d 件）", job["id"], status, len(errors),
+                extra={"job_id": job["id"], "status": status, "failed": len(errors)})
+    return status
+
+def backfill_step(rag: RAGSystem, batch_size: int = None) -> str:
+    """未分割の文書を1バッチだけチャンク化し、状態を返します
+    
+    more: 続きがある / done: 今チャンク化できる文書が残っていない / error: 中断した（次の確認時に再試行）
+    """
+    batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+    try:
+        processed = rag.backfill_chunks(batch_size=batch_size, limit=batch_size)
+    except Exception:
+        logger.exception("既存の文書のチャンク化中にエラーが発生しました。%s 秒後に再試行します。",
+                         Config.CHUNK_BACKFILL_INTERVAL)
+        return "error"
+    return "more" if processed else "done"
+
+def main():
+    parser = argparse.ArgumentParser(description="文書追加ジョブの worker")
+    parser.add_argument("--once", action="store_true", help="実行可能なジョブが無くなったら終了する")
+    args = parser.parse_args()
+    setup_logging()
+
+    rag = RAGSystem()
+    if not rag.db.connect():
+        return 1
+
+    # 停止要求（Heroku の SIGTERM 等）を受けたら処理中のジョブを終えてから終了する
+    stopping = False
+    def request_stop(signum, frame):
+        nonlocal stopping
+        logger.info("停止要求を受け付けました。処理中のジョブの完了後に終了します。")
+        stopping = True
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logger.info("文書追加ジョブの待ち受けを開始します。")
+    # 失敗した文書の再試行や中断からの再開のため、完了後も CHUNK_BACKFILL_INTERVAL 秒ごとに確認する
+    next_backfill = time.monotonic() if Config.CHUNKING_ENABLED else None
+    backfill_status = None
+    while not stopping:
+        job = rag.db.claim_ingest_job()
+        if job:
+            process_job(rag, job)
+            continue
+        if next_backfill is not None and time.monotonic() >= next_backfill:
+            status = backfill_step(rag)
+            if status == "done" and backfill_status != "done":
+                logger.info("既存の文書のチャンク化が完了しました。")
+            backfill_status = status
+            if status == "more":
+                continue
+            next_backfill = time.monotonic() + Config.CHUNK_BACKFILL_INTERVAL
+        if args.once:
+            break
+        time.sleep(Config.INGEST_WORKER_POLL_INTERVAL)
+
+    rag.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import re
+import unicodedata
+from typing import List
+
+# 語彙検索の対象とする語（英数字の型番・エラー番号、カタカナ語、漢字語）
+# 単語分割器を使わず、文字種の連続で区切る（ひらがなは助詞・活用語尾が多いため除く）
+_TERM_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_\-.]*[A-Za-z0-9]|[A-Za-z0-9]|[ァ-ヴー]+|[一-龯々〆ヵヶ]+")
+
+def extract_search_terms(query: str, max_terms: int = 8) -> List[str]:
+    """クエリから語彙検索に使う語を出現順に重複なく取り出します（2文字未満は除きます）"""
+    text = unicodedata.normalize("NFKC", query or "")
+    terms = []
+    for match in _TERM_PATTERN.finditer(text):
+        term = match.group()
+        if len(term) >= 2 and term not in terms:
+            terms.append(term)
+        if len(terms) >= max_terms:
+            break
+    return terms
+
+def like_pattern(term: str) -> str:
+    """部分一致の LIKE パターンを作ります（%・_・\\ はエスケープします）"""
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
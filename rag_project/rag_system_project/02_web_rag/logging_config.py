@@ -0,0 +1,88 @@
+"""
+ログ出力の設定
+
+各モジュールは logging.getLogger(__name__) に書き込み、出力先の設定はプロセスの入口
+（create_app・ingest_worker・各 CLI）で setup_logging() を1回呼んで行います。
+ログはキュー経由で別スレッドから出力するため、リクエストを処理するスレッドは標準出力への書き込みを待ちません。
+文書・クエリごとの詳細（埋め込み生成・挿入・キャッシュヒット等）は DEBUG で出すため、本番（LOG_LEVEL=INFO）では出力されません。
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from config import Config
+
+# LogRecord の標準属性（これ以外の属性は extra で渡された構造化フィールドとして出力する）
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+_TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_handler = None
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行の JSON にします（extra のフィールドと例外のトレースバックも含めます）"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging(level: str = None, fmt: str = None, stream=None):
+    """ルートロガーをキュー経由の出力に設定します（2回目以降の呼び出しは何もしません）
+
+    level は LOG_LEVEL、fmt は LOG_FORMAT（json / text）が既定です。
+    書式の整形は呼び出し元のスレッドで、標準出力（stream）への書き込みはリスナーのスレッドで行います。
+    """
+    global _handler, _listener
+    if _listener is not None:
+        return
+    level = (level or Config.LOG_LEVEL).upper()
+    fmt = fmt or Config.LOG_FORMAT
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter("%(message)s"))
+    _handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _handler.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(_TEXT_FORMAT))
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level)
+    # 終了時にキューに残ったログを書き出す
+    atexit.register(shutdown_logging)
+
+def shutdown_logging():
+    """キューに残ったログを書き出してリスナーを止めます（再度 setup_logging で設定できます）"""
+    global _handler, _listener
+    if _listener is not None:
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _handler = None
+        _listener = None
+
+def _restart_listener_after_fork():
+    """fork した子プロセス（gunicorn の --preload 時のワーカー等）ではリスナーのスレッドが無いため作り直します"""
+    global _listener
+    if _listener is None:
+        return
+    _handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(_handler.queue, *_listener.handlers)
+    _listener.start()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
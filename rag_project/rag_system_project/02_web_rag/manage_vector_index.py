@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+pgvector の ANN インデックス（HNSW / IVFFlat）を管理するスクリプト
+
+使い方:
+    python manage_vector_index.py status   # インデックスの状態を表示
+    python manage_vector_index.py create   # ANN_INDEX_TYPE のインデックスを CONCURRENTLY で作成
+    python manage_vector_index.py rebuild  # 書き込みを止めずに作り直す（種類の切り替えにも使用）
+    python manage_vector_index.py drop     # すべての ANN インデックスを削除
+    python manage_vector_index.py lexical  # 語彙検索用の pg_trgm 拡張とトライグラムインデックスを作成
+    python manage_vector_index.py chunks   # チャンク分割導入前の文書をチャンク化（埋め込みの提供元を使います）
+
+--table document_chunks を付けるとチャンクテーブルのインデックスを対象にします。
+"""
+import argparse
+import sys
+from dotenv import load_dotenv
+from config import Config
+from db_utils import DatabaseManager, VECTOR_TABLES
+from logging_config import setup_logging
+
+# .envファイルから環境変数を読み込み
+load_dotenv()
+
+def backfill_chunks() -> int:
+    """未分割の文書をすべてチャンク化します（ingest_worker.py が動いていれば待っていても同じ結果になります）
+
+    以前に失敗して飛ばしていた文書も再試行します。
+    """
+    from rag_system import RAGSystem
+
+    rag = RAGSystem()
+    if not rag.db.connect():
+        return 1
+    rag.db.reset_chunk_backfill_failures()
+    try:
+        processed = rag.backfill_chunks()
+    except RuntimeError as e:
+        print(f"チャンク化を中断しました: {e}")
+        rag.close()
+        return 1
+    failed = rag.db.count_chunk_backfill_failures()
+    rag.close()
+    print(f"チャンク化した文書: {processed - failed} 件" + (f"（失敗 {failed} 件。ログを確認してください）" if failed else ""))
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="pgvector ANN インデックス管理")
+    parser.add_argument("command", choices=["status", "create", "rebuild", "drop", "lexical", "chunks"])
+    parser.add_argument("--table", choices=VECTOR_TABLES, default="documents")
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.command == "chunks":
+        return backfill_chunks()
+
+    db = DatabaseManager()
+    if not db.connect():
+        return 1
+    if args.command == "lexical":
+        # pg_trgm は pgvector の有無に関係なく使える
+        success = db.create_lexical_indexes()
+        db.disconnect()
+        return 0 if success else 1
+    if not db.has_pgvector:
+        print("pgvector が利用できないため、ANN インデックスは使用できません。")
+        db.disconnect()
+        return 1
+
+    print(f"設定: 種類={Config.ANN_INDEX_TYPE}, 類似度={Config.SIMILARITY_METRIC}, テーブル={args.table}")
+    if args.command == "status":
+        indexes = db.get_vector_index_status(args.table)
+        if not indexes:
+            print("ANN インデックスはありません。")
+        for index in indexes:
+            state = "有効" if index["valid"] else "無効（作成途中または失敗）"
+            print(f"- {index['name']} ({index['size']}, {state})")
+            print(f"  {index['definition']}")
+        success = True
+    elif args.command == "create":
+        success = db.create_vector_index(concurrently=True, table=args.table)
+    elif args.command == "rebuild":
+        success = db.rebuild_vector_index(args.table)
+    else:
+        success = db.drop_vector_index(table=args.table)
+
+    db.disconnect()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Prometheus 形式のメトリクス
+
+gunicorn で複数ワーカーを動かす場合は、ワーカー起動前に環境変数 PROMETHEUS_MULTIPROC_DIR
+（全ワーカーが書き込める空のディレクトリ）を設定します。各ワーカーは値をそのディレクトリのファイルに書き、
+/metrics はどのワーカーが応答しても全ワーカー分を集約して返します（設定は gunicorn.conf.py を参照）。
+未設定の場合はプロセス内の値だけを返します（開発サーバー・単一プロセス用）。
+
+キャッシュのヒット率は rag_cache_requests_total から PromQL で計算します。
+    sum(rate(rag_cache_requests_total{cache="answer",result="hit"}[5m]))
+      / sum(rate(rag_cache_requests_total{cache="answer"}[5m]))
+"""
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+import request_timing
+
+# 回答生成までを含むため、既定より長い区間まで用意する
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# パイプラインの段階（embedding: generate_embedding, db_search: ベクトル・語彙検索,
+# context_build: コンテキストの組み立て, generation: generate_content）
+STAGES = ("embedding", "db_search", "context_build", "generation")
+
+HTTP_REQUESTS = Counter(
+    "rag_http_requests_total", "HTTPリクエスト数", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "rag_http_request_duration_seconds", "HTTPリクエストの処理時間（ストリーミングは応答開始まで）",
+    ["method", "route"], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds", "RAGパイプラインの段階ごとの処理時間", ["stage"], buckets=LATENCY_BUCKETS)
+
+DB_CONNECTIONS_IN_USE = Gauge(
+    "rag_db_pool_connections_in_use", "貸し出し中のDB接続数（全ワーカーの合計）", multiprocess_mode="livesum")
+DB_CONNECTIONS_MAX = Gauge(
+    "rag_db_pool_connections_max", "DB接続プールの上限（全ワーカーの合計）", multiprocess_mode="livesum")
+DB_POOL_WAIT = Histogram(
+    "rag_db_pool_wait_seconds", "DB接続の空き待ち時間",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+DB_POOL_TIMEOUTS = Counter("rag_db_pool_timeouts_total", "DB接続の空き待ちがタイムアウトした回数")
+
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total", "キャッシュの参照数（result は hit / miss、埋め込みは memory_hit / db_hit / miss）",
+    ["cache", "result"])
+EMBEDDING_FALLBACKS = Counter(
+    "rag_embedding_fallbacks_total", "埋め込み生成に失敗してダミーのゼロベクトルを返した回数")
+
+def record_stage(stage: str, seconds: float):
+    """段階 stage の処理時間をヒストグラムと、処理中のリクエストの内訳（request_timing）に記録します"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    request_timing.add_span(stage, seconds)
+
+@contextmanager
+def stage_timer(stage: str):
+    """with 文で囲んだ区間の処理時間を段階 stage として記録します"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+def render():
+    """/metrics の応答本文と Content-Type を返します"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,224 @@
+"""
+埋め込み・回答生成の提供元
+
+RAGSystem は EMBEDDING_PROVIDER / GENERATION_PROVIDER で選んだ提供元を通して埋め込みと回答を得ます。
+    gemini  Gemini API（既定。GOOGLE_API_KEY が必要）
+    local   埋め込みのみ。文字 n-gram をハッシュして固定次元に射影し、プロセス内で計算します（ネットワーク不要）
+    stub    回答生成のみ。プロンプトから決まる固定の回答を返します（ベンチマーク・オフライン動作確認用）
+
+提供元ごとに埋め込み空間が異なるため、EMBEDDING_PROVIDER を切り替えた場合は文書の埋め込みを作り直してください
+（埋め込みキャッシュは提供元の model 名ごとに分かれます）。
+独自の提供元は EMBEDDING_PROVIDERS / GENERATION_PROVIDERS に登録すると名前で選べます。
+非同期版（aembed / agenerate / agenerate_stream、AsyncRAGSystem が使います）は、
+提供元が実装しない場合は同期版を既定のスレッドプールで実行します。
+embed / generate は抽象メソッドのため、実装していない提供元は作成時に TypeError になります。
+"""
+import asyncio
+import hashlib
+import re
+import time
+import unicodedata
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Tuple
+import numpy as np
+import google.generativeai as genai
+from config import Config
+
+class EmbeddingProvider(ABC):
+    """埋め込みの提供元
+
+    model は埋め込みキャッシュのキーに使う名前、remote はネットワーク越しの呼び出しかどうかです
+    （False の提供元はキャッシュを使わずに毎回計算します）。
+    """
+    model: str = ""
+    remote: bool = True
+
+    @abstractmethod
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        """texts の各テキストの埋め込みを同じ順に返します"""
+
+    async def aembed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        """embed の非同期版"""
+        return await asyncio.to_thread(self.embed, texts, task_type)
+
+class GenerationProvider(ABC):
+    """回答生成の提供元"""
+    model: str = ""
+
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        """プロンプトに対する回答全体を返します"""
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        """回答を生成された順にテキストの断片で返します"""
+        yield self.generate(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        """generate の非同期版"""
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """generate_stream の非同期版（既定では回答全体を1つの断片で返します）"""
+        yield await self.agenerate(prompt)
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Gemini API の埋め込み（複数テキストは1回の API 呼び出しにまとめます）"""
+    def __init__(self, api_key: str = None, model: str = None):
+        api_key = api_key or Config.GOOGLE_API_KEY
+        if not api_key:
+            raise ValueError("Google API キーが設定されていません。")
+        genai.configure(api_key=api_key)
+        self.model = model or Config.EMBEDDING_MODEL
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        response = genai.embed_content(model=self.model, content=texts, task_type=task_type)
+        return response["embedding"]
+
+    async def aembed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        response = await genai.embed_content_async(model=self.model, content=texts, task_type=task_type)
+        return response["embedding"]
+
+class GeminiGenerationProvider(GenerationProvider):
+    """Gemini API の回答生成"""
+    def __init__(self, api_key: str = None, model: str = None, generation_config: Dict = None):
+        api_key = api_key or Config.GOOGLE_API_KEY
+        if not api_key:
+            raise ValueError("Google API キーが設定されていません。")
+        genai.configure(api_key=api_key)
+        self.model = model or Config.GENERATION_MODEL
+        self.client = genai.GenerativeModel(
+            model_name=self.model,
+            generation_config=generation_config or Config.GENERATION_CONFIG
+        )
+
+    def generate(self, prompt: str) -> str:
+        return self.client.generate_content(prompt).text
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.client.generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # 安全性フィルタ等でテキストを含まないチャンクは読み飛ばす
+                continue
+            if text:
+                yield text
+
+    async def agenerate(self, prompt: str) -> str:
+        response = await self.client.generate_content_async(prompt)
+        return response.text
+
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        response = await self.client.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue
+            if text:
+                yield text
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """文字 n-gram のハッシュによる埋め込み（プロセス内で計算し、ネットワークを使いません）
+
+    NFKC 正規化・小文字化したテキストの文字 n-gram（既定は1〜3文字）を数え、
+    対数の出現回数に n-gram の長さを掛けた重み（長い n-gram ほど語を特定しやすいため、IDF の代わりに使う）を、
+    n-gram のハッシュで決まる次元に符号付きで加えて単位長にします。
+    符号付きハッシュはランダムな疎行列による次元への射影と同じで、内積（コサイン類似度）がおよそ保たれます。
+    コーパスの統計を使わないため、文書を追加しても既存の文書のベクトルは変わりません。
+    分かち書きをしないため日本語でもそのまま使えますが、意味の近さではなく表記の重なりで近さが決まります。
+    """
+    remote = False
+
+    def __init__(self, dimension: int = None, ngram_range: Tuple[int, int] = (1, 3)):
+        self.dimension = dimension or Config.EMBEDDING_DIMENSION
+        self.ngram_range = ngram_range
+        self.model = f"local-char-ngram-{ngram_range[0]}-{ngram_range[1]}-d{self.dimension}"
+
+    def _ngrams(self, text: str) -> Counter:
+        text = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip().lower()
+        low, high = self.ngram_range
+        return Counter(text[i:i + n] for n in range(low, high + 1) for i in range(len(text) - n + 1))
+
+    def embed_one(self, text: str) -> np.ndarray:
+        """1テキストの埋め込みを単位長の float32 配列で返します（空のテキストはゼロベクトル）"""
+        grams = self._ngrams(text)
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        if not grams:
+            return vector
+        crc32 = zlib.crc32
+        digests = np.fromiter((crc32(gram.encode("utf-8")) for gram in grams), dtype=np.int64, count=len(grams))
+        counts = np.fromiter(grams.values(), dtype=np.float32, count=len(grams))
+        lengths = np.fromiter(map(len, grams), dtype=np.float32, count=len(grams))
+        # 最上位ビットで符号を決める（次元の決定に使う下位ビットとほぼ独立）
+        signs = np.where(digests & 0x80000000, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, digests % self.dimension, signs * (1.0 + np.log(counts)) * lengths)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def embed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        # 質問と文書を同じ空間に置くため task_type は使わない
+        return [self.embed_one(text).tolist() for text in texts]
+
+    async def aembed(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        # スレッドに渡すより、その場で計算する方が速い
+        return self.embed(texts, task_type)
+
+class StubGenerationProvider(GenerationProvider):
+    """プロンプトから決まる固定の回答を返す回答生成（latency 秒待ってから返します）"""
+    model = "stub"
+
+    def __init__(self, latency: float = 0.0, chunk_size: int = 8):
+        self.latency = latency
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def _answer(prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        return f"スタブの回答です（プロンプト {len(prompt)} 文字, {digest}）。"
+
+    def generate(self, prompt: str) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(prompt)
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        answer = self.generate(prompt)
+        for start in range(0, len(answer), self.chunk_size):
+            yield answer[start:start + self.chunk_size]
+
+    async def agenerate(self, prompt: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._answer(prompt)
+
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        answer = await self.agenerate(prompt)
+        for start in range(0, len(answer), self.chunk_size):
+            yield answer[start:start + self.chunk_size]
+
+# 提供元の名前と、API キーを受け取って提供元を作る関数
+EMBEDDING_PROVIDERS: Dict[str, Callable[[str], EmbeddingProvider]] = {
+    "gemini": lambda api_key: GeminiEmbeddingProvider(api_key),
+    "local": lambda api_key: LocalEmbeddingProvider(),
+}
+GENERATION_PROVIDERS: Dict[str, Callable[[str], GenerationProvider]] = {
+    "gemini": lambda api_key: GeminiGenerationProvider(api_key),
+    "stub": lambda api_key: StubGenerationProvider(),
+}
+
+def create_embedding_provider(name: str = None, api_key: str = None) -> EmbeddingProvider:
+    """名前（既定は EMBEDDING_PROVIDER）で埋め込みの提供元を作ります"""
+    name = name or Config.EMBEDDING_PROVIDER
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"未対応の EMBEDDING_PROVIDER です: {name}（{', '.join(EMBEDDING_PROVIDERS)}）")
+    return EMBEDDING_PROVIDERS[name](api_key)
+
+def create_generation_provider(name: str = None, api_key: str = None) -> GenerationProvider:
+    """名前（既定は GENERATION_PROVIDER）で回答生成の提供元を作ります"""
+    name = name or Config.GENERATION_PROVIDER
+    if name not in GENERATION_PROVIDERS:
+        raise ValueError(f"未対応の GENERATION_PROVIDER です: {name}（{', '.join(GENERATION_PROVIDERS)}）")
+    return GENERATION_PROVIDERS[name](api_key)
@@ -1,100 +1,331 @@
+import contextvars
 import json
+import logging
 import os
+import threading
+import time
 import numpy as np
-from typing import List, Dict, Any
-import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from dotenv import load_dotenv
-from db_utils import DatabaseManager
+from db_utils import DatabaseManager, normalize_embedding
+from embedding_cache import EmbeddingCache
+from answer_cache import AnswerCache
+from chunking import chunk_text
+from context_packer import estimate_tokens, pack_context
+from ranking import maximal_marginal_relevance, reciprocal_rank_fusion
+from vector_index import VectorIndex, IVFIndex
 from config import Config
+from providers import EmbeddingProvider, GenerationProvider, create_embedding_provider, create_generation_provider
+import request_timing
+from metrics import EMBEDDING_FALLBACKS, record_stage, stage_timer
 
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+def is_valid_document(doc) -> bool:
+    """タイトルと内容が空白以外の文字を含む文書かどうか（API・一括取り込み・add_documents の入力検証）"""
+    return isinstance(doc, dict) and all(str(doc.get(key) or "").strip() for key in ("title", "content"))
+
 class RAGSystem:
     """RAG (Retrieval-Augmented Generation) システムクラス"""
-    def __init__(self, google_api_key: str = None):
-        """RAGシステムを初期化します"""
-        self.google_api_key = google_api_key or Config.GOOGLE_API_KEY
-        if not self.google_api_key:
-            raise ValueError("Google API キーが設定されていません。")
+    def __init__(self, google_api_key: str = None, embedding_provider: EmbeddingProvider = None,
+                 generation_provider: GenerationProvider = None):
+        """RAGシステムを初期化します
         
-        genai.configure(api_key=self.google_api_key)
+        埋め込み・回答生成の提供元は省略時に EMBEDDING_PROVIDER / GENERATION_PROVIDER から作ります。
+        """
+        self.google_api_key = google_api_key or Config.GOOGLE_API_KEY
+        self.embedder = embedding_provider or create_embedding_provider(api_key=self.google_api_key)
+        self.generator = generation_provider or create_generation_provider(api_key=self.google_api_key)
         self.db = DatabaseManager()
-        self.embedding_model = Config.EMBEDDING_MODEL
+        self.embedding_model = self.embedder.model
+        self.embedding_cache = EmbeddingCache(self.db, self.embedding_model)
+        self.answer_cache = AnswerCache()
         
-        # 生成AIモデルの設定
-        self.generation_config = Config.GENERATION_CONFIG
-        self.model = genai.GenerativeModel(
-            model_name="gemini-1.5-pro-latest",
-            generation_config=self.generation_config
-        )
+        # 検索の単位（チャンク分割が有効ならチャンク、無効なら文書全体）
+        self.retrieval_table = "document_chunks" if Config.CHUNKING_ENABLED else "documents"
+        # ハイブリッド検索で語彙検索をベクトル検索と並行して実行するためのスレッド
+        self._search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical-search")
+        
+        # pgvector非対応時に使うメモリ常駐インデックス（初回検索時に構築）
+        self.vector_index = self._create_fallback_index()
+        self._index_signature = None
+        self._index_checked_at = 0.0
+        self._index_unsaved_changes = 0
+        # インデックスの同期・差し替えを1スレッドずつ行うためのロックと、再学習中のスレッド
+        self._index_sync_lock = threading.Lock()
+        self._retrain_thread: Optional[threading.Thread] = None
         
     def initialize_database(self):
         """データベースを初期化します"""
         try:
-            print("データベース接続を試みています...")
+            logger.info("データベース接続を試みています...")
             connection = self.db.connect()
             if connection:
-                print("データベース接続に成功しました")
-                print("documentsテーブルの作成を試みています...")
+                logger.info("データベース接続に成功しました。documentsテーブルの作成を試みています...")
                 result = self.db.create_documents_table()
                 if result:
-                    print("documentsテーブルの作成に成功しました")
+                    logger.info("documentsテーブルの作成に成功しました")
                 else:
-                    print("documentsテーブルの作成に失敗しました")
+                    logger.error("documentsテーブルの作成に失敗しました")
                 return result
             else:
-                print("データベース接続に失敗しました")
+                logger.error("データベース接続に失敗しました")
                 return False
-        except Exception as e:
-            print(f"データベース初期化中にエラーが発生しました: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("データベース初期化中にエラーが発生しました")
             return False
     
-    def generate_embedding(self, text: str) -> List[float]:
-        """テキストの埋め込みベクトルを生成します"""
+    def generate_embedding(self, text: str, task_type: str = "retrieval_query") -> List[float]:
+        """テキストの埋め込みベクトルを生成します（キャッシュ済みならAPIを呼びません）"""
+        with stage_timer("embedding"):
+            if not self.embedder.remote:
+                # プロセス内で計算する提供元はキャッシュを引くより計算し直す方が速い
+                return self.embedder.embed([text], task_type)[0]
+            cached = self.embedding_cache.get(text, task_type)
+            if cached is not None:
+                return cached
+            
+            try:
+                logger.debug("埋め込みを生成中... テキスト長: %d", len(text))
+                result = self.embedder.embed([text], task_type)[0]
+                logger.debug("埋め込み生成成功: ベクトル長 %d", len(result))
+                self.embedding_cache.put(text, result, task_type)
+                return result
+            except Exception:
+                # テスト用にダミーベクトルを返す
+                dummy_vector = [0.0] * 768
+                logger.exception("埋め込み生成中にエラーが発生しました。ダミーベクトルを返します。長さ: %d", len(dummy_vector))
+                EMBEDDING_FALLBACKS.inc()
+                return dummy_vector
+    
+    def generate_embeddings(self, texts: List[str], task_type: str = "retrieval_query") -> List[List[float]]:
+        """複数テキストの埋め込みを1回のAPI呼び出しでまとめて生成します
+        
+        キャッシュ済みのテキストはAPIに送りません。
+        失敗時は例外をそのまま送出します（ダミーベクトルは返しません）。
+        """
+        if not texts:
+            return []
+        if not self.embedder.remote:
+            return self.embedder.embed(texts, task_type)
+        results = self.embedding_cache.get_many(texts, task_type)
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if not missing:
+            return results
+        
+        logger.debug("埋め込みを一括生成中... %d 件（キャッシュ済み %d 件）", len(missing), len(texts) - len(missing))
+        missing_texts = [texts[i] for i in missing]
+        generated = self.embedder.embed(missing_texts, task_type)
+        if len(generated) != len(missing):
+            raise ValueError(f"埋め込みの件数が一致しません: {len(generated)} / {len(missing)}")
+        self.embedding_cache.put_many(missing_texts, generated, task_type)
+        for i, vector in zip(missing, generated):
+            results[i] = vector
+        return results
+    
+    def add_documents(self, documents: List[Dict[str, Any]], batch_size: int = None) -> List[Dict[str, Any]]:
+        """複数の文書をバッチ単位で埋め込み・挿入します
+        
+        documents の各要素は title, content, metadata(任意) を持つ辞書です。
+        batch_size 件ごとに埋め込みAPIを1回、INSERTを1文だけ発行し、
+        入力と同じ順序で文書ごとの結果（success, document_id, error）を返します。
+        
+        チャンク分割が有効な場合はバッチ内の全チャンクを batch_size 件ずつまとめて埋め込み、
+        文書全体のベクトルにはチャンクのベクトルの平均を使います（長い本文を埋め込みAPIに送りません）。
+        """
+        batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+        results = [
+            {"title": doc.get("title"), "success": False, "document_id": None, "error": None}
+            for doc in documents
+        ]
+        if not self.db.ensure_connected():
+            for result in results:
+                result["error"] = "データベースに接続されていません"
+            return results
+        
+        for start in range(0, len(documents), batch_size):
+            batch = documents[start:start + batch_size]
+            batch_results = results[start:start + batch_size]
+            
+            valid = []
+            for doc, result in zip(batch, batch_results):
+                if not is_valid_document(doc):
+                    result["error"] = "タイトルと内容は必須です"
+                else:
+                    valid.append((doc, result))
+            if not valid:
+                continue
+            
+            try:
+                rows = self.prepare_documents([doc for doc, _ in valid], batch_size)
+            except Exception as e:
+                logger.error("埋め込みの一括生成中にエラーが発生しました: %s", e)
+                for _, result in valid:
+                    result["error"] = f"埋め込み生成エラー: {e}"
+                continue
+            
+            document_ids = self.db.insert_documents(rows)
+            if len(document_ids) != len(rows):
+                for _, result in valid:
+                    result["error"] = "データベースへの挿入に失敗しました"
+                continue
+            
+            for (_, result), document_id, row in zip(valid, document_ids, rows):
+                result["success"] = True
+                result["document_id"] = document_id
+                if Config.CHUNKING_ENABLED:
+                    for chunk_id, (_, chunk_embedding) in zip(row.get("chunk_ids", []), row["chunks"]):
+                        self._add_to_vector_index(chunk_id, chunk_embedding)
+                else:
+                    self._add_to_vector_index(document_id, row["embedding"])
+        
+        succeeded = sum(1 for result in results if result["success"])
+        logger.info("一括追加完了: %d / %d 件", succeeded, len(documents))
+        return results
+    
+    def prepare_documents(self, documents: List[Dict[str, Any]], batch_size: int = None) -> List[Dict[str, Any]]:
+        """文書を埋め込み、DBに渡す行（title, content, embedding, metadata, チャンク分割時は chunks）を作ります
+        
+        挿入は行わないため、一括取り込みでは複数スレッドから並行して呼び出せます。
+        失敗時は例外をそのまま送出します。
+        """
+        batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+        if Config.CHUNKING_ENABLED:
+            return self._embed_chunked(documents, batch_size)
+        embeddings = self.generate_embeddings([doc["content"] for doc in documents], task_type="retrieval_document")
+        return [
+            {"title": doc["title"], "content": doc["content"], "embedding": embedding, "metadata": doc.get("metadata")}
+            for doc, embedding in zip(documents, embeddings)
+        ]
+    
+    def _embed_chunked(self, documents: List[Dict[str, Any]], batch_size: int) -> List[Dict[str, Any]]:
+        """文書をチャンクに分割して埋め込み、insert_documents に渡す行を作ります"""
+        # 空白だけの本文などでチャンクが1つも作れない場合は、本文全体を1つのチャンクにする
+        chunked = [chunk_text(doc["content"]) or [doc["content"]] for doc in documents]
+        texts = [chunk for chunks in chunked for chunk in chunks]
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            embeddings.extend(self.generate_embeddings(texts[start:start + batch_size], task_type="retrieval_document"))
+        
+        rows = []
+        position = 0
+        for doc, chunks in zip(documents, chunked):
+            chunk_embeddings = embeddings[position:position + len(chunks)]
+            position += len(chunks)
+            rows.append({
+                "title": doc["title"],
+                "content": doc["content"],
+                "embedding": np.mean([normalize_embedding(e) for e in chunk_embeddings], axis=0).tolist(),
+                "metadata": doc.get("metadata"),
+                "chunks": list(zip(chunks, chunk_embeddings)),
+            })
+        return rows
+    
+    def backfill_chunks(self, batch_size: int = None, limit: int = None) -> int:
+        """チャンク分割導入前に追加された文書をチャンク化し、処理した文書数を返します
+        
+        チャンク単位の検索はチャンクの無い文書を見つけられないため、CHUNKING_ENABLED にした後は
+        ingest_worker.py がジョブの無い間に少しずつ実行します（manage_vector_index.py chunks でも実行できます）。
+        limit を指定するとその件数を処理した時点で戻ります。
+        
+        埋め込み・保存に失敗した文書は記録して飛ばし（record_chunk_backfill_failure。本文が空の文書は
+        再試行しません）、後ろの文書の処理を続けます。処理した文書数には飛ばした文書も含むため、
+        0 を返すのは今チャンク化できる文書が残っていない場合だけです。
+        文書の取得や失敗の記録ができない場合は RuntimeError を送出します。
+        """
+        batch_size = batch_size or Config.EMBEDDING_BATCH_SIZE
+        processed = 0
+        while limit is None or processed < limit:
+            size = batch_size if limit is None else min(batch_size, limit - processed)
+            documents = self.db.get_documents_without_chunks(limit=size)
+            if documents is None:
+                raise RuntimeError("未分割の文書を取得できませんでした")
+            if not documents:
+                break
+            valid = [doc for doc in documents if is_valid_document(doc)]
+            for doc in documents:
+                if not is_valid_document(doc):
+                    self._record_backfill_failure(doc["id"], "タイトルまたは本文が空です", retry=False)
+            for doc, (row, error) in zip(valid, self._embed_chunked_per_document(valid, batch_size)):
+                if row is not None:
+                    chunk_ids = self.db.insert_chunks(doc["id"], row["chunks"])
+                    if not chunk_ids:
+                        error = "チャンクを保存できませんでした"
+                    elif self.retrieval_table == "document_chunks":
+                        for chunk_id, (_, chunk_embedding) in zip(chunk_ids, row["chunks"]):
+                            self._add_to_vector_index(chunk_id, chunk_embedding)
+                if error:
+                    self._record_backfill_failure(doc["id"], error)
+            processed += len(documents)
+            logger.info("チャンク化済み: %d 件", processed)
+        return processed
+    
+    def _embed_chunked_per_document(self, documents: List[Dict[str, Any]], batch_size: int) -> List[tuple]:
+        """_embed_chunked の結果を文書ごとの (行, エラー) で返します
+        
+        まとめて埋め込めなかった場合は1件ずつ埋め込み直し、失敗した文書だけをエラーにします。
+        """
         try:
-            print(f"埋め込みを生成中... テキスト長: {len(text)}")
-            embedding = genai.embed_content(
-                model=self.embedding_model,
-                content=text,
-                task_type="retrieval_query"
-            )
-            result = embedding["embedding"]
-            print(f"埋め込み生成成功: ベクトル長 {len(result)}")
-            return result
+            return [(row, None) for row in self._embed_chunked(documents, batch_size)]
         except Exception as e:
-            print(f"埋め込み生成中にエラーが発生しました: {e}")
-            import traceback
-            traceback.print_exc()
-            # テスト用にダミーベクトルを返す
-            dummy_vector = [0.0] * 768
-            print(f"ダミーベクトルを返します。長さ: {len(dummy_vector)}")
-            return dummy_vector
+            if len(documents) <= 1:
+                return [(None, str(e)) for _ in documents]
+            logger.warning("チャンクの一括埋め込みに失敗したため、1件ずつ埋め込み直します: %s", e)
+        results = []
+        for doc in documents:
+            try:
+                results.append((self._embed_chunked([doc], batch_size)[0], None))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+    
+    def _record_backfill_failure(self, document_id: int, error: str, retry: bool = True):
+        logger.error("文書 ID %s のチャンク化に失敗しました。飛ばして続けます: %s", document_id, error)
+        # 記録できないまま続けると同じ文書を取得し続けるため中断する
+        if not self.db.record_chunk_backfill_failure(document_id, error, retry=retry):
+            raise RuntimeError(f"文書 ID {document_id} のチャンク化の失敗を記録できませんでした")
+    
+    def _add_to_vector_index(self, item_id: int, embedding: List[float]):
+        """構築済みのメモリ常駐インデックスに追加分（文書またはチャンク）を反映します"""
+        with self._index_sync_lock:
+            if self._index_signature is None:
+                return
+            self.vector_index.add(item_id, embedding)
+            self._index_unsaved_changes += 1
+            count, max_id = self._index_signature
+            self._index_signature = (count + 1, max(max_id, item_id))
     
     def add_document(self, title: str, content: str, metadata: Dict[str, Any] = None):
         """文書をRAGシステムに追加します"""
-        if not self.db.connection:
-            print("データベースに接続されていません。")
+        if not self.db.ensure_connected():
             return False
         
+        if Config.CHUNKING_ENABLED:
+            result = self.add_documents([{"title": title, "content": content, "metadata": metadata}])[0]
+            if not result["success"]:
+                logger.error("文書追加処理中にエラーが発生しました: %s", result["error"])
+                return False
+            return result["document_id"]
+        
         # テキストの埋め込みを生成
         try:
-            print(f"文書 '{title}' の埋め込みを生成中...")
-            embedding = self.generate_embedding(content)
+            logger.debug("文書 '%s' の埋め込みを生成中...", title)
+            embedding = self.generate_embedding(content, task_type="retrieval_document")
             if not embedding or len(embedding) == 0:
-                print("埋め込みの生成に失敗しました。空のベクトルが返されました。")
+                logger.error("埋め込みの生成に失敗しました。空のベクトルが返されました。")
                 return False
             
-            print(f"埋め込み生成完了: ベクトル長 {len(embedding)}")
-            
             # データベースに保存
-            return self.db.insert_document(title, content, embedding, metadata)
-        except Exception as e:
-            print(f"文書追加処理中にエラーが発生しました: {e}")
-            import traceback
-            traceback.print_exc()
+            document_id = self.db.insert_document(title, content, embedding, metadata)
+            if document_id:
+                self._add_to_vector_index(document_id, embedding)
+            return document_id
+        except Exception:
+            logger.exception("文書追加処理中にエラーが発生しました")
             return False
     
     def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
@@ -107,62 +338,329 @@ class RAGSystem:
         except Exception:
             return 0.0
     
-    def search_similar_documents(self, query: str, top_k: int = 3) -> List[Dict]:
-        """クエリに類似した文書を検索します"""
-        if not self.db.connection:
-            print("データベースに接続されていません。")
-            return []
+    def search_similar_documents(self, query: str, top_k: int = 3, query_vector: np.ndarray = None,
+                                 search_options: Dict[str, Any] = None,
+                                 filters: Dict[str, Any] = None) -> List[Dict]:
+        """クエリに類似した文書を検索します
         
-        # クエリの埋め込みを生成
-        query_embedding = self.generate_embedding(query)
-        if not query_embedding:
+        チャンク分割が有効な場合は類似したチャンクを返します（id は文書ID、
+        content はチャンク本文で、chunk_id と chunk_index が加わります）。
+        正規化済みのクエリベクトルが手元にある場合は query_vector に渡すと埋め込みを再計算しません。
+        
+        search_options でリクエストごとに検索方式を変えられます（省略したキーは Config の値）:
+            mode            "hybrid" / "vector" / "lexical"
+            vector_weight   ハイブリッド時のベクトル検索の重み（0で無効）
+            lexical_weight  ハイブリッド時の語彙検索の重み（0で無効）
+            candidates      統合前に各検索から取る候補数
+            mmr_lambda      MMR の関連度の重み（1で再ランキングなし、小さいほど重複を避ける）
+            mmr_candidates  MMR で選ぶ前に取得する候補数
+        ハイブリッド検索では語彙検索とベクトル検索を並行して実行し、Reciprocal Rank Fusion で
+        統合します。pg_trgm が使えない場合はベクトル検索だけを行います。
+        MMR が有効なら mmr_candidates 件を取得し、その埋め込みから重複の少ない top_k 件を選びます。
+        
+        filters で検索対象を絞り込めます（title: タイトルの部分一致, metadata: メタデータのキーと値の一致。値は文字列として比べます）。
+        絞り込みは近傍探索の前に（または探索と同時に）適用されるため、条件に合う結果が top_k 件返ります。
+        """
+        if not self.db.ensure_connected():
             return []
         
-        # pgvectorが利用可能な場合は、データベースレベルで類似度検索
-        if self.db.has_pgvector:
-            return self.db.search_documents(query_embedding=query_embedding, limit=top_k)
+        options = search_options or {}
+        limit, mmr_lambda = self._mmr_settings(top_k, options)
+        results, query_vector = self._retrieve(query, limit, query_vector, options, filters)
+        return self._finish_search(results, query_vector, top_k, mmr_lambda)
+    
+    @staticmethod
+    def _mmr_settings(top_k: int, options: Dict[str, Any]) -> Tuple[int, Optional[float]]:
+        """(取得する候補数, MMR の関連度の重み) を返します（MMR を使わない場合の重みは None）"""
+        mmr_lambda = float(options.get("mmr_lambda", Config.MMR_LAMBDA))
+        if not (Config.MMR_ENABLED or "mmr_lambda" in options) or mmr_lambda >= 1.0:
+            return top_k, None
+        return max(top_k, int(options.get("mmr_candidates") or Config.MMR_CANDIDATES)), mmr_lambda
+    
+    def _finish_search(self, results: List[Dict], query_vector: Optional[np.ndarray], top_k: int,
+                       mmr_lambda: Optional[float]) -> List[Dict]:
+        """取得した候補を必要なら MMR で選び直し、上位 top_k 件を返します"""
+        request_timing.set_value("candidates", len(results))
+        if mmr_lambda is not None and len(results) > top_k and query_vector is not None:
+            results = self._rerank_mmr(results, query_vector, top_k, mmr_lambda)
+        return results[:top_k]
+    
+    def _retrieve(self, query: str, limit: int, query_vector: Optional[np.ndarray], options: Dict[str, Any],
+                  filters: Optional[Dict[str, Any]]) -> Tuple[List[Dict], Optional[np.ndarray]]:
+        """検索方式に従って最大 limit 件を取得し、(結果, クエリベクトル) を返します"""
+        mode = self._search_mode(options)
+        if mode == "lexical":
+            results = self._search_lexical(query, limit, filters)
+            return self._attach_similarity(results, query_vector), query_vector
         
-        # pgvectorが利用できない場合は、Pythonで類似度計算
-        documents = self.db.get_all_documents()
-        results = []
+        lexical_future = None
+        if mode == "hybrid":
+            candidates = self._hybrid_candidates(limit, options)
+            # 語彙検索はクエリの埋め込み生成も待たずに別の接続で先に始める
+            # 処理時間の内訳（request_timing）を語彙検索のスレッドにも引き継ぐ
+            lexical_future = self._search_pool.submit(
+                contextvars.copy_context().run, self._search_lexical, query, candidates, filters)
         
-        for doc in documents:
-            # 埋め込みデータの処理
-            embedding_data = doc["embedding"]
-            if isinstance(embedding_data, str):
-                doc_embedding = json.loads(embedding_data)
+        if query_vector is None:
+            # クエリの埋め込みを生成
+            # 文書側は保存時に正規化済みのため、クエリも一度だけ正規化して内積で比較する
+            query_vector = normalize_embedding(self.generate_embedding(query))
+        if not np.any(query_vector):
+            # 埋め込みの生成に失敗した（ダミーのゼロベクトル。回答キャッシュの確認で作ったものを含む）場合は
+            # ベクトル検索では近傍が決まらないため、語彙検索の結果だけを返す
+            lexical_results = lexical_future.result()[:limit] if lexical_future else []
+            return self._attach_similarity(lexical_results, None), None
+        
+        if lexical_future is None:
+            return self._vector_search(query_vector, limit, filters), query_vector
+        
+        vector_results = self._vector_search(query_vector, candidates, filters)
+        return self._fuse(vector_results, lexical_future.result(), limit, options, query_vector), query_vector
+    
+    def _search_mode(self, options: Dict[str, Any]) -> str:
+        """検索方式（pg_trgm が使えない場合はベクトル検索のみ）"""
+        mode = options.get("mode") or Config.SEARCH_MODE
+        return mode if mode == "vector" or self.db.has_trgm else "vector"
+    
+    @staticmethod
+    def _hybrid_candidates(limit: int, options: Dict[str, Any]) -> int:
+        """ハイブリッド検索で統合前に各検索から取る候補数"""
+        return max(limit, int(options.get("candidates") or Config.HYBRID_CANDIDATES))
+    
+    def _fuse(self, vector_results: List[Dict], lexical_results: List[Dict], limit: int, options: Dict[str, Any],
+              query_vector: np.ndarray) -> List[Dict]:
+        """ベクトル検索と語彙検索の結果を Reciprocal Rank Fusion で統合し、上位 limit 件を返します"""
+        weights = (
+            options.get("vector_weight", Config.HYBRID_VECTOR_WEIGHT),
+            options.get("lexical_weight", Config.HYBRID_LEXICAL_WEIGHT),
+        )
+        fused = reciprocal_rank_fusion([vector_results, lexical_results], weights, key=self._result_key)
+        return self._attach_similarity(fused[:limit], query_vector)
+    
+    @staticmethod
+    def _rerank_mmr(results: List[Dict], query_vector: np.ndarray, top_k: int, mmr_lambda: float) -> List[Dict]:
+        """取得済みの埋め込みを使い、MMR で重複の少ない top_k 件を選びます（埋め込みが無い結果があれば上位をそのまま返します）"""
+        if any(doc.get("embedding") is None for doc in results):
+            return results[:top_k]
+        vectors = np.stack([np.asarray(doc["embedding"], dtype=np.float32) for doc in results])
+        return [results[i] for i in maximal_marginal_relevance(query_vector, vectors, top_k, mmr_lambda)]
+    
+    def _result_key(self, result: Dict[str, Any]):
+        """検索結果を同一視するためのキー（チャンク検索ならチャンクID、文書検索なら文書ID）"""
+        return result["chunk_id"] if self.retrieval_table == "document_chunks" else result["id"]
+    
+    @staticmethod
+    def _attach_similarity(results: List[Dict], query_vector: Optional[np.ndarray]) -> List[Dict]:
+        """類似度の無い結果（語彙検索のみでヒットしたもの）に、保存済みの埋め込みとの内積を加えます"""
+        for doc in results:
+            if "similarity" in doc:
+                continue
+            if query_vector is not None and doc.get("embedding") is not None:
+                doc["similarity"] = float(np.dot(np.asarray(doc["embedding"], dtype=np.float64), query_vector))
             else:
-                doc_embedding = embedding_data
+                doc["similarity"] = 0.0
+        return results
+    
+    def _search_lexical(self, query: str, limit: int, filters: Dict[str, Any] = None) -> List[Dict]:
+        """語彙検索を行います（ハイブリッド検索ではベクトル検索と並行して別スレッドで呼ばれます）"""
+        with stage_timer("db_search"):
+            return self.db.search_lexical(query, limit, self.retrieval_table, filters)
+    
+    def _vector_search(self, query_vector: np.ndarray, limit: int, filters: Dict[str, Any] = None) -> List[Dict]:
+        """正規化済みのクエリベクトルで近傍検索し、similarity の降順で返します"""
+        with stage_timer("db_search"):
+            # pgvectorが利用可能な場合は、データベースレベルで類似度検索
+            if self.db.has_pgvector:
+                filters = filters or {}
+                if self.retrieval_table == "document_chunks":
+                    results = self.db.search_chunks(query_vector, limit=limit, filters=filters)
+                else:
+                    results = self.db.search_documents(query_embedding=query_vector, limit=limit,
+                                                       title_filter=filters.get("title"),
+                                                       metadata_filter=filters.get("metadata"))
+                return self._rank_by_similarity(results, query_vector)
             
-            # 類似度計算
-            similarity = self.cosine_similarity(query_embedding, doc_embedding)
-            doc["similarity"] = similarity
-            results.append(doc)
+            # pgvectorが利用できない場合は、メモリ常駐インデックスで類似度計算
+            self._sync_vector_index()
+            if filters:
+                # 条件に合うIDをDBで先に求め、その範囲だけを厳密に検索する
+                allowed = self.db.get_filtered_ids(filters, table=self.retrieval_table)
+                if allowed is None:
+                    return []
+                hits = self.vector_index.search_subset(query_vector, limit, allowed)
+            else:
+                hits = self.vector_index.search(query_vector, limit)
+            similarities = dict(hits)
+            # MMR 用に、DBから読み直さずインデックスが持つベクトルを結果に添える
+            vectors = self.vector_index.get_vectors(list(similarities))
+            if self.retrieval_table == "document_chunks":
+                results = self.db.get_chunks_by_ids([chunk_id for chunk_id, _ in hits])
+                for chunk in results:
+                    chunk["similarity"] = similarities[chunk["chunk_id"]]
+                    chunk["embedding"] = vectors.get(chunk["chunk_id"])
+                return results
+            results = self.db.get_documents_by_ids([doc_id for doc_id, _ in hits])
+            for doc in results:
+                doc["similarity"] = similarities[doc["id"]]
+                doc["embedding"] = vectors.get(doc["id"])
+            return results
+    
+    @staticmethod
+    def _rank_by_similarity(results: List[Dict], query_vector: np.ndarray) -> List[Dict]:
+        """pgvector の検索結果に保存済みの埋め込みとの内積を加え、similarity の降順に並べます"""
+        for doc in results:
+            doc["similarity"] = float(np.dot(np.asarray(doc["embedding"], dtype=np.float64), query_vector))
+        # 絞り込み時の反復スキャン（relaxed_order）は距離順が前後することがあるため並べ直す
+        results.sort(key=lambda doc: doc["similarity"], reverse=True)
+        return results
+    
+    def _create_fallback_index(self):
+        """FALLBACK_INDEX_TYPE に応じたメモリ常駐インデックスを作成します"""
+        if Config.FALLBACK_INDEX_TYPE == "ivf":
+            return IVFIndex(Config.EMBEDDING_DIMENSION, Config.IVF_NLISTS, Config.IVF_NPROBE)
+        return VectorIndex(Config.EMBEDDING_DIMENSION)
+    
+    def _sync_vector_index(self, force: bool = False):
+        """メモリ常駐インデックスをデータベースと同期します
         
-        # 類似度でソート
-        results.sort(key=lambda x: x.get("similarity", 0), reverse=True)
-        return results[:top_k]
+        初回は保存済みのIVFインデックスがあれば読み込み、無ければ全件から構築します。
+        以降は VECTOR_INDEX_SYNC_INTERVAL 秒ごとに文書数と最大IDだけを確認し、
+        他のワーカーによる追加・削除があった場合はIDの差分だけを反映します。
+        同期は1スレッドずつ行い、構築済みなら他のスレッドは同期を待たずに現在のインデックスで検索します。
+        IVFの再学習はリクエストの処理を止めないよう、別スレッドで行ってから差し替えます。
+        """
+        if not force and not self._index_sync_due():
+            return
+        # 未構築の間は検索できないため待つ
+        if not self._index_sync_lock.acquire(blocking=force or self._index_signature is None):
+            return
+        try:
+            if force or self._index_sync_due():
+                self._sync_vector_index_locked(force)
+        finally:
+            self._index_sync_lock.release()
     
-    def answer_question(self, question: str, max_context_length: int = 2000) -> str:
-        """質問に対して回答を生成します"""
-        # 関連する文書を検索
-        relevant_docs = self.search_similar_documents(question, top_k=3)
+    def _index_sync_due(self) -> bool:
+        return self._index_signature is None \
+            or time.monotonic() - self._index_checked_at >= Config.VECTOR_INDEX_SYNC_INTERVAL
+    
+    def _sync_vector_index_locked(self, force: bool):
+        """_sync_vector_index の本体（_index_sync_lock を取った状態で呼びます）"""
+        now = time.monotonic()
+        signature = self.db.get_corpus_signature(table=self.retrieval_table)
+        self._index_checked_at = now
+        if not force and signature is not None and signature == self._index_signature:
+            return
         
-        if not relevant_docs:
-            return "関連する文書が見つかりませんでした。"
+        if self._index_signature is None and not force:
+            self._load_persisted_index()
         
-        # コンテキストを作成（最大長を制限）
-        context_parts = []
-        total_length = 0
+        rebuilt = False
+        if force or len(self.vector_index) == 0:
+            ids, vectors = self.db.get_all_embeddings(table=self.retrieval_table)
+            self.vector_index.build(ids, vectors)
+            rebuilt = bool(ids)
+            logger.info("ベクトルインデックスを構築しました: %d 件", len(self.vector_index))
+        else:
+            changes = self._apply_index_delta()
+            if changes is None:
+                return
+            self._index_unsaved_changes += changes
         
-        for doc in relevant_docs:
-            doc_text = f"Document: {doc['title']}\nContent: {doc['content']}\n"
-            if total_length + len(doc_text) > max_context_length:
-                break
-            context_parts.append(doc_text)
-            total_length += len(doc_text)
+        self._index_signature = signature
+        self._persist_vector_index(force=rebuilt)
+        if not rebuilt and isinstance(self.vector_index, IVFIndex) and self.vector_index.needs_retrain():
+            self._start_retrain()
+    
+    def _start_retrain(self):
+        """IVFインデックスの再学習を別スレッドで始めます（実行中なら何もしません）"""
+        if self._retrain_thread is not None and self._retrain_thread.is_alive():
+            return
+        self._retrain_thread = threading.Thread(target=self._retrain_vector_index, name="ivf-retrain", daemon=True)
+        self._retrain_thread.start()
+    
+    def _retrain_vector_index(self):
+        """現在のインデックスの内容で新しいIVFインデックスを学習し、学習中の追加・削除を反映して差し替えます"""
+        try:
+            current = self.vector_index
+            ids, matrix = current.export()
+            retrained = self._create_fallback_index()
+            retrained.build(ids, matrix, normalized=True)
+            with self._index_sync_lock:
+                # 学習中に差し替えられた場合（強制再構築など）は捨てる
+                if self.vector_index is not current:
+                    return
+                current_ids = set(current.ids())
+                trained_ids = set(int(item_id) for item_id in ids)
+                for item_id in trained_ids - current_ids:
+                    retrained.remove(item_id)
+                for item_id, vector in current.get_vectors(sorted(current_ids - trained_ids)).items():
+                    retrained.add(item_id, vector)
+                self.vector_index = retrained
+                self._persist_vector_index(force=True)
+            logger.info("IVFインデックスを再学習しました: %d 件 / %d リスト", len(retrained), retrained.list_count)
+        except Exception:
+            logger.exception("IVFインデックスの再学習に失敗しました")
+    
+    def _apply_index_delta(self):
+        """DBとインデックスのIDを突き合わせ、差分だけを反映して変更件数を返します（失敗時は None）"""
+        db_ids = self.db.get_document_ids(table=self.retrieval_table)
+        if db_ids is None:
+            return None
+        db_ids = set(db_ids)
+        index_ids = set(self.vector_index.ids())
         
-        context = "\n".join(context_parts)
+        removed = index_ids - db_ids
+        for doc_id in removed:
+            self.vector_index.remove(doc_id)
+        added_ids, vectors = self.db.get_embeddings_by_ids(sorted(db_ids - index_ids), table=self.retrieval_table)
+        for doc_id, vector in zip(added_ids, vectors):
+            self.vector_index.add(doc_id, vector)
+        
+        if removed or added_ids:
+            logger.debug("ベクトルインデックスを差分更新しました: 追加 %d 件 / 削除 %d 件", len(added_ids), len(removed))
+        return len(removed) + len(added_ids)
+    
+    def _index_path(self) -> str:
+        """IVFインデックスの保存先（チャンク単位の場合は別ファイル）"""
+        if self.retrieval_table == "documents":
+            return Config.IVF_INDEX_PATH
+        root, ext = os.path.splitext(Config.IVF_INDEX_PATH)
+        return f"{root}_chunks{ext}"
+    
+    def _load_persisted_index(self):
+        """保存済みのIVFインデックスがあれば読み込みます（学習をやり直さずに起動できる）"""
+        path = self._index_path()
+        if not isinstance(self.vector_index, IVFIndex) or not os.path.exists(path):
+            return
+        try:
+            index, _ = IVFIndex.load(path, nprobe=Config.IVF_NPROBE)
+        except Exception as e:
+            logger.warning("IVFインデックスの読み込みに失敗しました: %s", e)
+            return
+        if index.dimension != Config.EMBEDDING_DIMENSION:
+            logger.warning("IVFインデックスの次元数が一致しないため破棄します: %d", index.dimension)
+            return
+        self.vector_index = index
+        logger.info("IVFインデックスを読み込みました: %d 件 / %d リスト", len(index), index.list_count)
+    
+    def _persist_vector_index(self, force: bool = False):
+        """IVFインデックスをファイルへ保存します（再学習時か、未保存の変更が溜まった時）"""
+        if not isinstance(self.vector_index, IVFIndex):
+            return
+        if not force and self._index_unsaved_changes < Config.IVF_SAVE_AFTER_CHANGES:
+            return
+        try:
+            self.vector_index.save(self._index_path(), self._index_signature)
+            self._index_unsaved_changes = 0
+        except OSError as e:
+            logger.error("IVFインデックスの保存に失敗しました: %s", e)
+    
+    def _build_prompt(self, question: str, relevant_docs: List[Dict],
+                      max_context_tokens: int = None) -> Tuple[str, Dict[str, Any]]:
+        """検索結果をトークン予算内のコンテキストに詰め、(回答生成用のプロンプト, 詰めた結果) を返します"""
+        with stage_timer("context_build"):
+            packed = pack_context(question, relevant_docs, token_budget=max_context_tokens)
         
         # プロンプト作成
         prompt = f"""以下のコンテキストに基づいて、質問に回答してください。
@@ -170,23 +668,196 @@ class RAGSystem:
 回答は簡潔で分かりやすくしてください。
 
 コンテキスト:
-{context}
+{packed['context']}
 
 質問: {question}
 
 回答:"""
+        return prompt, packed
+    
+    def _prepare_prompt(self, question: str, relevant_docs: List[Dict],
+                        max_context_tokens: int = None) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """(プロンプト, 出典, コンテキストの使用状況) を返します（出典はコンテキストに入れた文書だけ）"""
+        prompt, packed = self._build_prompt(question, relevant_docs, max_context_tokens)
+        request_timing.set_value("prompt_chars", len(prompt))
+        request_timing.set_value("prompt_tokens", estimate_tokens(prompt))
+        sources = self._format_sources([item["doc"] for item in packed["documents"]])
+        return prompt, sources, self._context_usage(packed)
+    
+    @staticmethod
+    def _context_usage(packed: Dict[str, Any]) -> Dict[str, Any]:
+        """コンテキストのトークン予算の使用状況（APIで返す形式）"""
+        return {
+            "used_tokens": packed["used_tokens"],
+            "budget": packed["budget"],
+            "documents": len(packed["documents"]),
+            "trimmed": sum(1 for item in packed["documents"] if item["trimmed"]),
+        }
+    
+    def _format_sources(self, relevant_docs: List[Dict]) -> List[Dict[str, Any]]:
+        """検索結果をAPIで返す出典の形式（埋め込み・本文全体を除く）にします"""
+        sources = []
+        for doc in relevant_docs:
+            source = {
+                "id": doc["id"],
+                "title": doc["title"],
+                "similarity": float(doc.get("similarity", 0.0)),
+                "preview": (doc.get("content") or "")[:Config.DOCUMENT_PREVIEW_LENGTH],
+            }
+            if "chunk_index" in doc:
+                source["chunk_index"] = doc["chunk_index"]
+            sources.append(source)
+        return sources
+    
+    @staticmethod
+    def _cache_variant(max_context_tokens: int, search_options: Dict[str, Any] = None,
+                       filters: Dict[str, Any] = None):
+        """回答を左右する質問以外の条件（回答キャッシュはこれが一致するエントリだけを使う）"""
+        budget = Config.CONTEXT_TOKEN_BUDGET if max_context_tokens is None else max_context_tokens
+        return budget, json.dumps([search_options or {}, filters or {}], sort_keys=True)
+    
+    def _check_answer_cache(self, question: str, max_context_tokens: int, search_options: Dict[str, Any] = None,
+                            filters: Dict[str, Any] = None):
+        """回答キャッシュを引き、(クエリベクトル, コーパスのバージョン, キャッシュ済みの回答) を返します
+        
+        キャッシュ無効時は (None, None, None) を返します。クエリベクトルは検索にそのまま使えます。
+        """
+        if not Config.ANSWER_CACHE_ENABLED:
+            return None, None, None
+        query_vector = normalize_embedding(self.generate_embedding(question))
+        corpus_version = self.db.get_corpus_version()
+        cached = self.answer_cache.get(query_vector, corpus_version,
+                                       variant=self._cache_variant(max_context_tokens, search_options, filters))
+        if cached:
+            logger.debug("回答キャッシュにヒットしました（類似度 %.3f）", cached["similarity"])
+        return query_vector, corpus_version, cached
+    
+    def query(self, question: str, max_context_tokens: int = None,
+              search_options: Dict[str, Any] = None, filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """質問に対する回答と、回答に使った出典を返します（類似の質問が回答済みならキャッシュから返します）
+        
+        search_options（検索方式）と filters（検索対象の絞り込み）は search_similar_documents に渡します。
+        timings には段階ごとの処理時間（embed_ms, search_ms, pack_ms, generate_ms, total_ms）と
+        検索の候補数 candidates、プロンプトの大きさ prompt_chars / prompt_tokens が入ります。
+        """
+        with request_timing.collect_timings() as timings:
+            result = self._answer(question, max_context_tokens, search_options, filters)
+        result["timings"] = timings.as_dict()
+        logger.debug("クエリの処理時間: %.1f ms", result["timings"]["total_ms"], extra={"timings": result["timings"]})
+        return result
+    
+    def _answer(self, question: str, max_context_tokens: int = None, search_options: Dict[str, Any] = None,
+                filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """query の本体（回答キャッシュの確認・検索・コンテキストの組み立て・回答生成）"""
+        query_vector, corpus_version, cached = self._check_answer_cache(
+            question, max_context_tokens, search_options, filters)
+        if cached:
+            return {"answer": cached["answer"], "sources": cached["sources"], "cached": True, "context_usage": None}
+        
+        # 関連する文書を検索
+        relevant_docs = self.search_similar_documents(question, top_k=3, query_vector=query_vector,
+                                                      search_options=search_options, filters=filters)
+        
+        if not relevant_docs:
+            return {"answer": "関連する文書が見つかりませんでした。", "sources": [], "cached": False,
+                    "context_usage": None}
         
+        prompt, sources, context_usage = self._prepare_prompt(question, relevant_docs, max_context_tokens)
         try:
             # 回答を生成
-            response = self.model.generate_content(prompt)
-            return response.text
+            with stage_timer("generation"):
+                answer = self.generator.generate(prompt)
         except Exception as e:
-            return f"回答生成中にエラーが発生しました: {e}"
+            return {"answer": f"回答生成中にエラーが発生しました: {e}", "sources": sources, "cached": False,
+                    "context_usage": context_usage}
+        
+        if query_vector is not None:
+            self.answer_cache.put(query_vector, corpus_version, answer, sources,
+                                  variant=self._cache_variant(max_context_tokens, search_options, filters))
+        return {"answer": answer, "sources": sources, "cached": False, "context_usage": context_usage}
+    
+    def answer_question(self, question: str, max_context_tokens: int = None,
+                        search_options: Dict[str, Any] = None, filters: Dict[str, Any] = None) -> str:
+        """質問に対して回答を生成します（filters で検索対象の文書を絞り込めます）"""
+        return self.query(question, max_context_tokens, search_options, filters)["answer"]
+    
+    def answer_question_stream(self, question: str, max_context_tokens: int = None,
+                               search_options: Dict[str, Any] = None,
+                               filters: Dict[str, Any] = None) -> Iterator[Tuple[str, Any]]:
+        """質問に対する回答をストリーミングで生成します
+        
+        (イベント名, データ) の組を順に返すジェネレータです。検索が終わった時点で
+        まず ("sources", 出典のリスト) を返し、続いて生成されたテキストを届いた順に
+        ("token", テキスト) で返し、最後に ("done", 回答全体) を返します。
+        失敗時は ("error", メッセージ) を返して終了します。
+        """
+        try:
+            query_vector, corpus_version, cached = self._check_answer_cache(
+                question, max_context_tokens, search_options, filters)
+            if cached:
+                yield "sources", cached["sources"]
+                yield "token", cached["answer"]
+                yield "done", cached["answer"]
+                return
+            relevant_docs = self.search_similar_documents(question, top_k=3, query_vector=query_vector,
+                                                          search_options=search_options, filters=filters)
+        except Exception as e:
+            yield "error", f"文書検索中にエラーが発生しました: {e}"
+            return
+        
+        if not relevant_docs:
+            answer = "関連する文書が見つかりませんでした。"
+            yield "sources", []
+            yield "token", answer
+            yield "done", answer
+            return
+        
+        prompt, sources, _ = self._prepare_prompt(question, relevant_docs, max_context_tokens)
+        yield "sources", sources
+        parts = []
+        started = time.monotonic()
+        try:
+            for text in self.generator.generate_stream(prompt):
+                parts.append(text)
+                yield "token", text
+        except Exception as e:
+            yield "error", f"回答生成中にエラーが発生しました: {e}"
+            return
+        # ストリーミングでは生成開始から最後のトークンまで（クライアントへの送信待ちを含む）を記録する
+        record_stage("generation", time.monotonic() - started)
+        answer = "".join(parts)
+        if query_vector is not None:
+            self.answer_cache.put(query_vector, corpus_version, answer, sources,
+                                  variant=self._cache_variant(max_context_tokens, search_options, filters))
+        yield "done", answer
+    
+    def delete_document(self, document_id: int) -> bool:
+        """文書を削除し、メモリ常駐インデックスからも取り除きます（チャンクは連動して削除されます）"""
+        item_ids = [document_id]
+        if self._index_signature is not None and self.retrieval_table == "document_chunks":
+            item_ids = self.db.get_chunk_ids(document_id)
+        success = self.db.delete_document(document_id)
+        with self._index_sync_lock:
+            if success and self._index_signature is not None:
+                for item_id in item_ids:
+                    self.vector_index.remove(item_id)
+                self._index_unsaved_changes += len(item_ids)
+                count, max_id = self._index_signature
+                self._index_signature = (count - len(item_ids), max_id)
+        return success
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """埋め込みキャッシュ・回答キャッシュのヒット・ミス数を返します"""
+        return {"embedding": self.embedding_cache.stats(), "answer": self.answer_cache.stats()}
+    
+    def get_document_count(self, mode: str = "cached") -> int:
+        """データベース内の文書数を取得します（mode は DatabaseManager.count_documents を参照）"""
+        return self.db.count_documents(mode)
     
-    def get_document_count(self) -> int:
-        """データベース内の文書数を取得します"""
-        documents = self.db.get_all_documents()
-        return len(documents)
+    def list_documents(self, limit: int = Config.DOCUMENT_PAGE_SIZE, cursor: str = None,
+                       fields: List[str] = None) -> Dict[str, Any]:
+        """文書一覧を1ページ取得します（next_cursor を渡すと続きを返します）"""
+        return self.db.list_documents(limit=limit, cursor=cursor, fields=fields)
     
     def list_all_documents(self) -> List[Dict]:
         """すべての文書のリストを取得します"""
@@ -194,5 +865,10 @@ class RAGSystem:
     
     def close(self):
         """RAGシステムを終了します"""
+        if self._retrain_thread is not None:
+            self._retrain_thread.join()
+        if self._index_unsaved_changes:
+            self._persist_vector_index(force=True)
+        self._search_pool.shutdown(wait=True)
         if self.db:
             self.db.disconnect()
@@ -0,0 +1,63 @@
+from typing import Any, Callable, Dict, List, Sequence
+import numpy as np
+from config import Config
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Dict[str, Any]]], weights: Sequence[float],
+                           key: Callable[[Dict[str, Any]], Any], k: int = None) -> List[Dict[str, Any]]:
+    """複数の検索結果を Reciprocal Rank Fusion で1つの順位にまとめます
+
+    各結果の順位 r（1始まり）に対して weight / (k + r) を合計したスコアの降順で返します。
+    スコアの尺度が異なる検索（ベクトルと語彙）でも順位だけで統合できます。
+    同じ要素が複数の結果にある場合は先に現れた辞書を使い、rrf_score を加えます。
+    """
+    k = Config.RRF_K if k is None else k
+    scores: Dict[Any, float] = {}
+    items: Dict[Any, Dict[str, Any]] = {}
+    for results, weight in zip(result_lists, weights):
+        if weight <= 0:
+            continue
+        for rank, item in enumerate(results, start=1):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + weight / (k + rank)
+            if item_key in items:
+                # 後の結果にしか無い項目（語彙スコア等）を補う
+                for field, value in item.items():
+                    items[item_key].setdefault(field, value)
+            else:
+                items[item_key] = dict(item)
+
+    fused = sorted(items, key=lambda item_key: scores[item_key], reverse=True)
+    for item_key in fused:
+        items[item_key]["rrf_score"] = scores[item_key]
+    return [items[item_key] for item_key in fused]
+
+def maximal_marginal_relevance(query_vector, vectors, k: int, lambda_mult: float) -> List[int]:
+    """Maximal Marginal Relevance で k 件を選び、選んだ順に vectors の位置を返します
+
+    各ステップで lambda_mult * (クエリとの類似度) - (1 - lambda_mult) * (選択済みとの最大類似度)
+    が最大の候補を選びます。lambda_mult=1 なら類似度順そのもの、小さいほど重複を避けます。
+    ベクトルは内部で単位長に正規化するため、類似度はコサイン類似度です。
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2 or len(matrix) == 0 or k <= 0:
+        return []
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = matrix @ query
+    redundancy = np.zeros(len(matrix), dtype=np.float32)
+    available = np.ones(len(matrix), dtype=bool)
+    selected: List[int] = []
+    for _ in range(min(k, len(matrix))):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        # 選択済みとの最大類似度を、今選んだ候補との類似度で更新する
+        similarities = matrix @ matrix[best]
+        redundancy = similarities if len(selected) == 1 else np.maximum(redundancy, similarities)
+    return selected
@@ -0,0 +1,69 @@
+"""
+リクエスト単位の処理時間の内訳
+
+collect_timings() の with 文の中で metrics.stage_timer 等が記録した段階ごとの時間を合計し、
+/api/query の timings（embed_ms, search_ms, pack_ms, generate_ms, total_ms 等）として返せる形にします。
+記録先は contextvars で持つため、同時に処理している他のリクエストの時間は混ざりません
+（別スレッドで実行する処理は contextvars.copy_context() で文脈を引き継いでください）。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# 段階名（metrics.STAGES）と timings のキーの対応
+STAGE_KEYS = {
+    "embedding": "embed_ms",
+    "db_search": "search_ms",
+    "context_build": "pack_ms",
+    "generation": "generate_ms",
+}
+
+class RequestTimings:
+    """1リクエスト分の段階ごとの合計時間と、候補数・プロンプトの大きさ等の値"""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans: Dict[str, float] = {}
+        self._values: Dict[str, Any] = {}
+
+    def add_span(self, stage: str, seconds: float):
+        with self._lock:
+            self._spans[stage] = self._spans.get(stage, 0.0) + seconds
+
+    def set_value(self, key: str, value: Any):
+        with self._lock:
+            self._values[key] = value
+
+    def as_dict(self) -> Dict[str, Any]:
+        """ミリ秒単位の内訳を返します（並行して実行した検索は search_ms に合算されるため、合計が total_ms を超えることがあります）"""
+        with self._lock:
+            timings = {key: round(self._spans.get(stage, 0.0) * 1000, 2) for stage, key in STAGE_KEYS.items()}
+            timings["total_ms"] = round((time.perf_counter() - self.started) * 1000, 2)
+            timings.update(self._values)
+        return timings
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+@contextmanager
+def collect_timings():
+    """with 文の中で記録された段階の時間を集める RequestTimings を返します"""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+def add_span(stage: str, seconds: float):
+    """処理中のリクエストがあれば、段階 stage に seconds 秒を加えます"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add_span(stage, seconds)
+
+def set_value(key: str, value: Any):
+    """処理中のリクエストがあれば、timings に値（候補数等）を記録します"""
+    timings = _current.get()
+    if timings is not None:
+        timings.set_value(key, value)
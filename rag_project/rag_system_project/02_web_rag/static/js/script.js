@@ -180,47 +180,123 @@ document.addEventListener('DOMContentLoaded', function() {
     const askButton = document.getElementById('ask-btn');
     const qaResults = document.getElementById('qa-results');
     
+    // SSEの1イベント分（"event: ..." と "data: ..." の行）を解析
+    function parseSseEvent(block) {
+        let event = 'message';
+        const dataLines = [];
+        block.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        return { event, data: dataLines.length ? JSON.parse(dataLines.join('\n')) : {} };
+    }
+    
+    // 質問・出典・回答の表示枠を作成して先頭に追加
+    function createQaItem(question) {
+        const qaItem = document.createElement('div');
+        qaItem.className = 'qa-item';
+        qaItem.innerHTML = `
+            <div class="qa-question"></div>
+            <ul class="qa-sources"></ul>
+            <div class="qa-answer"></div>
+            <div class="qa-timestamp"></div>
+        `;
+        qaItem.querySelector('.qa-question').textContent = '質問: ' + question;
+        qaResults.insertBefore(qaItem, qaResults.firstChild);
+        return qaItem;
+    }
+    
+    function renderSources(qaItem, sources) {
+        const list = qaItem.querySelector('.qa-sources');
+        list.innerHTML = '';
+        (sources || []).forEach(source => {
+            const item = document.createElement('li');
+            item.textContent = `${source.title}（類似度 ${source.similarity.toFixed(3)}）`;
+            list.appendChild(item);
+        });
+    }
+    
+    // ストリーミング非対応のブラウザ向け（回答全体をまとめて受け取る）
+    function askWithoutStreaming(question, qaItem) {
+        return fetch('/api/query', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ question })
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+            renderSources(qaItem, data.sources);
+            qaItem.querySelector('.qa-answer').textContent = data.answer;
+            qaItem.querySelector('.qa-timestamp').textContent = data.timestamp;
+        });
+    }
+    
     askButton.addEventListener('click', () => {
         const question = questionInput.value.trim();
         if (!question) return;
         
-        // ローディング表示
+        // ローディング表示（最初の出典が届いた時点で消す）
         showLoading();
+        const qaItem = createQaItem(question);
+        const answerEl = qaItem.querySelector('.qa-answer');
+        questionInput.value = '';
         
-        // APIリクエスト
-        fetch('/api/query', {
+        fetch('/api/query/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({ question })
         })
-        .then(response => response.json())
-        .then(data => {
-            hideLoading();
-            
-            if (data.success) {
-                // 質問と回答を表示
-                const qaItem = document.createElement('div');
-                qaItem.className = 'qa-item';
-                qaItem.innerHTML = `
-                    <div class="qa-question">質問: ${data.question}</div>
-                    <div class="qa-answer">${data.answer}</div>
-                    <div class="qa-timestamp">${data.timestamp}</div>
-                `;
-                
-                // 最新の質問を先頭に表示
-                qaResults.insertBefore(qaItem, qaResults.firstChild);
-                
-                // 入力フィールドをクリア
-                questionInput.value = '';
-            } else {
-                showNotification('エラー: ' + data.error, 'error');
+        .then(response => {
+            if (!response.ok || !response.body || !window.TextDecoder) {
+                return askWithoutStreaming(question, qaItem);
             }
+            
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            // 届いたイベントから順に描画する
+            const handleEvent = ({ event, data }) => {
+                if (event === 'sources') {
+                    hideLoading();
+                    renderSources(qaItem, data.sources);
+                } else if (event === 'token') {
+                    answerEl.textContent += data.text;
+                } else if (event === 'done') {
+                    qaItem.querySelector('.qa-timestamp').textContent = data.timestamp;
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                }
+            };
+            
+            const read = () => reader.read().then(({ done, value }) => {
+                if (done) {
+                    return;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                const blocks = buffer.split('\n\n');
+                buffer = blocks.pop();
+                blocks.filter(block => block.trim()).forEach(block => handleEvent(parseSseEvent(block)));
+                return read();
+            });
+            return read();
+        })
+        .then(() => {
+            hideLoading();
         })
         .catch(error => {
             hideLoading();
-            showNotification('通信エラーが発生しました: ' + error, 'error');
+            showNotification('エラー: ' + error.message, 'error');
         });
     });
     
@@ -279,10 +355,14 @@ document.addEventListener('DOMContentLoaded', function() {
                 docContentInput.value = '';
                 docMetadataInput.value = '';
                 
-                // 文書リスト更新
-                fetchDocuments();
-                
                 showNotification(data.message, 'success');
+                
+                // ジョブとして受け付けた場合は完了を待ってから文書リストを更新
+                if (data.job_id) {
+                    waitForJob(data.status_url);
+                } else {
+                    fetchDocuments();
+                }
             } else {
                 showNotification('エラー: ' + data.error, 'error');
             }
@@ -292,11 +372,42 @@ document.addEventListener('DOMContentLoaded', function() {
             showNotification('通信エラーが発生しました: ' + error, 'error');
         });
     });
+    // 文書追加ジョブの完了をポーリングで待つ
+    function waitForJob(statusUrl, interval = 1000) {
+        fetch(statusUrl)
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    showNotification('エラー: ' + data.error, 'error');
+                    return;
+                }
+                const job = data.job;
+                if (job.status === 'succeeded') {
+                    showNotification(`文書の追加が完了しました（${job.processed} / ${job.total} 件）`, 'success');
+                    fetchDocuments();
+                } else if (job.status === 'failed') {
+                    showNotification('文書の追加に失敗しました: ' + job.last_error, 'error');
+                    fetchDocuments();
+                } else {
+                    setTimeout(() => waitForJob(statusUrl, Math.min(interval * 2, 10000)), interval);
+                }
+            })
+            .catch(error => {
+                showNotification('通信エラーが発生しました: ' + error, 'error');
+            });
+    }
+    
       // 文書一覧取得・表示機能
-    function fetchDocuments() {
+    function fetchDocuments(cursor) {
         showLoading();
         
-        fetch('/api/documents')
+        // 一覧は本文プレビューのみをページ単位で取得（cursor指定時は続きを追記）
+        const params = new URLSearchParams({ fields: 'id,title,preview,content_length,metadata,created_at' });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        
+        fetch('/api/documents?' + params.toString())
             .then(response => response.json())
             .then(data => {
                 hideLoading();
@@ -305,11 +416,22 @@ document.addEventListener('DOMContentLoaded', function() {
                     const documentsContainer = document.getElementById('documents-container');
                     const docCount = document.getElementById('doc-count');
                     
-                    // 文書数表示
-                    docCount.textContent = data.count;
-                    
                     // 文書リストを表示
-                    documentsContainer.innerHTML = '';
+                    if (cursor) {
+                        const loadMoreBtn = document.getElementById('load-more-documents');
+                        if (loadMoreBtn) {
+                            loadMoreBtn.remove();
+                        }
+                    } else {
+                        documentsContainer.innerHTML = '';
+                    }
+                    
+                    // 文書数表示（総数が取れない場合は表示済みの件数）
+                    if (typeof data.total === 'number' && data.total >= 0) {
+                        docCount.textContent = data.total;
+                    } else {
+                        docCount.textContent = documentsContainer.querySelectorAll('.document-card').length + data.count;
+                    }
                     
                     console.log(`文書を表示中: ${data.documents.length} 件の文書`);
                     
@@ -337,7 +459,7 @@ document.addEventListener('DOMContentLoaded', function() {
                             }
                         }                        docCard.innerHTML = `
                             <div class="document-title">${doc.title}</div>
-                            <div class="document-content">${doc.content}</div>
+                            <div class="document-content">${doc.preview !== undefined ? doc.preview : doc.content}${doc.content_length > (doc.preview || '').length ? '…' : ''}</div>
                             ${metadataHtml}
                             <div class="document-actions">
                                 <button class="delete-btn" data-id="${doc.id}" data-title="${doc.title}" type="button" 
@@ -396,6 +518,16 @@ document.addEventListener('DOMContentLoaded', function() {
                             console.error(`削除ボタンが見つかりません: ID=${doc.id}`);
                         }
                     });
+                    
+                    // 続きがある場合は「さらに読み込む」ボタンを表示
+                    if (data.has_more && data.next_cursor) {
+                        const loadMoreBtn = document.createElement('button');
+                        loadMoreBtn.id = 'load-more-documents';
+                        loadMoreBtn.type = 'button';
+                        loadMoreBtn.textContent = 'さらに読み込む';
+                        loadMoreBtn.addEventListener('click', () => fetchDocuments(data.next_cursor));
+                        documentsContainer.appendChild(loadMoreBtn);
+                    }
                 } else {
                     showNotification('エラー: ' + data.error, 'error');
                 }
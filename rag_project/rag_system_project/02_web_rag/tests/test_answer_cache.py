@@ -0,0 +1,40 @@
+import numpy as np
+from unittest.mock import patch
+from answer_cache import AnswerCache
+
+def _vector(*values):
+    return np.array(list(values) + [0.0] * (8 - len(values)), dtype=np.float32)
+
+def test_similar_question_hits_within_threshold():
+    """しきい値以上に近い質問は同じバージョンならヒットし、遠い質問はミスすること"""
+    cache = AnswerCache(max_size=10, ttl=60, threshold=0.9)
+    cache.put(_vector(1.0, 0.1), 1, "回答", [{"id": 3}])
+
+    hit = cache.get(_vector(1.0, 0.0), 1)
+    assert hit["answer"] == "回答" and hit["sources"] == [{"id": 3}]
+    assert cache.get(_vector(0.0, 1.0), 1) is None
+    assert cache.get(_vector(1.0, 0.0), 1, variant=500) is None
+    assert cache.stats()["hits"] == 1
+
+def test_corpus_version_change_invalidates():
+    """コーパスのバージョンが変わると古いエントリは使われず破棄されること"""
+    cache = AnswerCache(max_size=10, ttl=60, threshold=0.9)
+    cache.put(_vector(1.0), 1, "古い回答", [])
+
+    assert cache.get(_vector(1.0), 2) is None
+    assert cache.stats()["size"] == 0
+
+def test_ttl_and_lru_eviction():
+    """TTLで失効し、上限を超えると最も使われていないエントリから追い出されること"""
+    cache = AnswerCache(max_size=2, ttl=10, threshold=0.99)
+    with patch('answer_cache.time.monotonic', return_value=100.0):
+        cache.put(_vector(1.0), 1, "a", [])
+        cache.put(_vector(0.0, 1.0), 1, "b", [])
+        assert cache.get(_vector(1.0), 1)["answer"] == "a"
+        cache.put(_vector(0.0, 0.0, 1.0), 1, "c", [])
+        assert cache.get(_vector(0.0, 1.0), 1) is None
+        assert cache.get(_vector(1.0), 1)["answer"] == "a"
+
+    with patch('answer_cache.time.monotonic', return_value=111.0):
+        assert cache.get(_vector(1.0), 1) is None
+        assert cache.stats()["size"] == 0
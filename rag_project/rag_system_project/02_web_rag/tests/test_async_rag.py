@@ -0,0 +1,120 @@
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock
+from providers import LocalEmbeddingProvider, StubGenerationProvider
+
+def _make_async_rag(search_delay=0.0):
+    """DB を非同期のモックに差し替えた AsyncRAGSystem を作成（検索は search_delay 秒かかる）"""
+    from async_rag import AsyncRAGSystem
+    from rag_system import RAGSystem
+
+    embedder = LocalEmbeddingProvider(dimension=768)
+    rag = RAGSystem(embedding_provider=embedder, generation_provider=StubGenerationProvider(chunk_size=4))
+    rag.db = MagicMock()
+    rag.db.has_pgvector = True
+    rag.db.has_trgm = True
+    rag.retrieval_table = "documents"
+    rag.answer_cache.get = MagicMock(return_value=None)
+
+    doc = {"id": 1, "title": "パスワード", "content": "パスワードは設定画面から再設定できます",
+           "embedding": embedder.embed_one("パスワードは設定画面から再設定できます")}
+    calls = []
+
+    async def search(name, *args, **kwargs):
+        calls.append((name, "start", time.monotonic()))
+        await asyncio.sleep(search_delay)
+        calls.append((name, "end", time.monotonic()))
+        return [dict(doc)]
+
+    db = MagicMock()
+    db.is_connected = True
+    db.has_pgvector = True
+    db.search_documents = lambda *args, **kwargs: search("vector", *args, **kwargs)
+    db.search_lexical = lambda *args, **kwargs: search("lexical", *args, **kwargs)
+    db.get_corpus_version = AsyncMock(return_value=1)
+    return AsyncRAGSystem(rag, db), calls
+
+def test_aquery_runs_lexical_search_concurrently_with_vector_search():
+    """ハイブリッド検索で語彙検索とベクトル検索が同時に走り、同期版と同じ形式の結果と処理時間を返すこと"""
+    async_rag, calls = _make_async_rag(search_delay=0.05)
+
+    result = asyncio.run(async_rag.aquery("パスワードの再設定", search_options={"mode": "hybrid"}))
+
+    assert result["answer"].startswith("スタブの回答です")
+    assert [source["id"] for source in result["sources"]] == [1]
+    assert result["cached"] is False and result["context_usage"]["documents"] == 1
+    assert {"embed_ms", "search_ms", "generate_ms", "total_ms"} <= set(result["timings"])
+    events = {(name, kind): at for name, kind, at in calls}
+    # 語彙検索はベクトル検索が終わる前に始まっている
+    assert events[("lexical", "start")] < events[("vector", "end")]
+    assert events[("vector", "start")] < events[("lexical", "end")]
+
+def test_many_questions_share_one_event_loop():
+    """多数の質問を同時に処理しても、待ち時間が直列に積み上がらないこと"""
+    async_rag, _ = _make_async_rag(search_delay=0.05)
+    async_rag.rag.generator.latency = 0.1
+
+    async def run_all():
+        return await asyncio.gather(*(async_rag.aanswer_question(f"質問{i}") for i in range(50)))
+
+    started = time.monotonic()
+    answers = asyncio.run(run_all())
+    assert len(answers) == 50 and all(answer.startswith("スタブの回答です") for answer in answers)
+    # 直列なら 50 × 0.15 秒かかる
+    assert time.monotonic() - started < 2.0
+
+def test_stream_yields_same_events_as_sync_version():
+    """ストリーミングが sources → token（複数）→ done の順に返し、断片をつなぐと回答全体になること"""
+    async_rag, _ = _make_async_rag()
+
+    async def collect():
+        return [item async for item in async_rag.aanswer_question_stream("パスワードの再設定")]
+
+    events = asyncio.run(collect())
+    assert events[0][0] == "sources" and events[-1][0] == "done"
+    tokens = [data for event, data in events if event == "token"]
+    assert len(tokens) > 1 and "".join(tokens) == events[-1][1]
+
+def test_asgi_query_route_answers_without_flask():
+    """ASGI アプリの /api/query が同期版と同じ形式で応答し、検索オプションの誤りは400を返すこと"""
+    from asgi_app import create_asgi_app
+
+    async_rag, _ = _make_async_rag()
+    app = create_asgi_app(async_rag, flask_app=MagicMock())
+
+    async def post(body, headers=()):
+        received = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/api/query", "headers": list(headers)}
+        await app(scope, receive, send)
+        return sent[0]["status"], json.loads(b"".join(message.get("body", b"") for message in sent[1:]))
+
+    status, body = asyncio.run(post({"question": "パスワードの再設定"}, [(b"x-rag-timings", b"1")]))
+    assert status == 200 and body["success"] is True
+    assert body["sources"][0]["id"] == 1 and "total_ms" in body["timings"]
+
+    status, body = asyncio.run(post({"question": "質問", "search": {"mode": "unknown"}}))
+    assert status == 400 and body["success"] is False
+
+def test_corpus_version_is_shared_with_sync_manager():
+    """非同期版のコーパスのバージョンは同期版がプロセス内に保持した値を使い、失効後は DB から読み直すこと"""
+    from async_db import AsyncDatabaseManager
+    from db_utils import DatabaseManager
+
+    sync = DatabaseManager(min_size=1, max_size=1)
+    db = AsyncDatabaseManager(sync)
+    sync.remember_corpus_version(7, time.monotonic())
+    assert asyncio.run(db.get_corpus_version()) == 7
+
+    # 失効後は DB に問い合わせる（未接続のため取得できない）
+    sync.remember_corpus_version(7, time.monotonic() - 3600)
+    assert sync.cached_corpus_version() is None
+    assert asyncio.run(db.get_corpus_version()) is None
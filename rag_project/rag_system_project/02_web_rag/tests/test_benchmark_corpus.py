@@ -0,0 +1,34 @@
+import numpy as np
+from benchmarks.corpus import FakeEmbedder, SyntheticCorpus
+
+def test_synthetic_corpus_is_deterministic_for_any_range():
+    """同じ seed なら、取り出す範囲によらず i 番目の文書が同じ内容になること"""
+    corpus = SyntheticCorpus(dimension=32, clusters=4, seed=7)
+    whole = list(corpus.documents(0, 1500))
+    part = list(SyntheticCorpus(dimension=32, clusters=4, seed=7).documents(990, 1010))
+
+    assert len(whole) == 1500 and len(part) == 20
+    for expected, actual in zip(whole[990:1010], part):
+        assert expected["content"] == actual["content"]
+        assert expected["metadata"] == actual["metadata"]
+        np.testing.assert_array_equal(expected["embedding"], actual["embedding"])
+    assert np.allclose(np.linalg.norm(whole[0]["embedding"]), 1.0, atol=1e-5)
+
+def test_queries_are_closest_to_documents_of_the_same_cluster():
+    """クエリベクトルに最も近い文書が正解のトピックの文書になること"""
+    corpus = SyntheticCorpus(dimension=64, clusters=8, seed=0)
+    documents = list(corpus.documents(0, 400))
+    matrix = np.stack([document["embedding"] for document in documents])
+
+    for query in corpus.queries(10):
+        best = documents[int(np.argmax(matrix @ query["embedding"]))]
+        assert best["metadata"]["cluster"] == query["cluster"]
+
+def test_fake_embedder_returns_registered_or_hashed_vectors():
+    """登録済みのテキストは登録したベクトル、未登録はテキストから決まるベクトルを返すこと"""
+    embedder = FakeEmbedder(dimension=16)
+    embedder.register("質問", np.ones(16) / 4)
+
+    registered, unknown = embedder.embed(["質問", "未登録"])
+    assert registered == (np.ones(16, dtype=np.float32) / 4).tolist()
+    assert unknown == FakeEmbedder(dimension=16).embed(["未登録"])[0]
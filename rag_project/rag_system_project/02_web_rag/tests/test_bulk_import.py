@@ -0,0 +1,46 @@
+from unittest.mock import MagicMock
+from bulk_import import iter_batches, iter_directory, run_import
+
+def test_iter_batches_skips_checkpoint_and_counts_invalid():
+    """再開位置までを読み飛ばし、タイトル・本文の無いレコードを数えて除くこと"""
+    records = [{"title": f"t{i}", "content": "c"} for i in range(5)] + [None, {"title": "本文なし"},
+                                                                          {"title": "空白", "content": "  "}]
+    batches = list(iter_batches(iter(records), batch_size=2, skip=1))
+
+    assert [(position, [doc["title"] for doc in batch], invalid) for position, batch, invalid in batches] == [
+        (3, ["t1", "t2"], 0), (5, ["t3", "t4"], 0), (8, [], 3)]
+
+def test_iter_directory_uses_heading_as_title(tmp_path):
+    """Markdownの最初の見出しをタイトルにし、相対パスをメタデータに残すこと"""
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "a.md").write_text("# 見出し\n本文", encoding="utf-8")
+    (tmp_path / "b.txt").write_text("本文のみ", encoding="utf-8")
+    (tmp_path / "c.bin").write_bytes(b"\x00")
+
+    docs = list(iter_directory(str(tmp_path)))
+    assert [(doc["title"], doc["metadata"]["source"]) for doc in docs] == [("b", "b.txt"), ("見出し", "sub/a.md")]
+
+def test_run_import_loads_in_order_with_checkpoints():
+    """埋め込みを並行させても入力順にロードし、バッチごとに再開位置を記録すること"""
+    rag = MagicMock()
+    rag.db.get_import_checkpoint.return_value = {"position": 2, "imported": 2}
+    rag.prepare_documents.side_effect = lambda batch, batch_size: [dict(doc, embedding=[1.0]) for doc in batch]
+    rag.db.copy_documents.side_effect = lambda rows, checkpoint: list(range(len(rows)))
+    records = [{"title": f"t{i}", "content": "c"} for i in range(7)]
+
+    assert run_import(rag, iter(records), "corpus", batch_size=2, concurrency=2) is True
+
+    calls = rag.db.copy_documents.call_args_list
+    assert [[row["title"] for row in c[0][0]] for c in calls] == [["t2", "t3"], ["t4", "t5"], ["t6"]]
+    assert [c.kwargs["checkpoint"] for c in calls] == [("corpus", 4, 4), ("corpus", 6, 6), ("corpus", 7, 7)]
+
+def test_run_import_stops_when_load_fails():
+    """ロードに失敗したら以降のバッチを取り込まずに終了すること"""
+    rag = MagicMock()
+    rag.db.get_import_checkpoint.return_value = {"position": 0, "imported": 0}
+    rag.prepare_documents.side_effect = lambda batch, batch_size: batch
+    rag.db.copy_documents.return_value = []
+    records = [{"title": f"t{i}", "content": "c"} for i in range(6)]
+
+    assert run_import(rag, iter(records), "corpus", batch_size=2, concurrency=1) is False
+    assert rag.db.copy_documents.call_count == 1
@@ -0,0 +1,27 @@
+import pytest
+from chunking import split_sentences, chunk_text
+
+def test_split_sentences_on_japanese_punctuation():
+    """句点・感嘆符・疑問符と閉じ括弧で文が区切られること"""
+    text = "今日は晴れ。「本当？」はい！\n次の行"
+    sentences = [text[start:end].strip() for start, end in split_sentences(text)]
+    assert sentences == ["今日は晴れ。", "「本当？」", "はい！", "次の行"]
+
+def test_chunk_text_respects_size_and_overlap():
+    """チャンクが上限文字数以内に収まり、末尾の文が次のチャンクに重なること"""
+    text = "".join(f"これは{i}番目の文です。" for i in range(10))
+    chunks = chunk_text(text, chunk_size=30, overlap=12)
+
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.startswith(previous[previous.rfind("これは"):])
+    assert chunks[-1].endswith("これは9番目の文です。")
+
+def test_chunk_text_splits_long_sentence():
+    """上限を超える1文は上限文字数ごとに重ねて切り分けられること"""
+    chunks = chunk_text("あ" * 25, chunk_size=10, overlap=2)
+    assert [len(chunk) for chunk in chunks] == [10, 10, 9]
+    assert chunk_text("", chunk_size=10, overlap=2) == []
+    with pytest.raises(ValueError):
+        chunk_text("あ", chunk_size=10, overlap=10)
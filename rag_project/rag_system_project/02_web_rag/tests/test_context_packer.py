@@ -0,0 +1,35 @@
+from context_packer import best_window, estimate_tokens, pack_context
+
+def test_estimate_tokens_counts_by_character_class():
+    """かな・漢字は1文字1トークン、英数字は4文字ごとに1トークン、記号は1トークンで数えること"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("日本語") == 3
+    assert estimate_tokens("hello world") == 4
+    assert estimate_tokens("API。") == 2
+
+def test_best_window_picks_sentences_matching_the_query():
+    """予算に収まらない本文から、質問と一致する文を含む範囲を「…」付きで返すこと"""
+    text = "今日は晴れです。明日は雨です。パスワードの再設定は設定画面から行います。週末は曇りです。"
+
+    window = best_window(text, "パスワードを再設定する方法", 24)
+    assert "パスワードの再設定は設定画面から行います。" in window
+    assert window.startswith("…") and window.endswith("…")
+    assert estimate_tokens(window) <= 24
+    assert best_window(text, "質問", 1000) == text
+
+def test_pack_context_trims_documents_to_fit_the_budget():
+    """類似度順に並べ、全文書を外さずに切り詰めて予算内に収め、使用量を返すこと"""
+    long_text = "関係のない前置きの文です。" * 20 + "料金プランの変更は毎月1日に反映されます。" + "関係のない後書きの文です。" * 20
+    docs = [
+        {"id": 1, "title": "短い", "content": "料金の問い合わせ窓口です。", "similarity": 0.5},
+        {"id": 2, "title": "長い", "content": long_text, "similarity": 0.9},
+    ]
+
+    packed = pack_context("料金プランの変更はいつ反映されますか", docs, token_budget=120, min_doc_tokens=20)
+    assert [item["doc"]["id"] for item in packed["documents"]] == [2, 1]
+    assert packed["documents"][0]["trimmed"] and not packed["documents"][1]["trimmed"]
+    assert "料金プランの変更は毎月1日に反映されます。" in packed["documents"][0]["text"]
+    assert packed["budget"] == 120
+    assert packed["used_tokens"] <= 120
+    assert packed["used_tokens"] == sum(item["tokens"] for item in packed["documents"])
+    assert "Document: 短い" in packed["context"]
@@ -1,5 +1,7 @@
+import json
 import pytest
 from unittest.mock import patch, MagicMock
+from config import Config
 from db_utils import DatabaseManager
 
 def test_database_connection():
@@ -50,3 +52,354 @@ def test_database_config():
     
     assert isinstance(Config.DB_PORT, int)
     assert Config.DB_PORT > 0
+
+def _fake_connection(*args, **kwargs):
+    """プールが生成するモック接続"""
+    import psycopg2.extensions
+
+    conn = MagicMock()
+    conn.closed = 0
+    conn.status = psycopg2.extensions.STATUS_READY
+    return conn
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_connection_pool_checkout_and_stats(mock_connect, mock_register):
+    """接続プールから借りた接続が返却され、統計に反映されること"""
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=2, max_size=2)
+        assert db_manager.ensure_connected()
+
+    assert db_manager.has_pgvector is False
+    with db_manager.get_connection() as first, db_manager.get_connection() as second:
+        assert first is not second
+        assert db_manager.pool_stats()['in_use'] == 2
+
+    stats = db_manager.pool_stats()
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 2
+    assert stats['checkouts'] == 2
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_connection_pool_discards_broken_connection(mock_connect, mock_register):
+    """切断された接続は返却時に破棄され、次回は新しい接続が使われること"""
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+
+    with db_manager.get_connection() as connection:
+        connection.closed = 2
+    assert db_manager.pool_stats()['discarded'] == 1
+
+    with db_manager.get_connection() as connection:
+        assert connection.closed == 0
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_connection_pool_timeout(mock_connect, mock_register):
+    """プールが枯渇した場合は待機後にPoolErrorになること"""
+    from psycopg2.pool import PoolError
+    from config import Config
+
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+
+    with patch.object(Config, 'DB_POOL_TIMEOUT', 0.01):
+        with db_manager.get_connection():
+            with pytest.raises(PoolError):
+                with db_manager.get_connection():
+                    pass
+    assert db_manager.pool_stats()['timeouts'] == 1
+    db_manager.disconnect()
+
+def test_vector_index_sql_matches_metric():
+    """ANNインデックスの演算子クラスと作成パラメータが設定に従うこと"""
+    from config import Config
+
+    db_manager = DatabaseManager()
+    with patch.object(Config, 'SIMILARITY_METRIC', 'inner_product'):
+        sql = db_manager._vector_index_sql('hnsw', 'idx_hnsw', True, 0)
+        assert 'CREATE INDEX CONCURRENTLY' in sql
+        assert 'USING hnsw (embedding vector_ip_ops)' in sql
+        assert f'm = {Config.HNSW_M}' in sql
+
+    with patch.object(Config, 'SIMILARITY_METRIC', 'l2'), patch.object(Config, 'IVFFLAT_LISTS', 0):
+        sql = db_manager._vector_index_sql('ivfflat', 'idx_ivf', False, 250_000)
+        assert 'CONCURRENTLY' not in sql
+        assert 'vector_l2_ops' in sql
+        assert 'lists = 250' in sql
+
+def test_cursor_roundtrip():
+    """カーソル文字列が (created_at, id) に復元できること"""
+    from datetime import datetime
+    from db_utils import encode_cursor, decode_cursor
+
+    created_at = datetime(2025, 5, 26, 12, 0, 0, 123456)
+    cursor = encode_cursor({"id": 42, "created_at": created_at})
+    assert decode_cursor(cursor) == (created_at, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_list_documents_keyset_and_projection(mock_connect, mock_register):
+    """一覧取得が埋め込みを読まず、カーソル以降だけをLIMIT+1件で問い合わせること"""
+    from datetime import datetime
+    from db_utils import encode_cursor
+
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+
+    rows = [(10 - i, datetime(2025, 1, 3 - i), f"文書{i}", "プレビュー") for i in range(3)]
+    with db_manager.get_connection() as connection:
+        db_cursor = connection.cursor.return_value
+        db_cursor.fetchall.return_value = rows
+
+    cursor = encode_cursor({"id": 11, "created_at": datetime(2025, 1, 4)})
+    page = db_manager.list_documents(limit=2, cursor=cursor, fields=["title", "preview"])
+
+    sql, params = db_cursor.execute.call_args[0]
+    assert "embedding" not in sql
+    assert "left(content, " in sql
+    assert "(created_at, id) < (%s, %s)" in sql
+    assert "ORDER BY created_at DESC, id DESC LIMIT %s" in sql
+    assert params[-1] == 3
+    assert [doc["id"] for doc in page["documents"]] == [10, 9]
+    assert page["has_more"] is True
+    assert page["next_cursor"] == encode_cursor(page["documents"][-1])
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_count_documents_uses_counter_and_local_cache(mock_connect, mock_register):
+    """文書数がカウンタ行から読まれ、TTL内は自プロセスの増減だけで更新されること"""
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+
+    with db_manager.get_connection() as connection:
+        db_cursor = connection.cursor.return_value
+        db_cursor.fetchone.side_effect = [(True,), (42,)]
+
+    assert db_manager.count_documents() == 42
+    executed = [c[0][0] for c in db_cursor.execute.call_args_list]
+    assert any("FROM document_stats" in sql for sql in executed)
+    assert not any("COUNT(*)" in sql for sql in executed)
+
+    db_cursor.execute.reset_mock()
+    db_manager._adjust_document_count(-1)
+    assert db_manager.count_documents() == 41
+    db_cursor.execute.assert_not_called()
+
+    db_cursor.fetchone.side_effect = [(-1,), (7,)]
+    assert db_manager.count_documents(mode="estimate") == 7
+    assert "COUNT(*)" in db_cursor.execute.call_args[0][0]
+    db_manager.disconnect()
+
+def test_encode_copy_binary_vector_and_jsonb():
+    """COPYバイナリ形式のヘッダ・pgvector・jsonbの符号化が仕様どおりであること"""
+    import struct
+    from db_utils import encode_copy_binary
+
+    data = encode_copy_binary([(7, [1.0, 0.5], {"a": 1}, None)], ["int4", "vector", "jsonb", "text"])
+
+    assert data.startswith(b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0))
+    assert data.endswith(struct.pack("!h", -1))
+    body = data[19:-2]
+    assert body[:2] == struct.pack("!h", 4)
+    assert body[2:10] == struct.pack("!ii", 4, 7)
+    assert body[10:26] == struct.pack("!iHHff", 12, 2, 0, 1.0, 0.5)
+    assert body[26:30] == struct.pack("!i", 9) and body[30:39] == b'\x01{"a": 1}'
+    assert body[39:] == struct.pack("!i", -1)
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_search_lexical_filters_with_indexable_terms(mock_connect, mock_register):
+    """3文字以上の語だけでインデックス用の絞り込み条件を作り、短い語は順位付けにだけ使うこと"""
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+    db_manager.has_trgm = True
+
+    with db_manager.get_connection() as connection:
+        db_cursor = connection.cursor.return_value
+        db_cursor.fetchall.return_value = [(5, 2, 0, "E1234 の設定", [1.0], "t", {}, None, 7)]
+
+    results = db_manager.search_lexical("設定でE1234", limit=3, table="document_chunks")
+    sql, params = db_cursor.execute.call_args[0]
+    condition = sql.split("WHERE")[1].split("ORDER BY")[0]
+    assert "%(term1)s" in condition and "%(term0)s" not in condition
+    assert params["term0"] == "%設定%" and params["limit"] == 3
+    assert results[0]["chunk_id"] == 5 and results[0]["id"] == 2 and results[0]["lexical_score"] == 7
+
+    db_cursor.execute.reset_mock()
+    assert db_manager.search_lexical("設定", table="document_chunks") == []
+    db_cursor.execute.assert_not_called()
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_search_chunks_with_filters_uses_iterative_scan(mock_connect, mock_register):
+    """絞り込み付きのチャンク検索が結合後に条件を適用し、反復スキャンを有効にすること"""
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+    db_manager.has_pgvector = True
+    db_manager.pgvector_version = (0, 8, 0)
+    mock_register.side_effect = None
+
+    with db_manager.get_connection() as connection:
+        db_cursor = connection.cursor.return_value
+        db_cursor.fetchall.return_value = []
+
+    with patch.object(Config, 'ANN_INDEX_TYPE', 'hnsw'):
+        db_manager.search_chunks([1.0, 0.0], limit=3, filters={"metadata": {"product": "A"}, "title": "手順"})
+    executed = [c[0] for c in db_cursor.execute.call_args_list]
+    assert ("SET LOCAL hnsw.iterative_scan = relaxed_order",) in executed
+    sql, params = executed[-1]
+    assert "d.metadata @> %(filter_metadata)s::jsonb" in sql and "d.title ILIKE %(filter_title)s" in sql
+    assert json.loads(params["filter_metadata"]) == {"product": "A"}
+    assert params["filter_title"] == "%手順%"
+
+    # 反復スキャンの無い版では、件数が足りなければ ANN インデックスを使わずに検索し直す
+    db_manager.pgvector_version = (0, 7, 4)
+    db_cursor.execute.reset_mock()
+    with patch.object(Config, 'ANN_INDEX_TYPE', 'hnsw'):
+        db_manager.search_chunks([1.0, 0.0], limit=3, filters={"title": "手順"})
+    executed = [c[0][0] for c in db_cursor.execute.call_args_list]
+    assert "SET LOCAL enable_indexscan = off" in executed
+    assert not any("iterative_scan" in sql for sql in executed)
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_run_migrations_serializes_with_advisory_lock(mock_connect, mock_register):
+    """移行は advisory lock の中で実行し、ロック待ちの間に他のプロセスが適用した移行は飛ばすこと"""
+    from db_utils import MIGRATION_LOCK_ID
+
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+    with db_manager.get_connection() as connection:
+        db_cursor = connection.cursor.return_value
+    db_cursor.fetchone.return_value = (True,)
+    # ロック前はどちらも未適用、ロック後は first が適用済み
+    db_cursor.fetchall.side_effect = [[], [("first",)]]
+    first, second = MagicMock(), MagicMock()
+
+    with patch.object(db_manager, '_migrations', return_value=[("first", first), ("second", second)]):
+        assert db_manager.run_migrations()
+
+    first.assert_not_called()
+    second.assert_called_once()
+    executed = [c[0] for c in db_cursor.execute.call_args_list]
+    lock = executed.index(("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,)))
+    unlock = executed.index(("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,)))
+    assert lock < executed.index(("INSERT INTO schema_migrations (name) VALUES (%s) ON CONFLICT DO NOTHING",
+                                  ("second",))) < unlock
+
+    # すべて適用済みならロックを取らない
+    db_cursor.execute.reset_mock()
+    db_cursor.fetchall.side_effect = [[("first",), ("second",)]]
+    with patch.object(db_manager, '_migrations', return_value=[("first", first), ("second", second)]):
+        assert db_manager.run_migrations()
+    assert not any("advisory" in c[0][0] for c in db_cursor.execute.call_args_list)
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_lexical_indexes_rebuild_invalid_and_skip_large_tables(mock_connect, mock_register):
+    """無効なトライグラムインデックスは作り直し、大きなテーブルでは起動時の移行でインデックスを作らないこと"""
+    from db_utils import MIGRATION_LOCK_ID
+
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+    with db_manager.get_connection() as connection:
+        db_cursor = connection.cursor.return_value
+    (valid, _, _), (invalid, invalid_table, _), (missing, _, _) = DatabaseManager._lexical_indexes()
+    # 1つ目は有効、2つ目は中断された CONCURRENTLY の残り、3つ目は未作成
+    db_cursor.fetchone.side_effect = [(True,), (False,), None]
+    db_cursor.execute.reset_mock()
+
+    assert db_manager.create_lexical_indexes()
+    executed = [c[0][0] for c in db_cursor.execute.call_args_list]
+    assert executed[0] == "SELECT pg_advisory_lock(%s)" and executed[-1] == "SELECT pg_advisory_unlock(%s)"
+    assert db_cursor.execute.call_args_list[0][0][1] == (MIGRATION_LOCK_ID,)
+    created = [sql for sql in executed if sql.startswith("CREATE INDEX")]
+    assert f"DROP INDEX CONCURRENTLY IF EXISTS {invalid}" in executed
+    assert [sql.split()[6] for sql in created] == [invalid, missing]
+    assert not any(valid in sql for sql in created)
+
+    # 推定行数が上限を超える場合は拡張だけを作成する
+    db_cursor.execute.reset_mock()
+    db_cursor.fetchone.side_effect = [(1_000_000,)]
+    with patch.object(Config, 'LEXICAL_INDEX_AUTO_MAX_ROWS', 50000):
+        db_manager._migrate_create_lexical_indexes(connection)
+    executed = [c[0][0] for c in db_cursor.execute.call_args_list]
+    assert "CREATE EXTENSION IF NOT EXISTS pg_trgm" in executed
+    assert not any(sql.startswith(("CREATE INDEX", "DROP INDEX")) for sql in executed)
+    assert db_manager.has_trgm
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_metadata_filter_compares_scalar_values_as_strings(mock_connect, mock_register):
+    """metadata の値は以前の metadata->>key = str(value) と同じく文字列として比べ、"2023" が数値の 2023 にも一致すること"""
+    from db_utils import metadata_containment
+
+    exact, alternatives = metadata_containment({"product": "A", "year": "2023", "reviewed": True, "tags": ["x"]})
+    assert json.loads(exact) == {"product": "A", "tags": ["x"]}
+    assert [[json.loads(c) for c in candidates] for candidates in alternatives] == [
+        [{"year": "2023"}, {"year": 2023}], [{"reviewed": "true"}, {"reviewed": True}]]
+    # 数値の値は文字列で保存された "2023" にも一致する
+    assert [json.loads(c) for c in metadata_containment({"year": 2023})[1][0]] == [{"year": "2023"}, {"year": 2023}]
+
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=1)
+        db_manager.connect()
+    with db_manager.get_connection() as connection:
+        db_cursor = connection.cursor.return_value
+        db_cursor.fetchall.return_value = []
+
+    db_manager.search_documents(metadata_filter={"product": "A", "year": "2023"})
+    sql, params = db_cursor.execute.call_args[0]
+    assert "metadata @> %s::jsonb AND (metadata @> %s::jsonb OR metadata @> %s::jsonb)" in sql
+    assert [json.loads(p) for p in params[:3]] == [{"product": "A"}, {"year": "2023"}, {"year": 2023}]
+
+    conditions, params = db_manager.filter_conditions({"metadata": {"year": "2023"}}, alias="d")
+    assert conditions == ["(d.metadata @> %(filter_metadata_0_0)s::jsonb OR d.metadata @> %(filter_metadata_0_1)s::jsonb)"]
+    assert json.loads(params["filter_metadata_0_1"]) == {"year": 2023}
+    db_manager.disconnect()
+
+@patch('pgvector.psycopg2.register_vector', side_effect=Exception("no vector type"))
+@patch('psycopg2.connect', side_effect=_fake_connection)
+def test_pool_size_gauge_adds_up_across_pools(mock_connect, mock_register):
+    """プールの上限のゲージは、同じプロセスの他のプールの分を上書きせずに増減すること"""
+    import metrics
+
+    def pool_max():
+        body = metrics.render()[0].decode()
+        return float(next(line.split()[1] for line in body.splitlines()
+                          if line.startswith("rag_db_pool_connections_max ")))
+
+    before = pool_max()
+    # 非同期版のプールなど、別のプールが先に加算している
+    metrics.DB_CONNECTIONS_MAX.inc(5)
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager = DatabaseManager(min_size=1, max_size=3)
+        db_manager.connect()
+    assert pool_max() == before + 8
+
+    db_manager.disconnect()
+    # 再接続しても他のプールの分は残る
+    with patch.object(DatabaseManager, 'run_migrations'):
+        db_manager.connect()
+    db_manager.disconnect()
+    assert pool_max() == before + 5
+    metrics.DB_CONNECTIONS_MAX.dec(5)
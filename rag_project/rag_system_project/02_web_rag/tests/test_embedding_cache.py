@@ -0,0 +1,41 @@
+import pytest
+from unittest.mock import MagicMock
+from embedding_cache import EmbeddingCache, text_hash
+
+def test_text_hash_normalizes_whitespace_and_width():
+    """空白や全角・半角の違いは同じキーになること"""
+    assert text_hash("  ＲＡＧ　とは？ ") == text_hash("RAG とは?")
+    assert text_hash("RAG") != text_hash("RAG とは")
+
+def test_memory_cache_hit_and_lru_eviction():
+    """1段目がヒットし、上限を超えると古いものから追い出されること"""
+    cache = EmbeddingCache(db=None, model="m", max_size=2, persist=False)
+    cache.put("a", [1.0, 0.0], "retrieval_query")
+    cache.put("b", [0.0, 1.0], "retrieval_query")
+    assert cache.get("a", "retrieval_query") == [1.0, 0.0]
+    cache.put("c", [1.0, 1.0], "retrieval_query")
+
+    assert cache.get("b", "retrieval_query") is None
+    assert cache.get("a", "retrieval_query") is not None
+    # task_type が異なれば別のキーになる
+    assert cache.get("a", "retrieval_document") is None
+
+    stats = cache.stats()
+    assert stats["memory_hits"] == 2
+    assert stats["misses"] == 2
+    assert stats["size"] == 2
+
+def test_db_cache_fills_memory_cache():
+    """2段目のヒットが1段目に取り込まれること"""
+    db = MagicMock()
+    db.get_cached_embeddings.return_value = {text_hash("q"): [0.5, 0.5]}
+    cache = EmbeddingCache(db=db, model="m", max_size=10, persist=True)
+
+    assert cache.get_many(["q", "other"], "retrieval_query") == [[0.5, 0.5], None]
+    assert cache.get("q", "retrieval_query") == [0.5, 0.5]
+    assert db.get_cached_embeddings.call_count == 1
+
+    stats = cache.stats()
+    assert stats["db_hits"] == 1
+    assert stats["memory_hits"] == 1
+    assert stats["hit_rate"] == pytest.approx(2 / 3)
@@ -0,0 +1,106 @@
+import pytest
+from unittest.mock import MagicMock
+from ingest_worker import process_job
+
+def _job(attempts=1, results=None):
+    documents = [{"title": f"文書{i}", "content": "内容"} for i in range(3)]
+    return {"id": 7, "payload": documents, "results": results or [None] * 3,
+            "attempts": attempts, "max_attempts": 3}
+
+def test_process_job_retries_only_failed_documents():
+    """失敗した文書だけを残してジョブを再試行待ちに戻し、次の試行では追加済みを飛ばすこと"""
+    rag = MagicMock()
+    rag.add_documents.return_value = [
+        {"success": True, "document_id": 1},
+        {"success": False, "error": "quota"},
+        {"success": True, "document_id": 3},
+    ]
+
+    assert process_job(rag, _job(), batch_size=10) == "queued"
+    results, = rag.db.update_ingest_job.call_args[0][1:]
+    assert rag.db.update_ingest_job.call_args.kwargs["status"] == "queued"
+    assert rag.db.update_ingest_job.call_args.kwargs["retry_delay"] > 0
+
+    rag.add_documents.reset_mock()
+    rag.add_documents.return_value = [{"success": True, "document_id": 2}]
+    assert process_job(rag, _job(attempts=2, results=results), batch_size=10) == "succeeded"
+    assert [doc["title"] for doc in rag.add_documents.call_args[0][0]] == ["文書1"]
+
+def test_process_job_fails_after_max_attempts():
+    """最大試行回数に達したジョブは failed になること"""
+    rag = MagicMock()
+    rag.add_documents.side_effect = RuntimeError("DB down")
+
+    assert process_job(rag, _job(attempts=3), batch_size=2) == "failed"
+    assert rag.add_documents.call_count == 2
+    assert rag.db.update_ingest_job.call_args.kwargs["last_error"] == "DB down"
+
+def test_backfill_step_chunks_one_batch_until_done():
+    """ジョブの無い間は未分割の文書を1バッチずつチャンク化し、残りが無くなったときだけ完了とすること"""
+    from ingest_worker import backfill_step
+
+    rag = MagicMock()
+    rag.backfill_chunks.return_value = 4
+    assert backfill_step(rag, batch_size=4) == "more"
+    rag.backfill_chunks.assert_called_once_with(batch_size=4, limit=4)
+
+    # 1バッチに満たなくても、文書を処理した間は続ける
+    rag.backfill_chunks.return_value = 1
+    assert backfill_step(rag, batch_size=4) == "more"
+    rag.backfill_chunks.return_value = 0
+    assert backfill_step(rag, batch_size=4) == "done"
+    rag.backfill_chunks.side_effect = RuntimeError("quota")
+    assert backfill_step(rag, batch_size=4) == "error"
+
+def test_backfill_chunks_skips_failed_document_and_continues():
+    """埋め込みや保存に失敗した文書は記録して飛ばし、後ろの文書はチャンク化されること"""
+    from rag_system import RAGSystem
+
+    rag = RAGSystem(google_api_key="test-key")
+    rag.db = MagicMock()
+    documents = [{"id": 1, "title": "t", "content": "壊れた本文です。"},
+                 {"id": 2, "title": "t", "content": "   "},
+                 {"id": 3, "title": "t", "content": "保存できない本文です。"},
+                 {"id": 4, "title": "t", "content": "正常な本文です。"}]
+    failed = set()
+    rag.db.get_documents_without_chunks.side_effect = lambda limit: [
+        doc for doc in documents if doc["id"] not in failed and doc["id"] not in chunked][:limit]
+    rag.db.record_chunk_backfill_failure.side_effect = lambda doc_id, error, retry=True: failed.add(doc_id) or True
+    chunked = set()
+    rag.db.insert_chunks.side_effect = lambda doc_id, chunks: [] if doc_id == 3 else chunked.add(doc_id) or [10]
+
+    def embed(texts, task_type=None):
+        if any("壊れた" in text for text in texts):
+            raise RuntimeError("invalid input")
+        return [[1.0] + [0.0] * 767 for _ in texts]
+    rag.generate_embeddings = embed
+
+    assert rag.backfill_chunks(batch_size=4) == 4
+    assert chunked == {4} and failed == {1, 2, 3}
+    retries = {c.args[0]: c.kwargs["retry"] for c in rag.db.record_chunk_backfill_failure.call_args_list}
+    # 本文が空の文書は再試行しない
+    assert retries == {1: True, 2: False, 3: True}
+    # 全件を処理した後は、取得結果が空になって初めて 0 を返す
+    assert rag.backfill_chunks(batch_size=4) == 0
+
+    # 失敗を記録できない場合は同じ文書を取り直し続けないよう中断する
+    failed.clear()
+    chunked.clear()
+    rag.db.record_chunk_backfill_failure.side_effect = None
+    rag.db.record_chunk_backfill_failure.return_value = False
+    with pytest.raises(RuntimeError):
+        rag.backfill_chunks(batch_size=4)
+
+def test_backfill_chunks_stops_at_limit():
+    """limit 件を処理した時点で戻り、それ以上の文書を読まないこと"""
+    from rag_system import RAGSystem
+
+    rag = RAGSystem(google_api_key="test-key")
+    rag.db = MagicMock()
+    rag.db.get_documents_without_chunks.side_effect = lambda limit: [
+        {"id": i, "title": "t", "content": "本文です。"} for i in range(limit)]
+    rag.db.insert_chunks.return_value = [1]
+    rag.generate_embeddings = lambda texts, task_type=None: [[1.0] + [0.0] * 767 for _ in texts]
+
+    assert rag.backfill_chunks(batch_size=2, limit=3) == 3
+    assert [c.kwargs["limit"] for c in rag.db.get_documents_without_chunks.call_args_list] == [2, 1]
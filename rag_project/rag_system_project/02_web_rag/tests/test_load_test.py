@@ -0,0 +1,34 @@
+import os
+import sys
+from unittest.mock import patch
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from load_test import LoadGenerator, parse_mix
+from corpus import SyntheticCorpus
+
+def test_parse_mix_rejects_unknown_endpoints():
+    """エンドポイント名と割合を読み、未対応の名前・割合の合計が0の指定はエラーにすること"""
+    assert parse_mix("query=3, documents_get=1") == {"query": 3.0, "documents_get": 1.0}
+    with pytest.raises(ValueError):
+        parse_mix("query=1,search=1")
+    with pytest.raises(ValueError):
+        parse_mix("query=0")
+
+def test_run_reports_latency_and_error_rate_per_endpoint():
+    """エンドポイントごとに件数・エラー率・パーセンタイルを集計し、2xx 以外をエラーに数えること"""
+    generator = LoadGenerator("http://localhost:1", {"query": 1, "documents_get": 1},
+                              SyntheticCorpus(dimension=8, clusters=2), timeout=1)
+    statuses = {"query": 200, "documents_get": 500}
+
+    with patch.object(LoadGenerator, "request", side_effect=lambda endpoint: statuses[endpoint]), \
+            patch("load_test.scrape_pool_metrics", return_value={}):
+        outcome = generator.run(concurrency=2, duration=0.2, warmup=0)
+
+    endpoints = outcome["endpoints"]
+    assert endpoints["query"]["requests"] > 0 and endpoints["query"]["error_rate"] == 0
+    assert endpoints["documents_get"]["error_rate"] == 1.0
+    assert endpoints["documents_get"]["statuses"] == {"500": endpoints["documents_get"]["requests"]}
+    assert endpoints["total"]["requests"] == endpoints["query"]["requests"] + endpoints["documents_get"]["requests"]
+    assert {"p50_ms", "p95_ms", "p99_ms"} <= set(endpoints["query"])
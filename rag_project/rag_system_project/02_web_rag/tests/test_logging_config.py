@@ -0,0 +1,43 @@
+import io
+import json
+import logging
+import sys
+import logging_config
+from logging_config import JsonFormatter, setup_logging, shutdown_logging
+
+def test_json_formatter_includes_extra_fields_and_exception():
+    """extra のフィールドと例外のトレースバックを1行の JSON に含めること"""
+    logger = logging.getLogger("test.json")
+    try:
+        raise ValueError("壊れた入力")
+    except ValueError:
+        record = logger.makeRecord("test.json", logging.ERROR, __file__, 1, "ジョブ %s が失敗しました", (7,),
+                                   exc_info=sys.exc_info(), extra={"job_id": 7})
+
+    line = JsonFormatter().format(record)
+    entry = json.loads(line)
+    assert "\n" not in line
+    assert entry["level"] == "ERROR"
+    assert entry["message"] == "ジョブ 7 が失敗しました"
+    assert entry["job_id"] == 7
+    assert "ValueError: 壊れた入力" in entry["exception"]
+
+def test_setup_logging_writes_through_the_queue_listener():
+    """ログはキュー経由で出力され、設定したレベル未満（DEBUG）は出力されないこと"""
+    shutdown_logging()
+    stream = io.StringIO()
+    previous_level = logging.getLogger().level
+    setup_logging(level="INFO", fmt="json", stream=stream)
+    try:
+        logger = logging.getLogger("test.queue")
+        logger.debug("出力されない")
+        logger.info("文書を %d 件追加しました", 3, extra={"route": "/api/documents"})
+    finally:
+        # リスナーを止めるとキューに残ったログが書き出される
+        shutdown_logging()
+        logging.getLogger().setLevel(previous_level)
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry["message"] for entry in lines] == ["文書を 3 件追加しました"]
+    assert lines[0]["route"] == "/api/documents"
+    assert logging_config._handler not in logging.getLogger().handlers
@@ -0,0 +1,49 @@
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _sample(body: str, name: str, labels: str = "") -> float:
+    """Prometheus のテキスト形式から1系列の値を読み出します（無ければ 0）"""
+    prefix = f"{name}{{{labels}}} " if labels else f"{name} "
+    for line in body.splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+def test_metrics_endpoint_counts_requests_per_route():
+    """/metrics がルートの定義ごとのリクエスト数と処理時間を返すこと"""
+    import web_app
+
+    with patch.object(web_app.Config, 'GOOGLE_API_KEY', 'test-key'), patch('rag_system.RAGSystem') as rag_class:
+        rag_class.return_value.db.get_ingest_job.return_value = None
+        client = web_app.create_app().test_client()
+        before = _sample(client.get('/metrics').get_data(as_text=True), 'rag_http_requests_total',
+                         'method="GET",route="/api/jobs/<int:job_id>",status="404"')
+        client.get('/api/jobs/1')
+        client.get('/api/jobs/2')
+        response = client.get('/metrics')
+
+    body = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert _sample(body, 'rag_http_requests_total',
+                   'method="GET",route="/api/jobs/<int:job_id>",status="404"') == before + 2
+    assert 'rag_http_request_duration_seconds_bucket{le="0.005",method="GET",route="/api/jobs/<int:job_id>"}' in body
+
+def test_metrics_are_aggregated_across_worker_processes(tmp_path):
+    """PROMETHEUS_MULTIPROC_DIR を共有する別プロセス（gunicorn のワーカー相当）の値を合計して返すこと"""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path), PYTHONPATH=PROJECT_DIR)
+    record = ("import metrics; metrics.EMBEDDING_FALLBACKS.inc(); "
+              "metrics.STAGE_LATENCY.labels('generation').observe(0.3)")
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", record], env=env, check=True)
+    render = "import json, metrics; print(json.dumps(metrics.render()[0].decode()))"
+    output = subprocess.run([sys.executable, "-c", render], env=env, check=True, capture_output=True, text=True)
+
+    body = json.loads(output.stdout)
+    assert _sample(body, 'rag_embedding_fallbacks_total') == 2
+    assert _sample(body, 'rag_stage_duration_seconds_count', 'stage="generation"') == 2
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from providers import LocalEmbeddingProvider, StubGenerationProvider, create_embedding_provider
+
+def test_local_embedder_ranks_overlapping_text_higher():
+    """単位長の固定次元ベクトルを返し、表記の重なる文書ほど質問との内積が大きくなること"""
+    embedder = LocalEmbeddingProvider(dimension=768)
+    question, related, unrelated = embedder.embed(
+        ["パスワードの再設定方法", "パスワードを再設定するには設定画面を開きます", "請求書は毎月1日に発行されます"])
+
+    assert len(question) == 768
+    assert np.linalg.norm(question) == pytest.approx(1.0, abs=1e-5)
+    assert np.dot(question, related) > np.dot(question, unrelated)
+    # 全角・半角や空白の違いは同じテキストとして扱う
+    assert embedder.embed(["ＡＢＣ  テスト"]) == embedder.embed(["abc テスト"])
+    assert not any(embedder.embed([""])[0])
+
+def test_stub_generator_is_deterministic_and_streams_the_same_answer():
+    """同じプロンプトには同じ回答を返し、ストリーミングの断片をつなぐと同じ回答になること"""
+    generator = StubGenerationProvider(chunk_size=4)
+
+    answer = generator.generate("プロンプト")
+    assert answer == StubGenerationProvider().generate("プロンプト")
+    assert answer != generator.generate("別のプロンプト")
+    assert "".join(generator.generate_stream("プロンプト")) == answer
+
+def test_rag_system_runs_without_api_key_on_local_providers():
+    """local / stub の提供元なら API キーなしで初期化でき、埋め込みキャッシュを使わないこと"""
+    from unittest.mock import MagicMock, patch
+    from rag_system import RAGSystem
+
+    with patch("rag_system.Config.GOOGLE_API_KEY", None):
+        rag = RAGSystem(embedding_provider=create_embedding_provider("local"),
+                        generation_provider=StubGenerationProvider())
+    rag.embedding_cache = MagicMock()
+
+    vector = rag.generate_embedding("質問")
+    assert vector == rag.generate_embeddings(["質問"])[0]
+    rag.embedding_cache.get.assert_not_called()
+    with pytest.raises(ValueError):
+        create_embedding_provider("unknown")
+
+def test_provider_without_required_method_fails_on_creation():
+    """embed / generate を実装していない提供元は、最初の呼び出しではなく作成時にエラーになること"""
+    from providers import EmbeddingProvider, GenerationProvider
+
+    class NoEmbed(EmbeddingProvider):
+        model = "incomplete"
+
+    class NoGenerate(GenerationProvider):
+        def generate_stream(self, prompt):
+            yield "断片"
+
+    with pytest.raises(TypeError):
+        NoEmbed()
+    with pytest.raises(TypeError):
+        NoGenerate()
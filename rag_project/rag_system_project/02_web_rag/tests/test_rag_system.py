@@ -0,0 +1,359 @@
+import pytest
+import numpy as np
+
+def test_normalize_embedding():
+    """正規化で単位長になり、ゼロベクトルはそのまま返ること"""
+    from db_utils import normalize_embedding
+
+    assert np.linalg.norm(normalize_embedding([3.0, 4.0])) == pytest.approx(1.0)
+    assert normalize_embedding([0.0, 0.0]).tolist() == [0.0, 0.0]
+
+def _make_rag():
+    """DB接続をモックに差し替えたRAGSystemを作成"""
+    from unittest.mock import MagicMock
+    from rag_system import RAGSystem
+
+    rag = RAGSystem(google_api_key="test-key")
+    rag.db = MagicMock()
+    rag.db.has_pgvector = False
+    rag.db.has_trgm = False
+    return rag
+
+def test_add_documents_batches_embeddings_and_inserts():
+    """一括追加がバッチごとに埋め込み1回・INSERT1回で処理されること"""
+    from unittest.mock import patch
+
+    rag = _make_rag()
+    rag.db.insert_documents.side_effect = lambda rows: list(range(100, 100 + len(rows)))
+    documents = [{"title": f"文書{i}", "content": f"内容{i}"} for i in range(5)]
+    documents.append({"title": "本文なし", "content": ""})
+
+    with patch.object(rag, "generate_embeddings", side_effect=lambda texts, task_type=None: [[0.1] * 768 for _ in texts]) as embed:
+        results = rag.add_documents(documents, batch_size=2)
+
+    assert embed.call_count == 3
+    assert rag.db.insert_documents.call_count == 3
+    assert [r["success"] for r in results] == [True] * 5 + [False]
+    assert results[5]["error"]
+
+def test_add_documents_reports_embedding_failure():
+    """埋め込み生成に失敗したバッチは挿入せずエラーを返すこと"""
+    from unittest.mock import patch
+
+    rag = _make_rag()
+    with patch.object(rag, "generate_embeddings", side_effect=RuntimeError("quota")):
+        results = rag.add_documents([{"title": "a", "content": "b"}])
+
+    rag.db.insert_documents.assert_not_called()
+    assert results[0]["success"] is False
+    assert "quota" in results[0]["error"]
+
+def test_fallback_index_delta_sync(tmp_path):
+    """他ワーカーでの追加・削除がIDの差分だけでインデックスに反映されること"""
+    from unittest.mock import patch
+    from config import Config
+
+    vectors = {i: np.eye(768, dtype=np.float32)[i] for i in range(1, 5)}
+    with patch.object(Config, 'IVF_INDEX_PATH', str(tmp_path / "ivf.npz")):
+        rag = _make_rag()
+        rag.db.get_corpus_signature.return_value = (3, 3)
+        rag.db.get_all_embeddings.return_value = ([1, 2, 3], [vectors[1], vectors[2], vectors[3]])
+        rag._sync_vector_index()
+        assert sorted(rag.vector_index.ids()) == [1, 2, 3]
+
+        rag.db.get_corpus_signature.return_value = (3, 4)
+        rag.db.get_document_ids.return_value = [1, 3, 4]
+        rag.db.get_embeddings_by_ids.return_value = ([4], [vectors[4]])
+        rag._sync_vector_index(force=False)
+        # 同期間隔内なので確認しない
+        assert sorted(rag.vector_index.ids()) == [1, 2, 3]
+
+        rag._index_checked_at -= Config.VECTOR_INDEX_SYNC_INTERVAL
+        rag._sync_vector_index()
+        assert sorted(rag.vector_index.ids()) == [1, 3, 4]
+        rag.db.get_embeddings_by_ids.assert_called_once_with([4], table=rag.retrieval_table)
+        assert rag.db.get_all_embeddings.call_count == 1
+
+def test_ivf_retrain_runs_off_the_request_thread(tmp_path):
+    """再学習は検索スレッドを止めずに別スレッドで行い、学習中の追加を反映して差し替えること"""
+    import threading
+    from unittest.mock import patch
+    from config import Config
+    from vector_index import IVFIndex
+
+    vectors = {i: np.eye(768, dtype=np.float32)[i] for i in range(1, 7)}
+    release = threading.Event()
+
+    class SlowIVFIndex(IVFIndex):
+        def build(self, *args, **kwargs):
+            release.wait(5)
+            super().build(*args, **kwargs)
+
+    with patch.object(Config, 'IVF_INDEX_PATH', str(tmp_path / "ivf.npz")), \
+            patch.object(Config, 'FALLBACK_INDEX_TYPE', 'ivf'), patch.object(Config, 'IVF_MIN_TRAIN_SIZE', 4), \
+            patch.object(Config, 'IVF_NLISTS', 2):
+        rag = _make_rag()
+        rag.db.get_corpus_signature.return_value = (3, 3)
+        rag.db.get_all_embeddings.return_value = ([1, 2, 3], [vectors[1], vectors[2], vectors[3]])
+        rag._sync_vector_index()
+        first_index = rag.vector_index
+
+        rag.db.get_corpus_signature.return_value = (5, 5)
+        rag.db.get_document_ids.return_value = [1, 2, 3, 4, 5]
+        rag.db.get_embeddings_by_ids.return_value = ([4, 5], [vectors[4], vectors[5]])
+        rag._index_checked_at -= Config.VECTOR_INDEX_SYNC_INTERVAL
+        with patch.object(rag, "_create_fallback_index", return_value=SlowIVFIndex(768, 2)):
+            rag._sync_vector_index()
+            # 再学習を待たずに戻り、学習中も元のインデックスで追加・検索できる
+            assert rag.vector_index is first_index and rag._retrain_thread.is_alive()
+            rag._add_to_vector_index(6, vectors[6])
+            release.set()
+            rag._retrain_thread.join(5)
+
+    assert isinstance(rag.vector_index, SlowIVFIndex) and rag.vector_index.centroids is not None
+    assert sorted(rag.vector_index.ids()) == [1, 2, 3, 4, 5, 6]
+
+def test_sync_skips_while_another_thread_is_syncing():
+    """他のスレッドが同期中なら、構築済みのインデックスで待たずに検索を続けること"""
+    from config import Config
+
+    rag = _make_rag()
+    rag._index_signature = (1, 1)
+    rag._index_checked_at -= Config.VECTOR_INDEX_SYNC_INTERVAL + 1
+    with rag._index_sync_lock:
+        rag._sync_vector_index()
+    rag.db.get_corpus_signature.assert_not_called()
+
+def test_add_documents_stores_chunks_and_indexes_them():
+    """チャンク分割時はチャンクをまとめて埋め込み、文書と同じINSERTで保存してチャンクIDで索引すること"""
+    from unittest.mock import patch
+    from config import Config
+
+    rag = _make_rag()
+    rag._index_signature = (0, 0)
+
+    def insert_documents(rows):
+        rows[0]["chunk_ids"] = [11, 12]
+        return [1]
+
+    rag.db.insert_documents.side_effect = insert_documents
+    calls = []
+
+    def embed(texts, task_type=None):
+        calls.append((list(texts), task_type))
+        return [[1.0] + [0.0] * 767 for _ in texts]
+
+    with patch.object(Config, 'CHUNKING_ENABLED', True), patch.object(Config, 'CHUNK_SIZE', 10), \
+            patch.object(Config, 'CHUNK_OVERLAP', 0), patch.object(rag, "generate_embeddings", side_effect=embed):
+        results = rag.add_documents([{"title": "t", "content": "一文目です。二文目です。"}])
+
+    assert results[0]["success"] is True
+    assert calls == [(["一文目です。", "二文目です。"], "retrieval_document")]
+    row = rag.db.insert_documents.call_args[0][0][0]
+    assert [content for content, _ in row["chunks"]] == ["一文目です。", "二文目です。"]
+    assert np.linalg.norm(row["embedding"]) == pytest.approx(1.0)
+    assert sorted(rag.vector_index.ids()) == [11, 12]
+
+def test_document_embeddings_use_document_task_type_without_chunking():
+    """チャンク分割の有無によらず、文書側の埋め込みは retrieval_document で生成すること"""
+    from unittest.mock import patch
+    from config import Config
+
+    rag = _make_rag()
+    rag.db.insert_documents.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    rag.db.insert_document.return_value = 5
+    task_types = []
+
+    def embed(texts, task_type=None):
+        task_types.append(task_type)
+        return [[1.0] + [0.0] * 767 for _ in texts]
+
+    with patch.object(Config, 'CHUNKING_ENABLED', False), patch.object(rag, "generate_embeddings", side_effect=embed), \
+            patch.object(rag, "generate_embedding", side_effect=lambda text, task_type=None: embed([text], task_type)[0]):
+        assert rag.add_documents([{"title": "t", "content": "本文です。"}])[0]["success"] is True
+        assert rag.add_document("t", "本文です。") == 5
+
+    assert task_types == ["retrieval_document", "retrieval_document"]
+
+def test_blank_content_does_not_fail_its_batch():
+    """空白だけの本文は文書ごとのエラーにし、同じバッチの他の文書は追加されること（チャンク化できない本文は1チャンク）"""
+    from unittest.mock import patch
+    from config import Config
+
+    rag = _make_rag()
+    rag.db.insert_documents.side_effect = lambda rows: list(range(1, len(rows) + 1))
+    embed = lambda texts, task_type=None: [[1.0] + [0.0] * 767 for _ in texts]
+
+    with patch.object(Config, 'CHUNKING_ENABLED', True), patch.object(rag, "generate_embeddings", side_effect=embed):
+        results = rag.add_documents([{"title": "t", "content": "本文です。"}, {"title": "t", "content": " \n "}])
+        rows = rag._embed_chunked([{"title": "t", "content": "   "}], batch_size=10)
+
+    assert [result["success"] for result in results] == [True, False]
+    assert len(rag.db.insert_documents.call_args[0][0]) == 1
+    assert len(rows[0]["chunks"]) == 1 and len(rows[0]["embedding"]) == 768
+
+def test_answer_question_stream_sends_sources_then_tokens():
+    """ストリーミング回答が出典→テキスト断片→完了の順に返ること"""
+    from unittest.mock import MagicMock, patch
+
+    rag = _make_rag()
+    docs = [{"id": 1, "title": "t", "content": "本文", "similarity": 0.9, "chunk_index": 0}]
+    rag.generator = MagicMock()
+    rag.generator.generate_stream.return_value = iter(["回答", "です"])
+
+    with patch.object(rag, "search_similar_documents", return_value=docs), \
+            patch.object(rag, "generate_embedding", return_value=[1.0] + [0.0] * 767):
+        events = list(rag.answer_question_stream("質問"))
+
+    assert [event for event, _ in events] == ["sources", "token", "token", "done"]
+    assert events[0][1][0]["chunk_index"] == 0
+    assert events[-1][1] == "回答です"
+    rag.generator.generate_stream.assert_called_once()
+
+def test_query_reuses_answer_for_similar_question_until_corpus_changes():
+    """言い回しの違う質問でも埋め込みが近ければ生成を省略し、コーパスが変わると生成し直すこと"""
+    from unittest.mock import MagicMock, patch
+
+    rag = _make_rag()
+    rag.generator = MagicMock()
+    rag.generator.generate.return_value = "回答"
+    rag.db.get_corpus_version.return_value = 1
+    docs = [{"id": 1, "title": "t", "content": "本文", "similarity": 0.9}]
+    embeddings = {"質問": [1.0, 0.0] + [0.0] * 766, "質問？": [1.0, 0.05] + [0.0] * 766}
+
+    with patch.object(rag, "search_similar_documents", return_value=docs) as search, \
+            patch.object(rag, "generate_embedding", side_effect=lambda text: embeddings[text]):
+        first = rag.query("質問")
+        second = rag.query("質問？")
+        rag.db.get_corpus_version.return_value = 2
+        third = rag.query("質問？")
+
+    assert first["cached"] is False and second["cached"] is True and third["cached"] is False
+    assert second["answer"] == "回答"
+    assert rag.generator.generate.call_count == 2
+    assert search.call_count == 2
+
+def test_hybrid_search_fuses_lexical_and_vector_results():
+    """ハイブリッド検索で語彙検索だけにヒットしたチャンクも重みに応じて上位に入ること"""
+    from unittest.mock import patch
+
+    rag = _make_rag()
+    rag.retrieval_table = "document_chunks"
+    rag.db.has_trgm = True
+    query_vector = np.array([1.0, 0.0])
+    vector_hits = [{"chunk_id": 1, "id": 10, "similarity": 0.9}, {"chunk_id": 2, "id": 10, "similarity": 0.8}]
+    lexical_hits = [{"chunk_id": 3, "id": 11, "embedding": [0.6, 0.8], "lexical_score": 5},
+                    {"chunk_id": 2, "id": 10, "embedding": [0.8, 0.6], "lexical_score": 3}]
+    rag.db.search_lexical.return_value = lexical_hits
+
+    with patch.object(rag, "_vector_search", return_value=vector_hits) as vector_search, \
+            patch("rag_system.Config.MMR_ENABLED", False):
+        balanced = rag.search_similar_documents("E1234 の対処", top_k=2, query_vector=query_vector)
+        lexical_first = rag.search_similar_documents(
+            "E1234 の対処", top_k=2, query_vector=query_vector,
+            search_options={"vector_weight": 0.0, "lexical_weight": 1.0, "candidates": 5})
+
+    assert [doc["chunk_id"] for doc in balanced] == [2, 1]
+    assert [doc["chunk_id"] for doc in lexical_first] == [3, 2]
+    assert lexical_first[0]["similarity"] == pytest.approx(0.6)
+    assert vector_search.call_args[0][1] == 5
+    rag.db.search_lexical.assert_called_with("E1234 の対処", 5, "document_chunks", None)
+
+def test_hybrid_search_falls_back_to_lexical_when_embedding_fails():
+    """クエリの埋め込みに失敗した（ゼロベクトル）場合はベクトル検索をせず、語彙検索の結果だけを返すこと"""
+    from unittest.mock import MagicMock, patch
+
+    rag = _make_rag()
+    rag.retrieval_table = "document_chunks"
+    rag.db.has_trgm = True
+    rag.db.get_corpus_version.return_value = 1
+    rag.embedder = MagicMock(remote=True)
+    rag.embedder.embed.side_effect = RuntimeError("quota exceeded")
+    rag.embedding_cache = MagicMock()
+    rag.embedding_cache.get.return_value = None
+    rag.generator = MagicMock()
+    rag.generator.generate.return_value = "回答"
+    lexical_hits = [{"chunk_id": 3, "id": 11, "title": "t", "content": "E1234 の対処",
+                     "embedding": [0.6, 0.8], "lexical_score": 5}]
+    rag.db.search_lexical.return_value = lexical_hits
+    arbitrary = [{"chunk_id": 9, "id": 12, "title": "t", "content": "無関係", "similarity": 0.0}]
+
+    with patch.object(rag, "_vector_search", return_value=arbitrary) as vector_search, \
+            patch("rag_system.Config.MMR_ENABLED", False):
+        results = rag.search_similar_documents("E1234 の対処", top_k=2, search_options={"mode": "hybrid"})
+        # 回答キャッシュの確認で作ったゼロベクトルを渡された場合も同じ
+        with patch("rag_system.Config.ANSWER_CACHE_ENABLED", True):
+            result = rag.query("E1234 の対処", search_options={"mode": "hybrid"})
+
+    vector_search.assert_not_called()
+    assert [doc["chunk_id"] for doc in results] == [3]
+    assert [source["id"] for source in result["sources"]] == [11]
+
+def test_filtered_search_without_pgvector_searches_only_matching_chunks():
+    """pgvector 非対応時の絞り込み検索が、条件に合うIDの範囲だけをメモリ常駐インデックスで検索すること"""
+    from unittest.mock import MagicMock, patch
+
+    rag = _make_rag()
+    rag.retrieval_table = "document_chunks"
+    rag.vector_index = MagicMock()
+    rag.vector_index.search_subset.return_value = [(7, 0.8)]
+    rag.db.get_filtered_ids.return_value = [7, 8]
+    rag.db.get_chunks_by_ids.return_value = [{"chunk_id": 7, "id": 3, "title": "t", "content": "c"}]
+    filters = {"metadata": {"product": "A"}}
+
+    with patch.object(rag, "_sync_vector_index"), patch("rag_system.Config.MMR_ENABLED", False):
+        results = rag.search_similar_documents("質問", top_k=2, query_vector=np.array([1.0, 0.0]), filters=filters)
+
+    rag.db.get_filtered_ids.assert_called_once_with(filters, table="document_chunks")
+    rag.vector_index.search.assert_not_called()
+    assert rag.vector_index.search_subset.call_args[0][1:] == (2, [7, 8])
+    assert results[0]["similarity"] == 0.8
+
+def test_mmr_reranking_skips_near_duplicates():
+    """MMR が有効なとき、上位のほぼ同じチャンクより別の内容のチャンクを選ぶこと"""
+    from unittest.mock import patch
+
+    rag = _make_rag()
+    rag.retrieval_table = "document_chunks"
+    query_vector = np.array([1.0, 0.0, 0.0])
+    candidates = [
+        {"chunk_id": 1, "id": 1, "embedding": [0.9, 0.42, 0.0], "similarity": 0.9},
+        {"chunk_id": 2, "id": 2, "embedding": [0.9, 0.43, 0.01], "similarity": 0.9},
+        {"chunk_id": 3, "id": 3, "embedding": [0.8, -0.6, 0.0], "similarity": 0.8},
+    ]
+
+    with patch.object(rag, "_vector_search", return_value=[dict(c) for c in candidates]) as vector_search:
+        diverse = rag.search_similar_documents("q", top_k=2, query_vector=query_vector,
+                                               search_options={"mode": "vector", "mmr_lambda": 0.5, "mmr_candidates": 10})
+        plain = rag.search_similar_documents("q", top_k=2, query_vector=query_vector,
+                                             search_options={"mode": "vector", "mmr_lambda": 1.0})
+
+    assert [doc["chunk_id"] for doc in diverse] == [1, 3]
+    assert vector_search.call_args_list[0][0][1] == 10
+    assert [doc["chunk_id"] for doc in plain] == [1, 2]
+    assert vector_search.call_args_list[1][0][1] == 2
+
+def test_query_reports_stage_timings():
+    """query が段階ごとの処理時間・候補数・プロンプトの大きさを timings に返すこと"""
+    from unittest.mock import MagicMock, patch
+    from config import Config
+
+    rag = _make_rag()
+    rag.generator = MagicMock()
+    rag.generator.generate.return_value = "回答"
+    rag.retrieval_table = "documents"
+    rag.db.has_pgvector = True
+    rag.db.search_documents.return_value = [
+        {"id": 1, "title": "t1", "content": "本文1", "embedding": np.eye(768)[0]},
+        {"id": 2, "title": "t2", "content": "本文2", "embedding": np.eye(768)[1]}]
+
+    with patch.object(Config, "ANSWER_CACHE_ENABLED", False), patch.object(Config, "MMR_ENABLED", False), \
+            patch.object(rag, "generate_embedding", return_value=list(np.eye(768)[0])):
+        result = rag.query("質問")
+
+    timings = result["timings"]
+    assert set(timings) >= {"embed_ms", "search_ms", "pack_ms", "generate_ms", "total_ms",
+                            "candidates", "prompt_chars", "prompt_tokens"}
+    assert timings["candidates"] == 2
+    assert timings["prompt_chars"] == len(rag.generator.generate.call_args.args[0])
+    assert timings["total_ms"] >= timings["search_ms"] + timings["generate_ms"]
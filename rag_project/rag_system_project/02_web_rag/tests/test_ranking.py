@@ -0,0 +1,31 @@
+import numpy as np
+from ranking import maximal_marginal_relevance, reciprocal_rank_fusion
+from lexical import extract_search_terms, like_pattern
+
+def test_reciprocal_rank_fusion_sums_weighted_reciprocal_ranks():
+    """両方の結果に現れた項目が上位になり、重み0の結果は無視されること"""
+    vector = [{"id": 1}, {"id": 2}, {"id": 3}]
+    lexical = [{"id": 2, "lexical_score": 9}, {"id": 3, "lexical_score": 4}]
+
+    fused = reciprocal_rank_fusion([vector, lexical], [1.0, 1.0], key=lambda item: item["id"], k=60)
+    assert [item["id"] for item in fused] == [2, 3, 1]
+    assert fused[0]["rrf_score"] == 1 / 62 + 1 / 61
+    assert fused[0]["lexical_score"] == 9
+
+    vector_only = reciprocal_rank_fusion([vector, lexical], [1.0, 0.0], key=lambda item: item["id"], k=60)
+    assert [item["id"] for item in vector_only] == [1, 2, 3]
+
+def test_extract_search_terms_splits_japanese_by_script():
+    """単語分割器なしで型番・カタカナ語・漢字語を取り出し、ひらがなと1文字の語を除くこと"""
+    terms = extract_search_terms("エラーコードＥ１２３４が出た時の対処方法は？")
+    assert terms == ["エラーコード", "E1234", "対処方法"]
+    assert like_pattern("50%_off") == "%50\\%\\_off%"
+
+def test_maximal_marginal_relevance_trades_relevance_for_diversity():
+    """lambda=1 では類似度順、小さくすると重複した候補より異なる候補を先に選ぶこと"""
+    query = np.array([1.0, 0.0])
+    vectors = np.array([[1.0, 0.1], [1.0, 0.12], [0.7, -0.7]])
+
+    assert maximal_marginal_relevance(query, vectors, 3, 1.0) == [0, 1, 2]
+    assert maximal_marginal_relevance(query, vectors, 2, 0.5) == [0, 2]
+    assert maximal_marginal_relevance(query, vectors[:0], 2, 0.5) == []
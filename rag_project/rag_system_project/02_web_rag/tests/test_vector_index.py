@@ -0,0 +1,132 @@
+import pytest
+import numpy as np
+from unittest.mock import patch
+from config import Config
+from vector_index import VectorIndex, IVFIndex
+
+def _random_vectors(n, dimension=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n, dimension)).astype(np.float32)
+
+def test_vector_index_matches_brute_force():
+    """正規化済みクエリでの内積検索が総当たりのコサイン類似度順と一致すること"""
+    vectors = _random_vectors(50)
+    index = VectorIndex(dimension=8)
+    index.build(list(range(1, 51)), vectors)
+
+    query = _random_vectors(1, seed=1)[0]
+    query /= np.linalg.norm(query)
+    hits = index.search(query, top_k=5)
+
+    expected = vectors @ query / np.linalg.norm(vectors, axis=1)
+    expected_ids = [int(i) + 1 for i in np.argsort(-expected)[:5]]
+    assert [doc_id for doc_id, _ in hits] == expected_ids
+    assert hits[0][1] == pytest.approx(float(expected.max()), rel=1e-5)
+
+def test_vector_index_incremental_add_and_remove():
+    """追加・削除がインデックスに即時反映されること"""
+    vectors = _random_vectors(3)
+    index = VectorIndex(dimension=8)
+    index.build([], [])
+    for doc_id, vector in zip([10, 20, 30], vectors):
+        index.add(doc_id, vector)
+    assert len(index) == 3
+    assert index.search(vectors[1], top_k=1)[0][0] == 20
+
+    assert index.remove(20) is True
+    assert index.remove(20) is False
+    assert len(index) == 2
+    assert 20 not in [doc_id for doc_id, _ in index.search(vectors[1], top_k=3)]
+    # 末尾から移動した行も正しく検索できること
+    assert index.search(vectors[2], top_k=1)[0][0] == 30
+
+def test_vector_index_empty():
+    """空のインデックスは空の結果を返すこと"""
+    index = VectorIndex(dimension=8)
+    assert index.search(np.ones(8), top_k=3) == []
+
+def _clustered_vectors(n_clusters=20, per_cluster=50, dimension=16, seed=0):
+    """クラスタ構造を持つ正規化済みベクトルを生成"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dimension))
+    vectors = np.repeat(centers, per_cluster, axis=0) + 0.1 * rng.normal(size=(n_clusters * per_cluster, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+def test_ivf_index_recall_against_brute_force():
+    """IVFインデックスの上位k件が総当たりの結果とほぼ一致すること"""
+    vectors = _clustered_vectors()
+    ids = list(range(1, len(vectors) + 1))
+    with patch.object(Config, 'IVF_MIN_TRAIN_SIZE', 100):
+        index = IVFIndex(dimension=16, n_lists=20, nprobe=4)
+        index.build(ids, vectors)
+    assert index.list_count == 20
+
+    flat = VectorIndex(dimension=16)
+    flat.build(ids, vectors)
+    recalls = []
+    for query in vectors[::97]:
+        expected = {doc_id for doc_id, _ in flat.search(query, 10)}
+        found = {doc_id for doc_id, _ in index.search(query, 10)}
+        recalls.append(len(expected & found) / 10)
+    assert np.mean(recalls) >= 0.9
+
+def test_ivf_index_small_corpus_is_exact():
+    """学習件数に満たない間はリスト1つの厳密検索になること"""
+    vectors = _random_vectors(30, dimension=16)
+    index = IVFIndex(dimension=16)
+    index.build(list(range(30)), vectors)
+    assert index.centroids is None
+    assert index.search(vectors[7], top_k=1)[0][0] == 7
+
+def test_ivf_index_incremental_and_retrain_threshold():
+    """学習後の追加・削除が反映され、件数の増加で再学習が必要になること"""
+    vectors = _clustered_vectors(n_clusters=5, per_cluster=20)
+    with patch.object(Config, 'IVF_MIN_TRAIN_SIZE', 50), patch.object(Config, 'IVF_RETRAIN_GROWTH', 1.5):
+        index = IVFIndex(dimension=16, n_lists=5, nprobe=5)
+        index.build(list(range(100)), vectors)
+        assert not index.needs_retrain()
+
+        index.add(1000, vectors[3])
+        assert 1000 in [doc_id for doc_id, _ in index.search(vectors[3], top_k=2)]
+        assert index.remove(1000) is True
+        assert index.remove(1000) is False
+
+        for i in range(51):
+            index.add(2000 + i, vectors[i])
+        assert index.needs_retrain()
+
+def test_ivf_index_save_and_load(tmp_path):
+    """保存したインデックスを読み込むと同じ検索結果になること"""
+    vectors = _clustered_vectors()
+    with patch.object(Config, 'IVF_MIN_TRAIN_SIZE', 100):
+        index = IVFIndex(dimension=16, n_lists=10, nprobe=3)
+        index.build(list(range(len(vectors))), vectors)
+    path = str(tmp_path / "ivf.npz")
+    index.save(path, signature=(len(vectors), len(vectors) - 1))
+
+    loaded, signature = IVFIndex.load(path, nprobe=3)
+    assert signature == (len(vectors), len(vectors) - 1)
+    assert len(loaded) == len(index)
+    assert loaded.list_count == 10
+    query = vectors[123]
+    assert loaded.search(query, 5) == index.search(query, 5)
+
+def test_search_subset_returns_top_k_within_allowed_ids():
+    """絞り込み検索が許可されたIDだけから、件数が足りる限り top_k 件を返すこと"""
+    vectors = _random_vectors(200)
+    ids = list(range(1, 201))
+    allowed = [5, 17, 42, 99, 150, 999]
+    query = vectors[16] / np.linalg.norm(vectors[16])
+
+    flat = VectorIndex(dimension=8)
+    flat.build(ids, vectors)
+    ivf = IVFIndex(dimension=8, n_lists=8, nprobe=1)
+    with patch.object(Config, 'IVF_MIN_TRAIN_SIZE', 10):
+        ivf.build(ids, vectors)
+
+    for index in (flat, ivf):
+        hits = index.search_subset(query, 3, allowed)
+        assert len(hits) == 3
+        assert hits[0][0] == 17
+        assert {doc_id for doc_id, _ in hits} <= set(allowed)
@@ -69,3 +69,120 @@ def test_static_files(client):
     response = client.get('/static/js/script.js')
     assert response.status_code == 200
     assert b'function' in response.data or b'document' in response.data
+
+def test_query_stream_endpoint_emits_sse():
+    """/api/query/stream が出典とテキストを SSE のイベントとして返すこと"""
+    from unittest.mock import patch
+    import web_app
+
+    events = [("sources", [{"id": 1, "title": "t", "similarity": 0.5, "preview": "p"}]),
+              ("token", "こんにちは"), ("done", "こんにちは")]
+    with patch.object(web_app.Config, 'GOOGLE_API_KEY', 'test-key'), \
+            patch('rag_system.RAGSystem') as rag_class:
+        rag_class.return_value.answer_question_stream.return_value = iter(events)
+        client = web_app.create_app().test_client()
+        response = client.post('/api/query/stream', data=json.dumps({'question': 'q'}),
+                               content_type='application/json')
+        body = response.get_data(as_text=True)
+
+    assert response.mimetype == 'text/event-stream'
+    assert body.index('event: sources') < body.index('event: token') < body.index('event: done')
+    assert '"text": "こんにちは"' in body
+
+def test_documents_post_enqueues_job():
+    """文書追加が202とジョブIDを返し、埋め込みはリクエスト内で行わないこと"""
+    from unittest.mock import patch
+    import web_app
+
+    with patch.object(web_app.Config, 'GOOGLE_API_KEY', 'test-key'), \
+            patch.object(web_app.Config, 'INGEST_QUEUE_ENABLED', True), \
+            patch('rag_system.RAGSystem') as rag_class:
+        rag = rag_class.return_value
+        rag.db.enqueue_ingest_job.return_value = 42
+        client = web_app.create_app().test_client()
+        response = client.post('/api/documents', data=json.dumps({'title': 't', 'content': 'c'}),
+                               content_type='application/json')
+
+    assert response.status_code == 202
+    assert json.loads(response.data)['job_id'] == 42
+    rag.add_documents.assert_not_called()
+    rag.add_document.assert_not_called()
+
+def test_documents_post_adds_synchronously_by_default():
+    """既定ではジョブのキューを使わず、worker が無くてもリクエスト内で文書を追加すること"""
+    import os
+    import subprocess
+    import sys
+    from unittest.mock import patch
+    import web_app
+
+    env = {key: value for key, value in os.environ.items() if key != 'INGEST_QUEUE_ENABLED'}
+    default = subprocess.run([sys.executable, '-c', 'from config import Config; print(Config.INGEST_QUEUE_ENABLED)'],
+                             env=env, capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert default.stdout.strip() == 'False'
+
+    with patch.object(web_app.Config, 'GOOGLE_API_KEY', 'test-key'), \
+            patch.object(web_app.Config, 'INGEST_QUEUE_ENABLED', False), \
+            patch('rag_system.RAGSystem') as rag_class:
+        rag = rag_class.return_value
+        rag.add_documents.return_value = [{'success': True, 'document_id': 5, 'error': None}]
+        client = web_app.create_app().test_client()
+        response = client.post('/api/documents', data=json.dumps({'title': 't', 'content': 'c'}),
+                               content_type='application/json')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)['document_id'] == 5
+    rag.db.enqueue_ingest_job.assert_not_called()
+
+def test_documents_post_rejects_blank_content():
+    """空白だけのタイトル・本文を含むリクエストはジョブを登録せずに400を返すこと"""
+    from unittest.mock import patch
+    import web_app
+
+    with patch.object(web_app.Config, 'GOOGLE_API_KEY', 'test-key'), \
+            patch('rag_system.RAGSystem') as rag_class:
+        client = web_app.create_app().test_client()
+        response = client.post('/api/documents', data=json.dumps(
+            {'documents': [{'title': 't', 'content': 'c'}, {'title': 't', 'content': '   '}]}),
+            content_type='application/json')
+
+    assert response.status_code == 400
+    rag_class.return_value.db.enqueue_ingest_job.assert_not_called()
+
+def test_query_passes_filters_and_rejects_invalid_ones():
+    """/api/query が filters を検索まで渡し、不正な filters は400を返すこと"""
+    from unittest.mock import patch
+    import web_app
+
+    with patch.object(web_app.Config, 'GOOGLE_API_KEY', 'test-key'), \
+            patch('rag_system.RAGSystem') as rag_class:
+        rag = rag_class.return_value
+        rag.query.return_value = {'answer': 'a', 'sources': [], 'cached': False}
+        client = web_app.create_app().test_client()
+        response = client.post('/api/query', content_type='application/json', data=json.dumps(
+            {'question': 'q', 'filters': {'title': '製品A', 'metadata': {'product': 'A'}}}))
+        invalid = client.post('/api/query', content_type='application/json', data=json.dumps(
+            {'question': 'q', 'filters': {'metadata': 'A'}}))
+
+    assert response.status_code == 200
+    assert rag.query.call_args.kwargs['filters'] == {'title': '製品A', 'metadata': {'product': 'A'}}
+    assert invalid.status_code == 400
+
+def test_query_returns_timings_only_when_requested():
+    """timings はリクエストの timings フラグか X-RAG-Timings ヘッダーがある時だけ返すこと"""
+    from unittest.mock import patch
+    import web_app
+
+    with patch.object(web_app.Config, 'GOOGLE_API_KEY', 'test-key'), \
+            patch('rag_system.RAGSystem') as rag_class:
+        rag_class.return_value.query.return_value = {
+            'answer': 'a', 'sources': [], 'cached': False, 'timings': {'total_ms': 12.5}}
+        client = web_app.create_app().test_client()
+        plain = client.post('/api/query', json={'question': 'q'})
+        flagged = client.post('/api/query', json={'question': 'q', 'timings': True})
+        header = client.post('/api/query', json={'question': 'q'}, headers={'X-RAG-Timings': '1'})
+
+    assert 'timings' not in plain.get_json()
+    assert flagged.get_json()['timings'] == {'total_ms': 12.5}
+    assert header.get_json()['timings'] == {'total_ms': 12.5}
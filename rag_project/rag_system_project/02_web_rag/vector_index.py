@@ -0,0 +1,349 @@
+import logging
+import os
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class VectorIndex:
+    """pgvector が使えない環境向けのメモリ常駐ベクトルインデックス
+    
+    全文書のベクトルを連続した float32 行列に、対応する文書IDを配列に保持します。
+    行は格納時に単位長へ正規化するため、検索は内積（行列ベクトル積1回）と
+    argpartition による上位k件の選択だけで済みます。pgvector の `<#>` と同じ順位になります。
+    """
+    
+    def __init__(self, dimension: int = Config.EMBEDDING_DIMENSION):
+        self.dimension = dimension
+        self._matrix = np.zeros((0, dimension), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._positions: Dict[int, int] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """各行を単位長に正規化します（ゼロベクトルはそのまま）"""
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+    
+    def build(self, ids: List[int], embeddings: List[Any], normalized: bool = False):
+        """インデックスを全件から作り直します（normalized=True なら正規化を省略）"""
+        if len(ids):
+            matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), self.dimension)
+            if not normalized:
+                matrix = self._normalize(matrix)
+        else:
+            matrix = np.zeros((0, self.dimension), dtype=np.float32)
+        with self._lock:
+            self._matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            self._ids = np.asarray(ids, dtype=np.int64)
+            self._positions = {int(doc_id): row for row, doc_id in enumerate(self._ids)}
+            self._size = len(self._ids)
+    
+    def ids(self) -> List[int]:
+        """格納している文書IDの一覧を返します"""
+        with self._lock:
+            return self._ids[:self._size].tolist()
+    
+    def export(self) -> Tuple[np.ndarray, np.ndarray]:
+        """格納している (文書ID配列, 正規化済み行列) のコピーを返します"""
+        with self._lock:
+            return self._ids[:self._size].copy(), self._matrix[:self._size].copy()
+    
+    def get_vectors(self, ids: List[int]) -> Dict[int, np.ndarray]:
+        """指定IDの正規化済みベクトルのコピーを返します（格納していないIDは含みません）"""
+        with self._lock:
+            return {doc_id: self._matrix[self._positions[doc_id]].copy()
+                    for doc_id in ids if doc_id in self._positions}
+    
+    def add(self, doc_id: int, embedding: List[float]):
+        """1件追加します（既存IDの場合はベクトルを置き換えます）"""
+        vector = self._normalize(np.asarray(embedding, dtype=np.float32).reshape(self.dimension))
+        with self._lock:
+            row = self._positions.get(doc_id)
+            if row is None:
+                if self._size == len(self._matrix):
+                    # 容量を倍々で確保し、追加ごとの全体コピーを避ける
+                    capacity = max(16, 2 * len(self._matrix))
+                    matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+                    matrix[:self._size] = self._matrix[:self._size]
+                    ids = np.zeros(capacity, dtype=np.int64)
+                    ids[:self._size] = self._ids[:self._size]
+                    self._matrix, self._ids = matrix, ids
+                row = self._size
+                self._size += 1
+                self._positions[doc_id] = row
+                self._ids[row] = doc_id
+            self._matrix[row] = vector
+    
+    def remove(self, doc_id: int) -> bool:
+        """1件削除します。末尾の行で穴を埋めるため O(次元数) で済みます"""
+        with self._lock:
+            row = self._positions.pop(doc_id, None)
+            if row is None:
+                return False
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                self._positions[moved_id] = row
+            self._size = last
+            return True
+    
+    def search(self, query_embedding: List[float], top_k: int) -> List[Tuple[int, float]]:
+        """内積の大きい順に (文書ID, 類似度) を最大 top_k 件返します
+        
+        クエリは正規化済みであることを前提とし、ここではノルムを計算しません。
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(self.dimension)
+        with self._lock:
+            if self._size == 0 or top_k <= 0:
+                return []
+            scores = self._matrix[:self._size] @ query
+            order = self._top_k(scores, top_k)
+            return [(int(self._ids[row]), float(scores[row])) for row in order]
+    
+    def search_subset(self, query_embedding: List[float], top_k: int, ids: List[int]) -> List[Tuple[int, float]]:
+        """ids に含まれる文書だけを対象に、内積の大きい順に最大 top_k 件返します（絞り込み検索用）"""
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(self.dimension)
+        with self._lock:
+            rows = np.fromiter((self._positions[doc_id] for doc_id in ids if doc_id in self._positions),
+                               dtype=np.int64)
+            if len(rows) == 0 or top_k <= 0:
+                return []
+            scores = self._matrix[rows] @ query
+            order = self._top_k(scores, top_k)
+            return [(int(self._ids[rows[i]]), float(scores[i])) for i in order]
+    
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """スコアの大きい順に最大 top_k 個の位置を返します"""
+        k = min(top_k, len(scores))
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class IVFIndex:
+    """k-means で分割した転置リスト型（IVF）のベクトルインデックス
+    
+    pgvector が使えない環境で、数千件を超えるコーパスを総当たりせずに検索するためのものです。
+    重心は正規化済みベクトルに対する球面 k-means で学習し、各転置リストは VectorIndex で保持します。
+    検索時はクエリに近い nprobe 個のリストだけを調べます。学習後の追加・削除は最寄りのリストへ
+    反映し、件数が学習時の IVF_RETRAIN_GROWTH 倍を超えたら needs_retrain() が True になります。
+    件数が IVF_MIN_TRAIN_SIZE 未満の間はリスト1つ（＝総当たりと同じ厳密検索）で動作します。
+    """
+    
+    def __init__(self, dimension: int = Config.EMBEDDING_DIMENSION, n_lists: int = Config.IVF_NLISTS,
+                 nprobe: int = Config.IVF_NPROBE):
+        self.dimension = dimension
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self._lists: List[VectorIndex] = [VectorIndex(dimension)]
+        self._assignments: Dict[int, int] = {}
+        self._lock = threading.RLock()
+    
+    def __len__(self) -> int:
+        return len(self._assignments)
+    
+    @property
+    def list_count(self) -> int:
+        return len(self._lists)
+    
+    def ids(self) -> List[int]:
+        """格納している文書IDの一覧を返します"""
+        with self._lock:
+            return list(self._assignments)
+    
+    def export(self) -> Tuple[np.ndarray, np.ndarray]:
+        """全リストの (文書ID配列, 正規化済み行列) を連結して返します"""
+        with self._lock:
+            parts = [inverted.export() for inverted in self._lists]
+        ids = np.concatenate([part[0] for part in parts]) if parts else np.zeros(0, dtype=np.int64)
+        matrix = np.concatenate([part[1] for part in parts]) if parts else np.zeros((0, self.dimension), dtype=np.float32)
+        return ids, matrix
+    
+    def needs_retrain(self) -> bool:
+        """学習し直すべき件数に達したかどうか"""
+        size = len(self)
+        if self.centroids is None:
+            return size >= Config.IVF_MIN_TRAIN_SIZE
+        return size > self.trained_size * Config.IVF_RETRAIN_GROWTH
+    
+    @staticmethod
+    def _nearest_lists(matrix: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+        """各行に最も近い重心の番号を返します（メモリ節約のため分割して計算）"""
+        labels = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), chunk_size):
+            labels[start:start + chunk_size] = np.argmax(matrix[start:start + chunk_size] @ centroids.T, axis=1)
+        return labels
+    
+    def _kmeans(self, samples: np.ndarray, n_lists: int, iterations: int, rng) -> np.ndarray:
+        """正規化済みサンプルに球面 k-means を適用し、単位長の重心を返します"""
+        centroids = samples[rng.choice(len(samples), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(samples @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, samples)
+            counts = np.bincount(labels, minlength=n_lists)
+            # 空になったクラスタはランダムなサンプルで置き直す
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                sums[empty] = samples[rng.choice(len(samples), len(empty), replace=False)]
+            centroids = VectorIndex._normalize(sums)
+        return centroids.astype(np.float32)
+    
+    def build(self, ids: List[int], embeddings: List[Any], normalized: bool = False,
+              iterations: int = 20, seed: int = 0):
+        """全件から重心を学習し、転置リストを作り直します"""
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), self.dimension)
+        if not normalized and len(ids):
+            matrix = VectorIndex._normalize(matrix)
+        ids = np.asarray(ids, dtype=np.int64)
+        
+        if len(ids) < Config.IVF_MIN_TRAIN_SIZE:
+            centroids = None
+            labels = np.zeros(len(ids), dtype=np.int64)
+        else:
+            n_lists = self.n_lists or max(1, int(np.sqrt(len(ids))))
+            n_lists = min(n_lists, len(ids))
+            rng = np.random.default_rng(seed)
+            sample_size = min(len(ids), n_lists * Config.IVF_TRAIN_SAMPLES_PER_LIST)
+            samples = matrix[rng.choice(len(ids), sample_size, replace=False)]
+            centroids = self._kmeans(samples, n_lists, iterations, rng)
+            labels = self._nearest_lists(matrix, centroids)
+        
+        self._load_lists(centroids, ids, matrix, labels)
+        self.trained_size = len(ids)
+        logger.info("IVFインデックスを構築しました: %d 件 / %d リスト", len(ids), len(self._lists))
+    
+    def _load_lists(self, centroids: Optional[np.ndarray], ids: np.ndarray, matrix: np.ndarray, labels: np.ndarray):
+        """割り当て済みのベクトルから転置リストを組み立てます"""
+        n_lists = 1 if centroids is None else len(centroids)
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(n_lists + 1))
+        lists = []
+        for list_no in range(n_lists):
+            rows = order[bounds[list_no]:bounds[list_no + 1]]
+            inverted = VectorIndex(self.dimension)
+            inverted.build(ids[rows].tolist(), matrix[rows], normalized=True)
+            lists.append(inverted)
+        with self._lock:
+            self.centroids = centroids
+            self._lists = lists
+            self._assignments = {int(doc_id): int(label) for doc_id, label in zip(ids, labels)}
+    
+    def add(self, doc_id: int, embedding: List[float]):
+        """1件を最寄りの転置リストへ追加します（既存IDは置き換え）"""
+        vector = VectorIndex._normalize(np.asarray(embedding, dtype=np.float32).reshape(self.dimension))
+        with self._lock:
+            self.remove(doc_id)
+            list_no = 0 if self.centroids is None else int(np.argmax(self.centroids @ vector))
+            self._lists[list_no].add(doc_id, vector)
+            self._assignments[doc_id] = list_no
+    
+    def remove(self, doc_id: int) -> bool:
+        """1件削除します"""
+        with self._lock:
+            list_no = self._assignments.pop(doc_id, None)
+            if list_no is None:
+                return False
+            return self._lists[list_no].remove(doc_id)
+    
+    def search(self, query_embedding: List[float], top_k: int, nprobe: int = None) -> List[Tuple[int, float]]:
+        """クエリに近い nprobe 個のリストを調べ、内積の大きい順に最大 top_k 件返します"""
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(self.dimension)
+        with self._lock:
+            if self.centroids is None:
+                probed = [self._lists[0]]
+            else:
+                probe = min(nprobe or self.nprobe, len(self._lists))
+                scores = self.centroids @ query
+                nearest = np.argpartition(-scores, probe - 1)[:probe] if probe < len(scores) else np.arange(len(scores))
+                probed = [self._lists[list_no] for list_no in nearest]
+        
+        hits = []
+        for inverted in probed:
+            hits.extend(inverted.search(query, top_k))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+    
+    def get_vectors(self, ids: List[int]) -> Dict[int, np.ndarray]:
+        """指定IDの正規化済みベクトルのコピーを返します（格納していないIDは含みません）"""
+        vectors: Dict[int, np.ndarray] = {}
+        with self._lock:
+            for doc_id in ids:
+                list_no = self._assignments.get(doc_id)
+                if list_no is not None:
+                    vectors.update(self._lists[list_no].get_vectors([doc_id]))
+        return vectors
+    
+    def search_subset(self, query_embedding: List[float], top_k: int, ids: List[int]) -> List[Tuple[int, float]]:
+        """ids に含まれる文書だけを対象に厳密に検索します（絞り込み後の件数に関係なく top_k 件まで返します）"""
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(self.dimension)
+        with self._lock:
+            members: Dict[int, List[int]] = {}
+            for doc_id in ids:
+                list_no = self._assignments.get(doc_id)
+                if list_no is not None:
+                    members.setdefault(list_no, []).append(doc_id)
+            targets = [(self._lists[list_no], list_ids) for list_no, list_ids in members.items()]
+        
+        hits = []
+        for inverted, list_ids in targets:
+            hits.extend(inverted.search_subset(query, top_k, list_ids))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+    
+    def save(self, path: str, signature: Tuple[int, int] = None):
+        """インデックスをファイルへ保存します（一時ファイルに書いてから置き換え）"""
+        with self._lock:
+            parts = [inverted.export() for inverted in self._lists]
+            centroids = self.centroids if self.centroids is not None else np.zeros((0, self.dimension), dtype=np.float32)
+            trained_size = self.trained_size
+        counts = np.array([len(part[0]) for part in parts], dtype=np.int64)
+        ids = np.concatenate([part[0] for part in parts])
+        matrix = np.concatenate([part[1] for part in parts])
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, centroids=centroids, ids=ids, vectors=matrix, counts=counts,
+                     trained_size=np.int64(trained_size),
+                     signature=np.asarray(signature if signature else (-1, -1), dtype=np.int64))
+        os.replace(temp_path, path)
+        logger.info("IVFインデックスを保存しました: %s（%d 件）", path, len(ids))
+    
+    @classmethod
+    def load(cls, path: str, nprobe: int = Config.IVF_NPROBE):
+        """保存済みのインデックスを読み込み、(インデックス, 保存時のシグネチャ) を返します
+        
+        ベクトルは正規化済みのまま保存しているため、読み込み時は学習も正規化も行いません。
+        """
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            ids = data["ids"]
+            matrix = data["vectors"]
+            counts = data["counts"]
+            trained_size = int(data["trained_size"])
+            signature = tuple(int(v) for v in data["signature"])
+        
+        index = cls(dimension=matrix.shape[1], n_lists=len(centroids), nprobe=nprobe)
+        labels = np.repeat(np.arange(len(counts)), counts)
+        index._load_lists(centroids if len(centroids) else None, ids, matrix, labels)
+        index.trained_size = trained_size
+        return index, (None if signature == (-1, -1) else signature)
@@ -3,17 +3,128 @@
 RAGシステムのWebインターフェース - GitHub/クラウド対応版
 """
 import os
+import json
+import logging
+import time
 from datetime import datetime
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, stream_with_context
+import metrics
 import rag_system
-from config import Config
+from config import Config, SEARCH_MODES
+from logging_config import setup_logging
 
 # .envファイルから環境変数を読み込み
 load_dotenv()
 
-def create_app():
-    """アプリケーションファクトリパターン"""
+logger = logging.getLogger(__name__)
+
+def parse_search_options(raw):
+    """リクエストの search オブジェクトを検証し、RAGSystem に渡す検索オプションにします
+    
+    不正な値の場合は ValueError を送出します。
+    """
+    if raw is None:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError('search はオブジェクトで指定してください')
+    unknown = set(raw) - {'mode', 'vector_weight', 'lexical_weight', 'candidates', 'mmr_lambda', 'mmr_candidates'}
+    if unknown:
+        raise ValueError(f"search に未対応のキーがあります: {', '.join(sorted(unknown))}")
+    
+    options = {}
+    if 'mode' in raw:
+        if raw['mode'] not in SEARCH_MODES:
+            raise ValueError(f"search.mode は {', '.join(SEARCH_MODES)} のいずれかで指定してください")
+        options['mode'] = raw['mode']
+    for key in ('vector_weight', 'lexical_weight'):
+        if key in raw:
+            value = raw[key]
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f'search.{key} は0以上の数値で指定してください')
+            options[key] = float(value)
+    for key in ('candidates', 'mmr_candidates'):
+        if key in raw:
+            value = raw[key]
+            if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 200:
+                raise ValueError(f'search.{key} は1〜200の整数で指定してください')
+            options[key] = value
+    if 'mmr_lambda' in raw:
+        value = raw['mmr_lambda']
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value <= 1:
+            raise ValueError('search.mmr_lambda は0以上1以下の数値で指定してください')
+        options['mmr_lambda'] = float(value)
+    return options or None
+
+def parse_filters(raw):
+    """リクエストの filters オブジェクトを検証し、検索対象の絞り込み条件にします
+    
+    title はタイトルの部分一致、metadata はメタデータに含まれるべきキーと値です。
+    不正な値の場合は ValueError を送出します。
+    """
+    if raw is None:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError('filters はオブジェクトで指定してください')
+    unknown = set(raw) - {'title', 'metadata'}
+    if unknown:
+        raise ValueError(f"filters に未対応のキーがあります: {', '.join(sorted(unknown))}")
+    
+    filters = {}
+    title = raw.get('title')
+    if title is not None:
+        if not isinstance(title, str):
+            raise ValueError('filters.title は文字列で指定してください')
+        if title.strip():
+            filters['title'] = title.strip()
+    metadata = raw.get('metadata')
+    if metadata is not None:
+        if not isinstance(metadata, dict):
+            raise ValueError('filters.metadata はオブジェクトで指定してください')
+        if metadata:
+            filters['metadata'] = metadata
+    return filters or None
+
+def timings_requested(data, headers=None) -> bool:
+    """処理時間の内訳（timings）を応答に含めるか（リクエストの "timings": true か X-RAG-Timings ヘッダー）"""
+    if isinstance(data, dict) and data.get('timings') is True:
+        return True
+    headers = request.headers if headers is None else headers
+    return headers.get('X-RAG-Timings', '').lower() in ('1', 'true')
+
+def query_response_body(question, result):
+    """/api/query の成功時の応答（timings は呼び出し側で必要な場合だけ加えます）"""
+    return {
+        'success': True,
+        'question': question,
+        'answer': result['answer'],
+        'sources': result.get('sources', []),
+        'cached': result.get('cached', False),
+        'context_usage': result.get('context_usage'),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def format_stream_event(question, event, payload) -> str:
+    """answer_question_stream の (イベント名, データ) を Server-Sent Events の1イベントにします"""
+    if event == 'sources':
+        body = {'question': question, 'sources': payload}
+    elif event == 'token':
+        body = {'text': payload}
+    elif event == 'done':
+        body = {'answer': payload, 'timestamp': datetime.now().isoformat()}
+    else:
+        body = {'error': payload}
+    return f"event: {event}\ndata: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+# ストリーミング応答のヘッダー（プロキシでのバッファリングを止め、断片が届いた時点でクライアントへ流す）
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+def create_app(rag=None):
+    """アプリケーションファクトリパターン（rag を渡すとそのインスタンスを使います）"""
+    setup_logging()
     app = Flask(__name__, static_folder="static", template_folder="templates")
     
     # Flask設定
@@ -21,27 +132,48 @@ def create_app():
     app.config['DEBUG'] = Config.DEBUG
     
     # RAGシステムのインスタンス（アプリケーション内で共有）
-    rag_instance = None
+    rag_instance = rag
     
     def get_rag_instance():
         """RAGシステムのインスタンスを取得（初期化済みでない場合は初期化）"""
         nonlocal rag_instance
         if rag_instance is None:
             api_key = Config.GOOGLE_API_KEY
-            if not api_key:
-                print("エラー: GOOGLE_API_KEYが設定されていません")
+            if not api_key and Config.uses_gemini():
+                logger.error("GOOGLE_API_KEYが設定されていません")
                 return None
             
             try:
-                print(f"RAGシステムを初期化中... API Key: {api_key[:4] if len(api_key) > 8 else 'SHORT'}...")
+                logger.info("RAGシステムを初期化中...")
                 rag_instance = rag_system.RAGSystem(api_key)
-                print("✅ RAGシステムの初期化が完了しました")
+                logger.info("RAGシステムの初期化が完了しました")
                 return rag_instance
-            except Exception as e:
-                print(f"❌ RAGシステムの初期化に失敗しました: {e}")
+            except Exception:
+                logger.exception("RAGシステムの初期化に失敗しました")
                 return None
         return rag_instance
 
+    @app.before_request
+    def start_request_timer():
+        """リクエストの処理時間の計測を始めます"""
+        g.request_started = time.monotonic()
+
+    @app.after_request
+    def record_request_metrics(response):
+        """ルートごとのリクエスト数と処理時間を記録します（ラベルはURLではなくルートの定義）"""
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.HTTP_REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+        started = g.get('request_started')
+        if started is not None:
+            metrics.HTTP_LATENCY.labels(request.method, route).observe(time.monotonic() - started)
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Prometheus 形式のメトリクス（gunicorn の全ワーカー分を集約）"""
+        body, content_type = metrics.render()
+        return Response(body, content_type=content_type)
+
     # ヘルスチェックエンドポイント
     @app.route('/health')
     def health_check():
@@ -67,23 +199,86 @@ def create_app():
                 'error': 'RAGシステムが初期化されていません'
             }), 500
         
+        # ページング・列指定（埋め込みは既定で読まず、本文はプレビューのみ返す）
+        try:
+            limit = int(request.args.get('limit', Config.DOCUMENT_PAGE_SIZE))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'limitは整数で指定してください'
+            }), 400
+        limit = max(1, min(limit, Config.DOCUMENT_PAGE_SIZE_MAX))
+        cursor = request.args.get('cursor') or None
+        fields = request.args.get('fields', 'id,title,preview,content_length,metadata,created_at')
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        
+        try:
+            page = rag.list_documents(limit=limit, cursor=cursor, fields=fields)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
         try:
-            documents = rag.get_all_documents()
+            documents = page['documents']
+            for doc in documents:
+                if isinstance(doc.get('created_at'), datetime):
+                    doc['created_at'] = doc['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+                if 'embedding' in doc and doc['embedding'] is not None and not isinstance(doc['embedding'], list):
+                    doc['embedding'] = [float(value) for value in doc['embedding']]
             return jsonify({
                 'success': True,
                 'documents': documents,
-                'count': len(documents)
+                'count': len(documents),
+                'total': rag.get_document_count(),
+                'next_cursor': page['next_cursor'],
+                'has_more': page['has_more']
             })
         except Exception as e:
-            print(f"文書取得エラー: {e}")
+            logger.exception("文書取得エラー", extra={'route': request.path})
             return jsonify({
                 'success': False,
                 'error': f'文書の取得に失敗しました: {str(e)}'
             }), 500
 
+    @app.route('/api/documents/count', methods=['GET'])
+    def get_document_count():
+        """文書数を取得（mode=cached|exact|estimate）"""
+        rag = get_rag_instance()
+        if not rag:
+            return jsonify({
+                'success': False,
+                'error': 'RAGシステムが初期化されていません'
+            }), 500
+        
+        mode = request.args.get('mode', 'cached')
+        if mode not in ('cached', 'exact', 'estimate'):
+            return jsonify({
+                'success': False,
+                'error': 'modeはcached・exact・estimateのいずれかで指定してください'
+            }), 400
+        
+        count = rag.get_document_count(mode)
+        if count < 0:
+            return jsonify({
+                'success': False,
+                'error': '文書数の取得に失敗しました'
+            }), 500
+        return jsonify({
+            'success': True,
+            'count': count,
+            'mode': mode
+        })
+
     @app.route('/api/documents', methods=['POST'])
     def add_document():
-        """新しい文書を追加"""
+        """新しい文書を追加
+        
+        INGEST_QUEUE_ENABLED の場合は文書追加ジョブを登録して 202 とジョブIDを返し、
+        埋め込み・挿入は worker プロセス（ingest_worker.py）が行います。
+        {"documents": [...]} で複数の文書をまとめて1つのジョブにできます。
+        """
         rag = get_rag_instance()
         if not rag:
             return jsonify({
@@ -92,30 +287,84 @@ def create_app():
             }), 500
         
         data = request.json
-        if not data or 'title' not in data or 'content' not in data:
+        documents = data.get('documents') if isinstance(data, dict) and 'documents' in data else [data]
+        if not isinstance(documents, list) or not documents or not all(
+                rag_system.is_valid_document(doc) for doc in documents):
             return jsonify({
                 'success': False,
                 'error': 'タイトルと内容は必須です'
             }), 400
+        documents = [
+            {'title': doc['title'], 'content': doc['content'], 'metadata': doc.get('metadata', {})}
+            for doc in documents
+        ]
+        
+        if Config.INGEST_QUEUE_ENABLED:
+            job_id = rag.db.enqueue_ingest_job(documents)
+            if job_id is None:
+                return jsonify({
+                    'success': False,
+                    'error': '文書追加ジョブの登録に失敗しました'
+                }), 500
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': f'/api/jobs/{job_id}',
+                'message': '文書の追加を受け付けました'
+            }), 202
         
         try:
-            document_id = rag.add_document(
-                title=data['title'],
-                content=data['content'],
-                metadata=data.get('metadata', {})
-            )
+            results = rag.add_documents(documents)
+            failed = [result for result in results if not result['success']]
+            if failed:
+                return jsonify({
+                    'success': False,
+                    'error': f"文書の追加に失敗しました: {failed[0]['error']}"
+                }), 500
             return jsonify({
                 'success': True,
-                'document_id': document_id,
+                'document_id': results[0]['document_id'],
+                'document_ids': [result['document_id'] for result in results],
                 'message': '文書が正常に追加されました'
             })
         except Exception as e:
-            print(f"文書追加エラー: {e}")
+            logger.exception("文書追加エラー", extra={'route': request.path})
             return jsonify({
                 'success': False,
                 'error': f'文書の追加に失敗しました: {str(e)}'
             }), 500
 
+    @app.route('/api/jobs/<int:job_id>', methods=['GET'])
+    def get_job(job_id):
+        """文書追加ジョブの状態と進捗を取得"""
+        rag = get_rag_instance()
+        if not rag:
+            return jsonify({
+                'success': False,
+                'error': 'RAGシステムが初期化されていません'
+            }), 500
+        
+        job = rag.db.get_ingest_job(job_id)
+        if job is None:
+            return jsonify({
+                'success': False,
+                'error': f'ジョブ ID {job_id} が見つかりません'
+            }), 404
+        
+        results = job.pop('results') or []
+        for key in ('created_at', 'updated_at', 'finished_at'):
+            if isinstance(job.get(key), datetime):
+                job[key] = job[key].strftime('%Y-%m-%d %H:%M:%S')
+        job['document_ids'] = [result['document_id'] for result in results if result and result.get('document_id')]
+        job['errors'] = [
+            {'index': index, 'error': result['error']}
+            for index, result in enumerate(results) if result and result.get('error')
+        ]
+        return jsonify({
+            'success': True,
+            'job': job
+        })
+
     @app.route('/api/documents/<int:document_id>', methods=['DELETE'])
     def delete_document(document_id):
         """指定されたIDの文書を削除"""
@@ -139,7 +388,7 @@ def create_app():
                     'error': f'文書ID {document_id} が見つかりません'
                 }), 404
         except Exception as e:
-            print(f"文書削除エラー: {e}")
+            logger.exception("文書削除エラー", extra={'route': request.path})
             return jsonify({
                 'success': False,
                 'error': f'文書の削除に失敗しました: {str(e)}'
@@ -163,20 +412,65 @@ def create_app():
             }), 400
         
         try:
-            result = rag.query(data['question'])
+            search_options = parse_search_options(data.get('search'))
+            filters = parse_filters(data.get('filters'))
+        except ValueError as e:
             return jsonify({
-                'success': True,
-                'answer': result['answer'],
-                'sources': result.get('sources', []),
-                'timestamp': datetime.now().isoformat()
-            })
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        try:
+            result = rag.query(data['question'], search_options=search_options, filters=filters)
+            body = query_response_body(data['question'], result)
+            if timings_requested(data):
+                body['timings'] = result.get('timings')
+                logger.info("クエリの処理時間", extra={'route': request.path, 'timings': body['timings']})
+            return jsonify(body)
         except Exception as e:
-            print(f"クエリエラー: {e}")
+            logger.exception("クエリエラー", extra={'route': request.path})
             return jsonify({
                 'success': False,
                 'error': f'質問の処理に失敗しました: {str(e)}'
             }), 500
 
+    @app.route('/api/query/stream', methods=['POST'])
+    def query_stream():
+        """質問に対する回答を Server-Sent Events で逐次返す
+        
+        sources（出典）→ token（生成テキストの断片、複数回）→ done の順にイベントを送ります。
+        失敗時は error イベントを送って終了します。
+        """
+        rag = get_rag_instance()
+        if not rag:
+            return jsonify({
+                'success': False,
+                'error': 'RAGシステムが初期化されていません'
+            }), 500
+        
+        data = request.json
+        if not data or 'question' not in data:
+            return jsonify({
+                'success': False,
+                'error': '質問が指定されていません'
+            }), 400
+        question = data['question']
+        try:
+            search_options = parse_search_options(data.get('search'))
+            filters = parse_filters(data.get('filters'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        def generate():
+            for event, payload in rag.answer_question_stream(question, search_options=search_options,
+                                                              filters=filters):
+                yield format_stream_event(question, event, payload)
+        
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
     @app.route('/api/test', methods=['GET'])
     def test_endpoint():
         """テスト用エンドポイント"""
@@ -187,6 +481,8 @@ def create_app():
             'config': {
                 'debug': Config.DEBUG,
                 'has_api_key': bool(Config.GOOGLE_API_KEY),
+                'embedding_provider': Config.EMBEDDING_PROVIDER,
+                'generation_provider': Config.GENERATION_PROVIDER,
                 'db_host': Config.DB_HOST,
                 'db_name': Config.DB_NAME
             },
@@ -217,176 +513,3 @@ if __name__ == '__main__':
     
     # デバッグモード無効で起動
     app.run(debug=False, host='0.0.0.0', port=5000)
-
-@app.route('/')
-def index():
-    """メインページ"""
-    return render_template('index.html')
-
-@app.route('/api/documents', methods=['GET'])
-def get_documents():
-    """文書一覧を取得"""
-    rag_instance = get_rag_instance()
-    if not rag_instance:
-        return jsonify({
-            'success': False,
-            'error': 'RAGシステムが初期化されていません'
-        }), 500
-    
-    try:
-        documents = rag_instance.list_all_documents()
-        
-        # 埋め込みベクトルを除外して日時を文字列に変換
-        for doc in documents:
-            doc.pop('embedding', None)
-            if 'created_at' in doc and isinstance(doc['created_at'], datetime):
-                doc['created_at'] = doc['created_at'].strftime('%Y-%m-%d %H:%M:%S')
-        
-        return jsonify({
-            'success': True,
-            'documents': documents,
-            'count': len(documents)
-        })
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': f'文書取得エラー: {str(e)}'
-        }), 500
-
-@app.route('/api/documents', methods=['POST'])
-def add_document():
-    """新しい文書を追加"""
-    rag_instance = get_rag_instance()
-    if not rag_instance:
-        return jsonify({
-            'success': False,
-            'error': 'RAGシステムが初期化されていません'
-        }), 500
-    
-    data = request.json
-    title = data.get('title', '')
-    content = data.get('content', '')
-    metadata = data.get('metadata', {})
-    
-    if not title or not content:
-        return jsonify({
-            'success': False,
-            'error': 'タイトルと本文は必須です'
-        }), 400
-    
-    try:
-        success = rag_instance.add_document(title, content, metadata)
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'message': f'文書「{title}」が正常に追加されました'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': '文書の追加に失敗しました'
-            }), 500
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': f'文書追加エラー: {str(e)}'
-        }), 500
-
-@app.route('/api/documents/<int:document_id>', methods=['DELETE'])
-def delete_document(document_id):
-    """指定されたIDの文書を削除"""
-    rag_instance = get_rag_instance()
-    if not rag_instance:
-        return jsonify({
-            'success': False,
-            'error': 'RAGシステムが初期化されていません'
-        }), 500
-    
-    try:
-        success = rag_instance.db.delete_document(document_id)
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'message': f'文書ID {document_id} が正常に削除されました'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': f'文書ID {document_id} が見つからないか、削除に失敗しました'
-            }), 404
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': f'文書削除エラー: {str(e)}'
-        }), 500
-
-@app.route('/api/query', methods=['POST'])
-def query():
-    """質問に対する回答を生成"""
-    rag_instance = get_rag_instance()
-    if not rag_instance:
-        return jsonify({
-            'success': False,
-            'error': 'RAGシステムが初期化されていません'
-        }), 500
-    
-    data = request.json
-    question = data.get('question', '')
-    
-    if not question:
-        return jsonify({
-            'success': False,
-            'error': '質問が入力されていません'
-        }), 400
-    
-    try:
-        print(f"質問を受信: {question}")
-        answer = rag_instance.answer_question(question)
-        print(f"回答を生成: {answer[:100]}...")  # 最初の100文字をログ出力
-        return jsonify({
-            'success': True,
-            'answer': answer,
-            'question': question,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
-    except Exception as e:
-        print(f"質問応答エラー: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'success': False,
-            'error': f'回答生成エラー: {str(e)}'
-        }), 500
-
-@app.route('/api/test', methods=['GET'])
-def test_endpoint():
-    """テスト用エンドポイント"""
-    rag_instance = get_rag_instance()
-    
-    return jsonify({
-        'success': True,
-        'message': 'APIが正常に動作しています',
-        'rag_initialized': rag_instance is not None,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    })
-
-if __name__ == '__main__':
-    print("============================================================")
-    print("🚀 RAG System - Webアプリケーション (完全版)")
-    print("============================================================")
-    
-    # 設定確認
-    if Config.GOOGLE_API_KEY:
-        print(f"✅ GOOGLE_API_KEY: 設定済み ({Config.GOOGLE_API_KEY[:4]}...{Config.GOOGLE_API_KEY[-4:]})")
-    else:
-        print("❌ GOOGLE_API_KEY: 未設定")
-        
-    print(f"📊 DB設定: {Config.DB_HOST}:{Config.DB_PORT}/{Config.DB_NAME}")
-    print(f"📁 作業ディレクトリ: {os.getcwd()}")
-    print(f"🌐 URL: http://localhost:5000")
-    print("============================================================")
-    
-    # デバッグモード無効で起動
-    app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file